@@ -0,0 +1,179 @@
+# Timer-driven acquisition of the ADC channels.
+# A periodic machine.Timer samples every channel at a fixed rate into one preallocated ring per
+# channel, and stamps each sample with time.ticks_us() in a ring of its own. The callback only
+# reads the ADCs and stores small ints into arrays, so it allocates nothing and may run as a
+# hard IRQ. The sensor helpers take their readings from the rings instead of the ADC: the
+# newest sample, the mean of the samples since they last looked, or the last few as a burst.
+#
+# Sample k of every channel sits at index k % capacity. `count` is bumped last, so a reader
+# that reads it first only sees complete samples; one that falls a whole ring behind gets the
+# oldest samples still there. Sample numbers are counted modulo COUNT_MASK + 1 (as in spsc.py),
+# so they stay small ints and a tick never allocates, however long the board runs; the
+# capacity is a power of two so the slots stay in step when they wrap, and readers only ever
+# look at the difference of two numbers.
+#
+#   acquisition = Acquisition((thermistor, light_sensor, ir_sensor), rate_hz=200)
+#   acquisition.start()
+#   acquisition.latest(2)
+#
+# frame() packs the samples for one live view (the /ws WebSocket) as
+#   FRAME_HEADER "<IHBB"  number of the first sample (uint32), samples per channel (uint16),
+#                         stride (uint8), channels (uint8)
+# followed by the samples of each channel in turn (uint16, little endian). The 8-byte header
+# keeps the samples 2-byte aligned, so the browser can read them with one Uint16Array.
+
+import struct
+from array import array
+
+from hardware import machine, time
+
+FRAME_HEADER = "<IHBB"
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER)
+
+COUNT_MASK = 0x3fffffff # sample numbers modulo this, so they stay small ints
+
+
+class Acquisition:
+  def __init__(self, adcs, rate_hz=200, capacity=256):
+    if capacity <= 0 or capacity & (capacity - 1):
+      raise ValueError("capacity must be a power of two")
+    self.adcs = tuple(adcs)
+    self.reads = tuple(adc.read_u16 for adc in self.adcs)
+    self.rate_hz = rate_hz
+    self.capacity = capacity
+    self.mask = capacity - 1
+    self.rings = tuple(array("H", bytes(2 * capacity)) for _ in self.adcs)
+    self.stamps = array("I", bytes(4 * capacity)) # ticks_us of each sample
+    self.count = 0 # number of the next sample (modulo COUNT_MASK + 1); it goes to count % capacity
+    self.full = False # the rings have gone round once: every slot holds a sample
+    self.timer = None
+    self.running = False
+    self.tick = self._tick # bound once, so arming the timer allocates nothing per sample
+
+  def _tick(self, timer=None):
+    i = self.count & self.mask
+    rings = self.rings
+    reads = self.reads
+    for c in range(len(reads)):
+      rings[c][i] = reads[c]()
+    self.stamps[i] = time.ticks_us() & 0x3fffffff
+    if i == self.mask:
+      self.full = True
+    self.count = (self.count + 1) & COUNT_MASK
+
+  def start(self, timer=None):
+    self.count = 0
+    self.full = False
+    self.timer = timer or self.timer or machine.Timer(-1)
+    self.running = True
+    self.timer.init(mode=machine.Timer.PERIODIC, freq=self.rate_hz, callback=self.tick)
+
+  def stop(self):
+    if self.timer:
+      self.timer.deinit()
+    self.running = False
+
+  def held(self):
+    """How many samples the rings hold."""
+    return self.capacity if self.full else self.count
+
+  def behind(self, since, end):
+    """How many samples sample number `since` is before `end`, at most held(). A number past
+    `end` (e.g. from before a restart) counts as 0 behind."""
+    n = (end - since) & COUNT_MASK
+    if n > COUNT_MASK // 2:
+      return 0
+    held = self.held()
+    return n if n < held else held
+
+  def latest(self, channel):
+    """Newest sample of a channel (0 before the first one)."""
+    n = self.count
+    return self.rings[channel][(n - 1) & self.mask] if n or self.full else 0
+
+  def mean(self, channel, since):
+    """Mean of the samples of a channel from number `since` on.
+
+    Returns (mean, number of the next sample) so the caller can pass that back next time. With
+    no new samples the mean is the newest sample.
+    """
+    end = self.count
+    n = self.behind(since, end)
+    if not n:
+      return self.latest(channel), end
+    ring = self.rings[channel]
+    mask = self.mask
+    total = 0
+    for k in range(end - n, end):
+      total += ring[k & mask]
+    return total // n, end
+
+  def recent(self, channel, out):
+    """Copy the newest len(out) samples of a channel into `out`. Returns how many there were."""
+    end = self.count
+    n = min(len(out), self.held())
+    ring = self.rings[channel]
+    for j in range(n):
+      out[j] = ring[(end - n + j) & self.mask]
+    return n
+
+  def frame(self, cursor, stride, buf, channels, limit):
+    """Pack every `stride`-th sample of `channels` from number `cursor` on into `buf`.
+
+    At most `limit` samples per channel: a viewer further behind than that skips ahead to the
+    newest ones (cursor None starts there). Returns (bytes packed, cursor for the next frame);
+    0 bytes when there is nothing new.
+    """
+    end = self.count
+    behind = limit * stride if cursor is None else self.behind(cursor, end)
+    if behind > limit * stride:
+      behind = limit * stride
+    held = self.held()
+    if behind > held:
+      behind = held
+    cursor = (end - behind) & COUNT_MASK
+    n = behind // stride
+    if n <= 0:
+      return 0, cursor
+    struct.pack_into(FRAME_HEADER, buf, 0, cursor, n, stride, len(channels))
+    offset = FRAME_HEADER_SIZE
+    mask = self.mask
+    for c in channels:
+      ring = self.rings[c]
+      k = cursor
+      for _ in range(n):
+        struct.pack_into("<H", buf, offset, ring[k & mask])
+        offset += 2
+        k += stride
+    return offset, (cursor + n * stride) & COUNT_MASK
+
+  def stats(self):
+    """Achieved rate and timing jitter, worked out from the sample stamps still in the ring.
+
+    The achieved rate is over the samples in the ring. Jitter is how far each interval between
+    two samples was from the nominal period: the mean and the largest deviation, in microseconds.
+    """
+    end = self.count
+    held = self.held()
+    period_us = 1000000 // self.rate_hz
+    deviation = 0
+    worst = 0
+    intervals = 0
+    span = 0
+    stamps = self.stamps
+    mask = self.mask
+    for k in range(end - held + 1, end):
+      gap = (stamps[k & mask] - stamps[(k - 1) & mask]) & 0x3fffffff
+      d = gap - period_us if gap > period_us else period_us - gap
+      deviation += d
+      if d > worst:
+        worst = d
+      intervals += 1
+      span += gap
+    return {
+      "rate_hz": self.rate_hz,
+      "achieved_hz": round(intervals * 1000000 / span, 1) if self.running and span > 0 else 0.0,
+      "samples": end,
+      "jitter_mean_us": deviation // intervals if intervals else 0,
+      "jitter_max_us": worst,
+    }
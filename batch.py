@@ -0,0 +1,193 @@
+# Pipelined batch runner for several plates.
+# Every stage of the stage table is a station that holds one plate at a time. Plates are fed in
+# order and move on as soon as their stage is done and the next station is free, so plate k+1
+# can be saturating while plate k is being sprayed or scanned. A stage that is done but blocked
+# by a busy next station is not checked again; the plate just waits there.
+#
+# BatchRunner has the same start()/step()/notify() interface as stages.StageEngine, so the
+# runners in stages.py (thread, asyncio task, timer) drive it unchanged, and it stops on a
+# stages.Abort the same way: every plate still in a station is marked "stopped".
+
+from hardware import time
+
+
+class Plate:
+  """Progress and result record of one plate."""
+
+  def __init__(self, id):
+    self.id = id
+    self.stage = None # name of the stage the plate is in, None before loading
+    self.index = -1
+    self.entered = 0
+    self.ready = False # current stage done, waiting for the next station
+    self.started = None # ms since the batch started
+    self.finished = None
+    self.failed = None # name of the stage that timed out
+    self.result = None
+    self.durations = [] # (stage name, ms spent in it, including waiting for the next station)
+
+  def summary(self):
+    return {
+      "id": self.id,
+      "stage": self.failed and "failed" or self.stage or "queued",
+      "result": self.result,
+      "started_ms": self.started,
+      "finished_ms": self.finished,
+    }
+
+
+class BatchRunner:
+  """Runs `count` plates through `stages` with overlapping stages.
+
+  on_leave(plate, stage) is called as a plate leaves each stage, also when the stage timed out.
+  on_finish(plate) is called once a plate is through, failed or stopped (see plate.failed),
+  e.g. to record its result.
+  """
+
+  def __init__(self, stages, count, on_leave=None, first_id=1, abort=None, on_finish=None):
+    self.stages = stages
+    self.abort = abort
+    self.aborted = None
+    self.stop_us = None
+    self.plates = [Plate(first_id + i) for i in range(count)]
+    self.queue = list(self.plates)
+    self.stations = [None] * len(stages)
+    self.on_leave = on_leave
+    self.on_finish = on_finish
+    self.listeners = [] # called with the runner after every plate movement
+    self.started = 0
+    self.finished = False
+    self.done_count = 0
+    self.busy_us = 0
+    self.idle_ms = 0
+    self.wake = False
+    self.wakeup = None
+
+  def start(self):
+    self.started = time.ticks_ms()
+    if self.abort is not None:
+      self.abort.engine = self
+
+  def notify(self):
+    self.wake = True
+    if self.wakeup:
+      self.wakeup()
+
+  def elapsed_ms(self):
+    return time.ticks_diff(time.ticks_ms(), self.started)
+
+  def plates_per_hour(self):
+    elapsed = self.elapsed_ms()
+    return self.done_count * 3600000 / elapsed if elapsed > 0 else 0.0
+
+  def _leave(self, plate, stage, now):
+    plate.durations.append((stage.name, time.ticks_diff(now, plate.entered)))
+    if stage.leave:
+      stage.leave()
+    if self.on_leave:
+      self.on_leave(plate, stage)
+
+  def _enter(self, plate, index, now):
+    self.stations[index] = plate
+    plate.index = index
+    plate.stage = self.stages[index].name
+    plate.entered = now
+    plate.ready = False
+    if plate.started is None:
+      plate.started = time.ticks_diff(now, self.started)
+    stage = self.stages[index]
+    if stage.enter:
+      stage.enter()
+
+  def _finish(self, plate, now, failed=None):
+    self.stations[plate.index] = None
+    plate.finished = time.ticks_diff(now, self.started)
+    plate.failed = failed
+    plate.stage = "done" if failed is None else failed
+    if failed is None:
+      self.done_count += 1
+    if self.on_finish:
+      self.on_finish(plate)
+
+  def _stop(self, now):
+    abort = self.abort
+    if abort.safe:
+      abort.safe()
+    self.aborted = abort.reason
+    self.stop_us = time.ticks_diff(time.ticks_us(), abort.at_us)
+    for plate in self.stations:
+      if plate is not None:
+        plate.durations.append((plate.stage, time.ticks_diff(now, plate.entered)))
+        self._finish(plate, now, failed="stopped")
+    self.queue = []
+    self.finished = True
+    for listener in self.listeners:
+      listener(self)
+
+  def step(self):
+    """Advance every plate that can move. Returns ms until the next step, or -1 when all are done."""
+    t0 = time.ticks_us()
+    self.wake = False
+    now = time.ticks_ms()
+    if self.abort is not None and self.abort.set:
+      self._stop(now)
+      return -1
+    wait = 1 << 30
+    moved = False
+    last = len(self.stages) - 1
+    # Walk the stations from the end so a plate leaving frees its station for the one behind it.
+    for i in range(last, -1, -1):
+      plate = self.stations[i]
+      if plate is None:
+        continue
+      stage = self.stages[i]
+      elapsed = time.ticks_diff(now, plate.entered)
+      if not plate.ready:
+        if elapsed < stage.hold_ms:
+          wait = min(wait, stage.hold_ms - elapsed)
+          continue
+        if stage.done is None or stage.done():
+          plate.ready = True
+        elif stage.timeout_ms is not None and elapsed >= stage.timeout_ms:
+          self._leave(plate, stage, now)
+          self._finish(plate, now, failed=stage.name)
+          moved = True
+          continue
+        else:
+          wait = min(wait, stage.poll_ms)
+          continue
+      if i == last:
+        self._leave(plate, stage, now)
+        self._finish(plate, now)
+        moved = True
+      elif self.stations[i + 1] is None:
+        self._leave(plate, stage, now)
+        self.stations[i] = None
+        self._enter(plate, i + 1, now)
+        moved = True
+        wait = 0 # the new stage may need checking straight away
+      else:
+        wait = min(wait, stage.poll_ms) # blocked: look again once the next station may be free
+    if self.stations[0] is None and self.queue:
+      self._enter(self.queue.pop(0), 0, now)
+      moved = True
+      wait = 0
+    if moved:
+      for listener in self.listeners:
+        listener(self)
+    self.busy_us += time.ticks_diff(time.ticks_us(), t0)
+    if not self.queue and all(p is None for p in self.stations):
+      self.finished = True
+      return -1
+    if wait > 0:
+      self.idle_ms += wait
+    return wait
+
+  def summary(self):
+    return {
+      "plates": [p.summary() for p in self.plates],
+      "done": self.done_count,
+      "elapsed_ms": self.elapsed_ms(),
+      "plates_per_hour": self.plates_per_hour(),
+      "stopped": self.aborted,
+    }
@@ -0,0 +1 @@
+# Host-side benchmarks. Run them from the repository root, e.g. `python -m benchmarks.bench_core`.
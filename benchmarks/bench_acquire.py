@@ -0,0 +1,101 @@
+# Sample timing of the sensors: the helpers reading the ADCs themselves from the experiment
+# thread versus the timer-driven acquisition engine (acquire.py) at several rates. Each run
+# goes through the saturation stage in real time with the thermistor warming up at FRONT_AT, and
+# reports the achieved thermistor sample rate, the jitter of the sample intervals against the
+# nominal period, ADC reads per second and how long after the warm-up the spray LED came on.
+# tick_us is the cost of one acquisition callback (all three channels).
+#
+#   python -m benchmarks.bench_acquire [--json out.json] [--compare baseline.json]
+
+import sys
+import threading
+import time
+
+import sim
+import acquire
+import stages
+from benchmarks import harness
+
+import chromatography as app
+
+FRONT_AT = 1.0 # s, thermistor warms up
+RUN_S = 2.0
+RATES = (100, 200, 500, 1000)
+
+
+def waveforms():
+  sim.reset()
+  sim.clock.virtual = False
+  sim.feed(27, 6000) # paper in position straight away
+  sim.feed(26, sim.script((FRONT_AT, 30000), (1, 32000)))
+  sim.feed(28, 20000)
+
+
+def jitter(stamps, period_s):
+  gaps = [b - a for a, b in zip(stamps, stamps[1:])]
+  deviations = sorted(abs(g - period_s) * 1000000 for g in gaps)
+  return {
+    "achieved_hz": len(gaps) / (stamps[-1] - stamps[0]) if len(gaps) > 1 else 0.0,
+    "jitter_mean_us": sum(deviations) / len(deviations) if deviations else 0.0,
+    "jitter_p99_us": harness.percentile(deviations, 0.99),
+    "jitter_max_us": deviations[-1] if deviations else 0.0,
+  }
+
+
+def first_on(pin, since=0.0):
+  for t, v in sim.pins[pin].writes:
+    if v and t >= since:
+      return t
+  return None
+
+
+def run(rate):
+  """One run through saturation; rate 0 leaves sampling to the helpers."""
+  waveforms()
+  adcs = (app.thermistor, app.light_sensor, app.ir_sensor)
+  reads0 = sum(adc.reads for adc in adcs)
+  stamps = []
+  read = app.thermistor.read_u16
+  app.thermistor.read_u16 = lambda: stamps.append(time.perf_counter()) or read()
+  acquisition = app.acquisition = acquire.Acquisition(adcs, rate or 1)
+  try:
+    if rate:
+      acquisition.start(sim.Timer())
+    engine = app.new_experiment()
+    with harness.quiet():
+      worker = threading.Thread(target=stages.run, args=(engine,), daemon=True)
+      worker.start()
+      time.sleep(RUN_S)
+      stats = acquisition.stats() if rate else None
+      app.abort.trigger("benchmark")
+      worker.join(1)
+  finally:
+    acquisition.stop()
+    del app.thermistor.read_u16
+    app.abort.clear()
+  result = jitter(stamps, 1 / (rate or app.THERMISTOR_HZ))
+  result["adc_reads_per_s"] = (sum(adc.reads for adc in adcs) - reads0) / RUN_S
+  spraying = first_on(15, FRONT_AT) # actuator LED 1
+  result["front_latency_us"] = (spraying - FRONT_AT) * 1000000 if spraying else -1
+  if stats:
+    result["engine_achieved_hz"] = stats["achieved_hz"]
+    result["engine_jitter_mean_us"] = stats["jitter_mean_us"]
+  return result
+
+
+def main(argv=None):
+  args = harness.parser("Ad hoc sensor reads versus timer-driven acquisition").parse_args(argv)
+  saved = app.acquisition
+  try:
+    results = {"helpers": run(0)}
+    for rate in RATES:
+      results["timer_%d_hz" % rate] = run(rate)
+  finally:
+    app.acquisition = saved
+  probe = acquire.Acquisition((app.thermistor, app.light_sensor, app.ir_sensor), 200)
+  results["tick"] = {"tick_us": harness.measure(probe.tick, args.repeat or 10000)["median_us"]}
+  return harness.report(results, args)
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,100 @@
+# Time to first response after a "reset": chromatography.py is started in a fresh interpreter
+# (tools/loadtest.py's local server, on the simulated backend) while a client keeps asking for
+# /status until it gets an answer. Reported per server mode: the median time from starting the
+# process to the first answer and to the board being ready, and the boot timeline from /boot of
+# the last start (ms since the interpreter's clock started; the interpreter start-up itself is
+# in first_response_ms but not in the timeline).
+#
+#   python -m benchmarks.bench_boot [--repeat 5] [--json out.json] [--compare baseline.json]
+
+import json
+import multiprocessing
+import socket
+import statistics
+import sys
+import time
+
+from benchmarks import harness
+from tools.loadtest import serve_local
+
+DEADLINE_S = 20.0
+
+
+def get(port, path, timeout=1.0):
+  """GET `path` on a fresh connection. Returns the body, or None if nobody answered."""
+  try:
+    conn = socket.create_connection(("127.0.0.1", port), timeout)
+  except OSError:
+    return None
+  try:
+    conn.settimeout(timeout)
+    conn.sendall(b"GET " + path + b" HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+    data = b""
+    while True:
+      chunk = conn.recv(4096)
+      if not chunk:
+        break
+      data += chunk
+  except OSError:
+    return None
+  finally:
+    conn.close()
+  head, _, body = data.partition(b"\r\n\r\n")
+  return body if head.startswith(b"HTTP/1.1 200") else None
+
+
+def start(mode):
+  with socket.socket() as s:
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+  t0 = time.perf_counter()
+  # Spawned rather than forked, so the child imports everything itself, as the board does.
+  server = multiprocessing.get_context("spawn").Process(target=serve_local, args=(port, mode), daemon=True)
+  server.start()
+  try:
+    while get(port, b"/status", 0.5) is None:
+      if time.perf_counter() - t0 > DEADLINE_S:
+        raise RuntimeError("no answer from the %s server" % mode)
+      time.sleep(0.002)
+    first = time.perf_counter() - t0
+    while True:
+      timeline = json.loads(get(port, b"/boot"))
+      if any(p["phase"] == "ready" for p in timeline["phases"]):
+        break
+      time.sleep(0.01)
+    ready = time.perf_counter() - t0
+  finally:
+    server.terminate()
+    server.join()
+  return first, ready, timeline
+
+
+def boot(mode, repeat):
+  firsts = []
+  readies = []
+  timeline = None
+  for _ in range(repeat):
+    first, ready, timeline = start(mode)
+    firsts.append(first * 1000)
+    readies.append(ready * 1000)
+  result = {
+    "first_response_ms": statistics.median(firsts),
+    "ready_ms": statistics.median(readies),
+  }
+  for p in timeline["phases"]:
+    result["phase_%s_at_ms" % p["phase"]] = p["at_ms"]
+  return result
+
+
+def main(argv=None):
+  args = harness.parser("Time from start-up to the first response").parse_args(argv)
+  repeat = args.repeat or 5
+  results = {
+    "async": boot("async", repeat),
+    "blocking": boot("blocking", repeat),
+  }
+  return harness.report(results, args)
+
+
+if __name__ == "__main__":
+  sys.exit(main())
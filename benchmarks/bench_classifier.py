@@ -0,0 +1,82 @@
+# Colour classification: the old chain of if/elif reads versus the burst + lookup classifier.
+# For each test level the light sensor is fed a noisy constant signal. Reported per classifier:
+# ADC reads per decision, decision latency and how often the decision matches the colour of the
+# noise-free level (the old code also lands in the gaps between bands and answers "void").
+#
+#   python -m benchmarks.bench_classifier [--json out.json] [--compare baseline.json]
+
+import sys
+import time
+
+import sim
+import classifier
+from benchmarks import harness
+
+LIGHT_PIN = 28
+NOISE = 400
+
+# Band centres plus levels close to edges, where reads straddling a threshold hurt most.
+LEVELS = (17000, 27700, 31950, 33700, 37000, 24800, 30600, 33200, 34200)
+
+
+def legacy_read_light_intensity(light_sensor):
+  """read_light_intensity() as it was before classifier.py, kept here as the reference."""
+  while light_sensor.read_u16() > 40000 or light_sensor.read_u16() < 10000:
+    sim.clock.sleep(0.2)
+  if (light_sensor.read_u16() >10000 and light_sensor.read_u16() <24600):
+    return "blue"
+  elif(light_sensor.read_u16() > 24600 and light_sensor.read_u16() <30800):
+    return "red-pink"
+  elif(light_sensor.read_u16() > 34350 and light_sensor.read_u16() <40000):
+    return "pink"
+  elif(light_sensor.read_u16() > 30800 and light_sensor.read_u16() <33100):
+    return "yellow"
+  elif(light_sensor.read_u16() > 33100 and light_sensor.read_u16() <34350):
+    return "white"
+  else:
+    return "void"
+
+
+def run(decide, adc, decisions):
+  reads = 0
+  correct = 0
+  void = 0
+  total_ns = 0
+  for level in LEVELS:
+    sim.reset()
+    sim.clock.virtual = True
+    sim.feed(LIGHT_PIN, sim.noisy(sim.constant(level), NOISE, seed=level))
+    truth = classifier.lookup(level)
+    adc.reads = 0
+    for _ in range(decisions):
+      t0 = time.perf_counter_ns()
+      colour = decide()
+      total_ns += time.perf_counter_ns() - t0
+      correct += colour == truth
+      void += colour == "void"
+    reads += adc.reads
+  n = decisions * len(LEVELS)
+  return {
+    "decisions": n,
+    "reads_per_decision": reads / n,
+    "mean_decision_us": total_ns / n / 1000,
+    "accuracy": correct / n,
+    "void_rate": void / n,
+  }
+
+
+def main(argv=None):
+  args = harness.parser("Colour classification: legacy reads versus burst classifier").parse_args(argv)
+  decisions = args.repeat or 500
+  adc = sim.ADC(LIGHT_PIN)
+  results = {"legacy": run(lambda: legacy_read_light_intensity(adc), adc, decisions)}
+  for samples, trim in ((8, 2), (16, 4), (16, 7), (32, 8)):
+    c = classifier.Classifier(adc, samples, trim)
+    results["burst_%d_trim_%d" % (samples, trim)] = run(c.classify, adc, decisions)
+  lookups = harness.measure(lambda: classifier.lookup(33200), 10000)
+  results["table_lookup"] = {"median_us": lookups["median_us"], "bands": len(classifier.EDGES) + 1}
+  return harness.report(results, args)
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,119 @@
+# Core benchmarks for chromatography.py under the simulated backend.
+# Times the sensor helpers, one full experiment run and the HTTP loop. The clock runs in virtual
+# mode so the sleeps inside the code under test cost nothing and only the CPU work is measured;
+# the simulated time each call would have taken on the board is reported next to it.
+#
+#   python -m benchmarks.bench_core [--json out.json] [--compare baseline.json]
+
+import sys
+
+import sim
+import httpd
+from benchmarks import harness
+
+import chromatography as app
+
+
+def plate_waveforms(light=20000):
+  """Paper arrives after 0.5 s, the solvent front warms the thermistor at 5 s, blue spot."""
+  sim.reset()
+  sim.clock.virtual = True
+  sim.feed(27, sim.script((0.5, 0), (1, 6000)))
+  sim.feed(26, sim.script((5, 30000), (1, 32000)))
+  sim.feed(28, light)
+
+
+def bench_read_light_intensity(repeat):
+  plate_waveforms()
+  reads = app.light_sensor.reads
+  t0 = sim.clock.now()
+  stats = harness.measure(app.read_light_intensity, repeat)
+  calls = repeat + 3
+  stats["adc_reads_per_call"] = (app.light_sensor.reads - reads) / calls
+  stats["sim_ms_per_call"] = (sim.clock.now() - t0) * 1000 / calls
+  return stats
+
+
+def bench_interpret_thermistor(repeat):
+  plate_waveforms()
+  t0 = sim.clock.now()
+  stats = harness.measure(app.interpret_thermistor, repeat)
+  stats["sim_ms_per_call"] = (sim.clock.now() - t0) * 1000 / (repeat + 3)
+  return stats
+
+
+def bench_experiment_sequence(repeat):
+  durations = []
+
+  def run():
+    plate_waveforms()
+    with harness.quiet():
+      app.experiment_sequence()
+    durations.append(sim.clock.now())
+
+  stats = harness.measure(run, repeat, warmup=1)
+  stats["sim_s_per_run"] = sum(durations) / len(durations)
+  return stats
+
+
+REQUESTS = [
+  b"GET / HTTP/1.1\r\nHost: 192.168.4.1\r\nAccept-Encoding: gzip, deflate\r\n\r\n",
+  b"GET /status HTTP/1.1\r\nHost: 192.168.4.1\r\n\r\n",
+]
+
+
+def bench_http_loop(repeat):
+  """Push `repeat` page loads and `repeat` status polls through serve() on fake sockets."""
+  plate_waveforms()
+  sent = []
+
+  def run():
+    listener = sim.ScriptedListener(REQUESTS * repeat)
+    with harness.quiet():
+      try:
+        app.serve(listener)
+      except sim.ListenerClosed:
+        pass
+    sent.append(sum(len(c.response()) for c in listener.accepted))
+
+  stats = harness.measure(run, 5, warmup=1)
+  requests = 2 * repeat
+  for key in ("min_us", "median_us", "mean_us", "p95_us", "max_us"):
+    stats[key] /= requests
+  stats["n"] = requests * 5
+  stats["requests_per_s"] = 1000000 / stats["median_us"]
+  stats["bytes_per_request"] = sent[-1] / requests
+  return stats
+
+
+def bench_status_poll(repeat):
+  """One /status answer: a full snapshot, and a 304 for a client that already has it."""
+  plate_waveforms()
+  app.post_status()
+  app.drain_events()
+  fresh = httpd.parse(b"GET /status HTTP/1.1\r\nHost: 192.168.4.1\r\n\r\n")
+  known = httpd.parse(b"GET /status?v=" + app.status_board.current.tag + b" HTTP/1.1\r\nHost: 192.168.4.1\r\n\r\n")
+  with harness.quiet():
+    stats = harness.measure(lambda: app.respond(fresh), repeat)
+    unchanged = harness.measure(lambda: app.respond(known), repeat)
+    stats["bytes_full"] = len(app.respond(fresh).data)
+    stats["bytes_not_modified"] = len(app.respond(known).data)
+  stats["not_modified_median_us"] = unchanged["median_us"]
+  return stats
+
+
+def main(argv=None):
+  args = harness.parser("Benchmarks for the sensor helpers, experiment and HTTP loop").parse_args(argv)
+  repeat = args.repeat or 200
+  results = {
+    "read_light_intensity": bench_read_light_intensity(repeat),
+    "interpret_thermistor": bench_interpret_thermistor(repeat),
+    "experiment_sequence": bench_experiment_sequence(max(1, repeat // 20)),
+    "http_loop": bench_http_loop(repeat),
+    "status_poll": bench_status_poll(repeat),
+  }
+  return harness.report(results, args)
+
+
+if __name__ == "__main__":
+  sys.exit(main())
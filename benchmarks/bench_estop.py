@@ -0,0 +1,150 @@
+# Emergency stop latency while the dashboard is under load.
+# The experiment runs on its own thread (as on the second core) and sits in the saturation stage
+# while client threads hammer / and /status. The stop is then raised either with a GET /?error
+# from one more client or with the push button (sim.press runs the pin IRQ handler). Two figures
+# per stop, both from the moment it was raised: when the first actuator LED was switched off
+# (its recorded pin write) and when the experiment thread had stopped. Both server modes are
+# measured, since the blocking loop only sees the stop request once it gets round to it.
+#
+#   python -m benchmarks.bench_estop [--repeat 20] [--json out.json] [--compare baseline.json]
+
+import random
+import socket
+import sys
+import threading
+import time
+
+import sim
+import stages
+from benchmarks import harness
+from benchmarks.bench_http import start_async, start_blocking, read_response
+
+import chromatography as app
+
+CLIENTS = 8
+BUTTON = 16
+SATURATING_LED = 13 # actuator LED 0, on for the whole saturation stage
+
+
+def waveforms():
+  sim.reset()
+  sim.clock.virtual = False
+  sim.feed(27, 6000) # paper in position straight away
+  sim.feed(26, 30000) # the thermistor never changes, so the run stays in saturation
+  sim.feed(28, 20000)
+
+
+def hammer(port, stop, counts):
+  done = 0
+  while not stop.is_set():
+    path = b"/" if done % 10 == 0 else b"/status"
+    try:
+      conn = socket.create_connection(("127.0.0.1", port), 2)
+      conn.sendall(b"GET " + path + b" HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+      read_response(conn.makefile("rb"))
+      conn.close()
+      done += 1
+    except OSError:
+      pass
+  counts.append(done)
+
+
+def web_stop(port):
+  conn = socket.create_connection(("127.0.0.1", port), 10)
+  conn.sendall(b"GET /?error HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+  read_response(conn.makefile("rb"))
+  conn.close()
+
+
+def button_stop(port):
+  sim.press(BUTTON)
+
+
+def wait_for(check, timeout=5.0):
+  end = time.perf_counter() + timeout
+  while not check():
+    if time.perf_counter() > end:
+      return False
+    time.sleep(0.001)
+  return True
+
+
+def first_off(pin, since):
+  for t, v in sim.pins[pin].writes:
+    if t >= since and not v:
+      return t
+  return None
+
+
+def trial(port, stop):
+  """One run, stopped at a random point of a sensor wait. Returns (safe s, stopped s) or None."""
+  app.abort.clear()
+  engine = app.new_experiment()
+  stopped = []
+  engine.listeners.append(lambda e: e.finished and not stopped and stopped.append(sim.clock.now()))
+  worker = threading.Thread(target=stages.run, args=(engine,), daemon=True)
+  worker.start()
+  if not wait_for(lambda: sim.pins[SATURATING_LED].value()):
+    return None
+  time.sleep(random.uniform(0, stages.WAIT_SLICE_MS / 1000))
+  t0 = sim.clock.now()
+  stop(port)
+  if not wait_for(lambda: stopped) or engine.aborted is None:
+    return None
+  worker.join(1)
+  off = first_off(SATURATING_LED, t0)
+  return off - t0, stopped[0] - t0
+
+
+def measure(start, stop, trials):
+  port, close = start()
+  waveforms()
+  halt = threading.Event()
+  counts = []
+  clients = [threading.Thread(target=hammer, args=(port, halt, counts), daemon=True) for _ in range(CLIENTS)]
+  t0 = time.perf_counter()
+  for c in clients:
+    c.start()
+  safe = []
+  stopped = []
+  missed = 0
+  for _ in range(trials):
+    result = trial(port, stop)
+    if result is None:
+      missed += 1
+      continue
+    safe.append(result[0] * 1000000)
+    stopped.append(result[1] * 1000000)
+  halt.set()
+  for c in clients:
+    c.join()
+  elapsed = time.perf_counter() - t0
+  close()
+  safe.sort()
+  stopped.sort()
+  return {
+    "trials": trials,
+    "missed": missed,
+    "load_requests_per_s": sum(counts) / elapsed,
+    "safe_p50_us": harness.percentile(safe, 0.5),
+    "safe_max_us": safe[-1] if safe else 0.0,
+    "stopped_p50_us": harness.percentile(stopped, 0.5),
+    "stopped_max_us": stopped[-1] if stopped else 0.0,
+  }
+
+
+def main(argv=None):
+  args = harness.parser("Emergency stop latency under dashboard load").parse_args(argv)
+  trials = args.repeat or 20
+  app.abort.button(sim.Pin(BUTTON, sim.Pin.IN, sim.Pin.PULL_UP))
+  results = {}
+  with harness.quiet():
+    for name, start in (("async", start_async), ("blocking", start_blocking)):
+      results[name + "_web"] = measure(start, web_stop, trials)
+      results[name + "_button"] = measure(start, button_stop, trials)
+  results["bound"] = {"wait_slice_us": stages.WAIT_SLICE_MS * 1000}
+  return harness.report(results, args)
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,105 @@
+# How many units one fleet collector (tools/fleet.py) can track.
+# For each fleet size, stand-in units run in a child process and the collector polls them (or
+# follows their /events) from this one for a few seconds. Reported per size: polls answered per
+# second against the number asked for, the share of units heard from within two poll intervals
+# at the end, poll latency and the collector's own CPU use. A size is tracked when every unit is
+# fresh and at least 90% of the polls asked for were answered. With --events a unit only speaks
+# when its stage changes, so it counts as fresh if heard from within one and a half stage periods.
+#
+#   python -m benchmarks.bench_fleet [--sizes 10,50,100,250] [--seconds 5] [--events]
+
+import asyncio
+import multiprocessing
+import sys
+import time
+
+from benchmarks import harness
+from tools import fleet
+
+INTERVAL = 1.0
+PERIOD = 2.0 # seconds per stand-in stage
+
+
+def run_standins(count, ports):
+  # Runs until the parent terminates it; a clean shutdown would only cancel open connections.
+  async def main():
+    standins, started = await fleet.start_standins(count, period_s=PERIOD)
+    ports.put(started)
+    while True:
+      await asyncio.sleep(3600)
+  asyncio.run(main())
+
+
+async def track(ports, seconds, events):
+  units = [fleet.Unit("unit-%d" % i, "127.0.0.1", port) for i, port in enumerate(ports)]
+  store = fleet.FleetStore(units)
+  latencies = []
+  record = store.seen
+
+  def seen(unit, latency_ms):
+    if latency_ms is not None:
+      latencies.append(latency_ms)
+    record(unit, latency_ms)
+
+  store.seen = seen
+  tasks = fleet.collectors(store, events, INTERVAL)
+  await asyncio.sleep(INTERVAL) # connections opened, first round done
+  polls0 = sum(u.polls for u in units)
+  del latencies[:]
+  cpu0 = time.process_time()
+  t0 = time.perf_counter()
+  await asyncio.sleep(seconds)
+  elapsed = time.perf_counter() - t0
+  cpu = time.process_time() - cpu0
+  now = time.time()
+  window = 1.5 * PERIOD if events else 2 * INTERVAL
+  fresh = sum(1 for u in units if u.last_seen and now - u.last_seen <= window)
+  polls = sum(u.polls for u in units) - polls0
+  for task in tasks:
+    task.cancel()
+  await asyncio.gather(*tasks, return_exceptions=True)
+  latencies.sort()
+  wanted = len(units) * elapsed / INTERVAL
+  result = {
+    "units": len(units),
+    "answers_per_s": polls / elapsed,
+    "asked_per_s": wanted / elapsed,
+    "fresh_share": fresh / len(units),
+    "updates": sum(u.updates for u in units),
+    "errors": sum(u.errors for u in units),
+    "p50_poll_us": harness.percentile(latencies, 0.5) * 1000,
+    "p95_poll_us": harness.percentile(latencies, 0.95) * 1000,
+    "collector_cpu_pct": 100 * cpu / elapsed,
+    "tracked": int(fresh == len(units) and (events or polls >= 0.9 * wanted)),
+  }
+  if events: # pushed updates carry no request latency, and nothing is asked for
+    for key in ("asked_per_s", "p50_poll_us", "p95_poll_us"):
+      del result[key]
+  return result
+
+
+def main(argv=None):
+  p = harness.parser("Fleet collector: units tracked by one collector")
+  p.add_argument("--sizes", default="10,50,100,250", help="comma-separated fleet sizes")
+  p.add_argument("--seconds", type=float, default=5.0)
+  p.add_argument("--events", action="store_true", help="follow /events instead of polling /status")
+  args = p.parse_args(argv)
+  results = {}
+  ctx = multiprocessing.get_context("spawn")
+  for size in (int(s) for s in args.sizes.split(",")):
+    ports = ctx.Queue()
+    child = ctx.Process(target=run_standins, args=(size, ports), daemon=True)
+    child.start()
+    try:
+      started = ports.get(timeout=60)
+      results["%s_%d" % ("events" if args.events else "poll", size)] = asyncio.run(track(started, args.seconds, args.events))
+    finally:
+      child.terminate()
+      child.join(5)
+  tracked = [r["units"] for r in results.values() if r["tracked"]]
+  results["capacity"] = {"largest_tracked": max(tracked) if tracked else 0}
+  return harness.report(results, args)
+
+
+if __name__ == "__main__":
+  sys.exit(main())
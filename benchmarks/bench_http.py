@@ -0,0 +1,149 @@
+# Requests per second and latency of the blocking accept loop versus the asyncio server.
+# Both servers run chromatography.respond() on loopback sockets; client threads hammer /status
+# (and the dashboard every tenth request). A final scenario opens one idle "slow phone"
+# connection first and counts how many other requests still get answered.
+#
+#   python -m benchmarks.bench_http [--json out.json] [--compare baseline.json]
+
+import asyncio
+import socket
+import sys
+import threading
+import time
+
+import sim
+import httpd
+from benchmarks import harness
+
+import chromatography as app
+
+CLIENTS = 8
+CLIENT_TIMEOUT = 2.0
+
+
+def start_blocking():
+  s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  s.bind(("127.0.0.1", 0))
+  s.listen(16)
+
+  def run():
+    try:
+      app.serve(s)
+    except OSError:
+      pass # socket closed by stop()
+
+  threading.Thread(target=run, daemon=True).start()
+  return s.getsockname()[1], s.close
+
+
+def start_async(send_buffer=None):
+  """Serve app.respond from a thread. `send_buffer` shrinks the sockets' send buffers (accepted
+  sockets inherit it from the listener), e.g. to the few KB lwIP has on the board."""
+  loop = asyncio.new_event_loop()
+  ready = threading.Event()
+  box = {}
+
+  async def boot():
+    box["server"] = await httpd.start_async_server(app.respond, 0, CLIENT_TIMEOUT, host="127.0.0.1", backlog=16)
+    if send_buffer:
+      box["server"].sockets[0].setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, send_buffer)
+    ready.set()
+
+  def run():
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(boot())
+    loop.run_forever()
+
+  threading.Thread(target=run, daemon=True).start()
+  ready.wait()
+
+  def stop():
+    loop.call_soon_threadsafe(box["server"].close)
+
+  return box["server"].sockets[0].getsockname()[1], stop
+
+
+def read_response(f):
+  length = 0
+  while True:
+    line = f.readline()
+    if not line:
+      raise OSError("connection closed")
+    if line == b"\r\n":
+      break
+    if line.lower().startswith(b"content-length:"):
+      length = int(line.split(b":")[1])
+  f.read(length)
+
+
+def client(port, count, keep, latencies, errors):
+  conn = None
+  for i in range(count):
+    path = b"/" if i % 10 == 0 else b"/status"
+    request = b"GET " + path + b" HTTP/1.1\r\nHost: x\r\nConnection: " + (b"keep-alive" if keep else b"close") + b"\r\n\r\n"
+    t0 = time.perf_counter()
+    try:
+      if conn is None:
+        conn = socket.create_connection(("127.0.0.1", port), CLIENT_TIMEOUT)
+        f = conn.makefile("rb")
+      conn.sendall(request)
+      read_response(f)
+      latencies.append((time.perf_counter() - t0) * 1000000)
+    except OSError:
+      errors.append(i)
+      if conn is not None:
+        conn.close()
+      conn = None
+      continue
+    if not keep:
+      conn.close()
+      conn = None
+  if conn is not None:
+    conn.close()
+
+
+def load(port, count, keep, slow_client=False):
+  latencies = []
+  errors = []
+  idle = socket.create_connection(("127.0.0.1", port)) if slow_client else None
+  threads = [threading.Thread(target=client, args=(port, count, keep, latencies, errors)) for _ in range(CLIENTS)]
+  t0 = time.perf_counter()
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+  elapsed = time.perf_counter() - t0
+  if idle:
+    idle.close()
+  latencies.sort()
+  return {
+    "clients": CLIENTS,
+    "requests": len(latencies),
+    "errors": len(errors),
+    "requests_per_s": len(latencies) / elapsed,
+    "p50_us": harness.percentile(latencies, 0.50),
+    "p95_us": harness.percentile(latencies, 0.95),
+    "p99_us": harness.percentile(latencies, 0.99),
+  }
+
+
+def main(argv=None):
+  args = harness.parser("Blocking accept loop versus asyncio server").parse_args(argv)
+  count = args.repeat or 200
+  sim.reset()
+  results = {}
+  with harness.quiet():
+    port, stop = start_blocking()
+    results["blocking_close"] = load(port, count, keep=False)
+    results["blocking_slow_client"] = load(port, 5, keep=False, slow_client=True)
+    stop()
+    port, stop = start_async()
+    results["async_close"] = load(port, count, keep=False)
+    results["async_keep_alive"] = load(port, count, keep=True)
+    results["async_slow_client"] = load(port, 5, keep=False, slow_client=True)
+    stop()
+  return harness.report(results, args)
+
+
+if __name__ == "__main__":
+  sys.exit(main())
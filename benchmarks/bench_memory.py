@@ -0,0 +1,75 @@
+# Heap use of the web server and the experiment under the simulated backend, with
+# MEMORY_PROFILE switched on (memstats.py, tracemalloc standing in for gc.mem_alloc()).
+# Reports per request route and per stage how many bytes were allocated, plus the size of the
+# prebuilt dashboard responses. With --compare, any *_bytes figure that grew by more than the
+# tolerance fails the run, so memory regressions show up like slow timings do.
+#
+#   python -m benchmarks.bench_memory [--json out.json] [--compare baseline.json]
+
+import sys
+
+import sim
+import memstats
+from benchmarks import harness
+from benchmarks.bench_core import plate_waveforms
+
+import chromatography as app
+
+REQUESTS = {
+  "/": b"GET / HTTP/1.1\r\nHost: 192.168.4.1\r\nAccept-Encoding: gzip, deflate\r\n\r\n",
+  "/status": b"GET /status HTTP/1.1\r\nHost: 192.168.4.1\r\n\r\n",
+  "/metrics": b"GET /metrics HTTP/1.1\r\nHost: 192.168.4.1\r\n\r\n",
+  "/batch": b"GET /batch HTTP/1.1\r\nHost: 192.168.4.1\r\n\r\n",
+  "/profile": b"GET /profile HTTP/1.1\r\nHost: 192.168.4.1\r\n\r\n",
+}
+
+
+class Sink(sim.ScriptedConnection):
+  """A scripted connection that counts what is sent instead of keeping it, so the copies the
+  simulation would hold on to do not count against the server."""
+
+  sent_bytes = 0
+
+  def send(self, data):
+    self.sent_bytes += len(data)
+    return len(data)
+
+
+def main(argv=None):
+  args = harness.parser("Heap use per request route and per stage (simulated backend)").parse_args(argv)
+  repeat = args.repeat or 50
+  memstats.enable()
+  app.MEMORY_PROFILE = True
+  plate_waveforms()
+  with harness.quiet():
+    app.experiment_sequence()
+    app.dashboard()
+    for _ in range(repeat):
+      for raw in REQUESTS.values():
+        app.handle_connection(Sink(raw))
+
+  results = {}
+  for route, usage in app.request_memory.summary().items():
+    results["request " + route] = {
+      "count": usage["count"],
+      "alloc_bytes": usage["mean_alloc_bytes"],
+      "max_alloc_bytes": usage["max_alloc_bytes"],
+      "gc_runs": usage["gc_runs"],
+    }
+  for stage, usage in app.stage_memory.summary().items():
+    results["stage " + stage] = {
+      "heap_growth_bytes": usage["max_alloc_bytes"],
+      "gc_runs": usage["gc_runs"],
+      "heap_free_after": usage["min_free_bytes"],
+    }
+  page = app.dashboard()
+  results["dashboard_page"] = {
+    "plain_bytes": len(page.plain.data),
+    "gzipped_bytes": len(page.gzipped.data) if page.gzipped else 0,
+  }
+  results["heap"] = {"free_at_end": memstats.mem_free(), "in_use": memstats.mem_alloc()}
+  return harness.report(results, args)
+
+
+if __name__ == "__main__":
+  sys.exit(main())
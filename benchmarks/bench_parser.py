@@ -0,0 +1,145 @@
+# Request parsing and routing: the old str(raw) + find() == 6 routing versus httpd.Request and
+# httpd.Router. Measures parse + route time and the memory allocated per request (tracemalloc
+# peak, so transient copies count too) for a few typical requests, and how often each approach
+# routes correctly when a request arrives split over several reads or is longer than 1024 bytes.
+#
+#   python -m benchmarks.bench_parser [--json out.json] [--compare baseline.json]
+
+import sys
+import tracemalloc
+
+import httpd
+from benchmarks import harness
+
+BROWSER = (b"Host: 192.168.4.1\r\nConnection: keep-alive\r\n"
+           b"User-Agent: Mozilla/5.0 (Linux; Android 14) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0 Mobile Safari/537.36\r\n"
+           b"Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n"
+           b"Accept-Encoding: gzip, deflate\r\nAccept-Language: en-GB,en;q=0.9\r\n")
+
+REQUESTS = {
+  "dashboard": b"GET / HTTP/1.1\r\n" + BROWSER + b"If-None-Match: \"1a2b3c4d\"\r\n\r\n",
+  "status": b"GET /status?v=42 HTTP/1.1\r\n" + BROWSER + b"\r\n",
+  "history": b"GET /history?since=1200 HTTP/1.1\r\nHost: 192.168.4.1\r\n\r\n",
+  "emergency": b"GET /?error HTTP/1.1\r\n" + BROWSER + b"\r\n",
+}
+EXPECTED = {"dashboard": "index", "status": "status", "history": "history", "emergency": "error"}
+
+# Long enough that the header the dashboard needs ends up past the first 1024 bytes.
+LARGE = (b"GET / HTTP/1.1\r\n" + BROWSER + b"Cookie: session=" + b"x" * 900 + b"\r\n"
+         b"If-None-Match: \"1a2b3c4d\"\r\n\r\n")
+
+
+def legacy_route(raw):
+  """The routing of respond() before httpd.Request, returning which branch it took."""
+  request = str(raw)
+  if request.find('/?error') == 6:
+    return "error"
+  if request.find("/status") == 6:
+    httpd.query(raw, b"v") or httpd.header(raw, b"If-None-Match")
+    return "status"
+  if request.find("/events") == 6:
+    return "events"
+  if request.find("/history") == 6:
+    httpd.query(raw, b"since")
+    return "history"
+  httpd.header(raw, b"If-None-Match")
+  return "index"
+
+
+def index(request):
+  if request.query(b"error") is not None:
+    return "error"
+  request.header(b"If-None-Match")
+  return "index"
+
+
+def status(request):
+  request.query(b"v") or request.header(b"If-None-Match")
+  return "status"
+
+
+def history(request):
+  request.query(b"since")
+  return "history"
+
+
+router = httpd.Router([
+  ("/status", status),
+  ("/events", lambda request: "events"),
+  ("/history", history),
+], index)
+
+request = httpd.Request()
+
+
+def parsed_route(raw):
+  request.reset()
+  request.feed(raw)
+  return router(request)
+
+
+def allocated(fn, raw, rounds=50):
+  """Peak bytes allocated by one call, taken as the smallest peak over `rounds` calls."""
+  fn(raw) # warm caches
+  best = None
+  tracemalloc.start()
+  try:
+    for _ in range(rounds):
+      tracemalloc.reset_peak()
+      base = tracemalloc.get_traced_memory()[0]
+      fn(raw)
+      peak = tracemalloc.get_traced_memory()[1] - base
+      best = peak if best is None else min(best, peak)
+  finally:
+    tracemalloc.stop()
+  return best
+
+
+def split_legacy(raw, size):
+  # The old loop routed on whatever the first recv(1024) returned.
+  return legacy_route(raw[:min(size, 1024)])
+
+
+def split_parsed(raw, size):
+  request.reset()
+  for i in range(0, len(raw), size):
+    if request.feed(raw[i:i + size]):
+      break
+  return router(request)
+
+
+def main(argv=None):
+  args = harness.parser("HTTP request parsing: str(raw) + find() versus httpd.Request").parse_args(argv)
+  repeat = args.repeat or 2000
+  results = {}
+  for name, raw in REQUESTS.items():
+    for label, fn in (("legacy", legacy_route), ("parser", parsed_route)):
+      assert fn(raw) == EXPECTED[name], (label, name, fn(raw))
+      stats = harness.measure(lambda: fn(raw), repeat)
+      results["%s_%s" % (label, name)] = {
+        "bytes": len(raw),
+        "median_us": stats["median_us"],
+        "p95_us": stats["p95_us"],
+        "allocated_bytes": allocated(fn, raw),
+      }
+
+  for label, fn in (("legacy", split_legacy), ("parser", split_parsed)):
+    correct = 0
+    total = 0
+    for size in (1, 7, 64, 1460):
+      for name, raw in REQUESTS.items():
+        total += 1
+        correct += fn(raw, size) == EXPECTED[name]
+    # A long request: the legacy loop loses the If-None-Match header beyond 1024 bytes.
+    total += 1
+    if label == "legacy":
+      correct += httpd.header(LARGE[:1024], b"If-None-Match") is not None
+    else:
+      split_parsed(LARGE, 1460)
+      correct += request.header(b"If-None-Match") is not None
+    results[label + "_split_reads"] = {"cases": total, "correct": correct}
+  return harness.report(results, args)
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,37 @@
+# Replay throughput: synthetic experiments per second through tools/replay.py.
+# Every trace runs the real experiment sequence under the virtual clock, in a pool of 1, 2 and 4
+# worker processes. Reported per pool size: traces per second, how many seconds of experiment
+# were replayed per wall-clock second, and the classification accuracy (which must not depend on
+# the number of workers). cpu_ms_per_trace is the median CPU time one experiment took inside a
+# worker, without generating its trace. More workers than CPUs (the "cpus" figure) cannot help.
+#
+#   python -m benchmarks.bench_replay [--repeat 400] [--json out.json] [--compare baseline.json]
+
+import os
+import statistics
+import sys
+
+from benchmarks import harness
+from tools import replay
+
+
+def main(argv=None):
+  args = harness.parser("Replayed experiments per second").parse_args(argv)
+  traces = args.repeat or 400
+  results = {"machine": {"cpus": os.cpu_count() or 1}}
+  for workers in (1, 2, 4):
+    out, wall = replay.run_pool(replay.run_synthetic, range(traces), workers)
+    report = replay.summary(out, wall, workers)
+    results["workers_%d" % workers] = {
+      "traces": report["traces"],
+      "traces_per_s": report["traces_per_s"],
+      "virtual_s_per_s": report["speedup_vs_real_time"],
+      "accuracy": report["accuracy"],
+      "timed_out": report["timed_out"],
+      "cpu_ms_per_trace": statistics.median(r["cpu_ms"] for r in out),
+    }
+  return harness.report(results, args)
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,134 @@
+# Event throughput from the experiment thread to the server thread through the SPSC ring
+# (spsc.py), against a list guarded by a lock and CPython's queue.Queue. A producer thread
+# posts EVENTS status records as fast as it can, waiting (sleep(0)) whenever the ring is full,
+# and a consumer thread drains them. Reported: events per second end to end, how often the
+# producer found the ring full, the cost of one push and pop on a single thread, and the heap
+# held per queued event (tracemalloc): the ring holds none, the list a tuple per event.
+#
+#   python -m benchmarks.bench_spsc [--repeat 200000] [--json out.json] [--compare baseline.json]
+
+import _thread
+import queue
+import sys
+import threading
+import time
+import tracemalloc
+
+import spsc
+from benchmarks import harness
+
+
+def run_threads(produce, consume):
+  t0 = time.perf_counter()
+  consumer = threading.Thread(target=consume)
+  consumer.start()
+  produce()
+  consumer.join()
+  return time.perf_counter() - t0
+
+
+def ring(events, capacity):
+  r = spsc.Ring(capacity)
+  received = [0]
+  done = [False]
+
+  def handle(kind, arg, value, ticks_ms):
+    received[0] += 1
+
+  def produce():
+    for i in range(events):
+      while not r.push(spsc.STATUS, i & 0xff, i, i):
+        time.sleep(0)
+    done[0] = True
+
+  def consume():
+    while True:
+      finished = done[0]
+      if not r.drain(handle):
+        if finished:
+          return
+        time.sleep(0)
+
+  elapsed = run_threads(produce, consume)
+  return {"events": events, "received": received[0], "full_waits": r.dropped, "events_per_s": received[0] / elapsed}
+
+
+def locked_list(events):
+  lock = _thread.allocate_lock()
+  pending = []
+  received = [0]
+  done = [False]
+
+  def produce():
+    for i in range(events):
+      with lock:
+        pending.append((spsc.STATUS, i & 0xff, i, i))
+    done[0] = True
+
+  def consume():
+    nonlocal pending
+    while True:
+      finished = done[0]
+      with lock:
+        batch = pending
+        pending = []
+      received[0] += len(batch)
+      if not batch:
+        if finished:
+          return
+        time.sleep(0)
+
+  elapsed = run_threads(produce, consume)
+  return {"events": events, "received": received[0], "events_per_s": received[0] / elapsed}
+
+
+def queue_queue(events):
+  q = queue.Queue(maxsize=64)
+  received = [0]
+
+  def produce():
+    for i in range(events):
+      q.put((spsc.STATUS, i & 0xff, i, i))
+    q.put(None)
+
+  def consume():
+    while q.get() is not None:
+      received[0] += 1
+
+  elapsed = run_threads(produce, consume)
+  return {"events": events, "received": received[0], "events_per_s": received[0] / elapsed}
+
+
+def held_bytes(post, count=64):
+  """Heap held per event after posting `count` events that nobody has taken yet."""
+  tracemalloc.start()
+  before = tracemalloc.get_traced_memory()[0]
+  for i in range(count):
+    post(i)
+  held = tracemalloc.get_traced_memory()[0] - before
+  tracemalloc.stop()
+  return held / count
+
+
+def main(argv=None):
+  args = harness.parser("SPSC ring versus locked list and queue.Queue").parse_args(argv)
+  events = args.repeat or 200000
+  results = {
+    "spsc_16": ring(events, 16),
+    "spsc_64": ring(events, 64),
+    "spsc_256": ring(events, 256),
+    "locked_list": locked_list(events),
+    "queue_64": queue_queue(events),
+  }
+  r = spsc.Ring(64)
+  pending = []
+  results["single_thread"] = {
+    "push_pop_us": harness.measure(lambda: r.push(spsc.STATUS, 1, 2, 3) and r.pop(), 10000)["median_us"],
+    "ring_held_bytes": held_bytes(lambda i: r.push(spsc.STATUS, i & 0xff, i, 100000 + i)),
+    "list_held_bytes": held_bytes(lambda i: pending.append((spsc.STATUS, i & 0xff, i, 100000 + i))),
+  }
+  return harness.report(results, args)
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,119 @@
+# CPU use and stage-transition latency of the experiment: the old busy-wait sequence versus the
+# stage engine (thread runner and timer runner). Runs in real time with the stage pauses
+# shortened, so the CPU figures are what a core would actually spend. Transition latency is
+# measured from the scripted sensor event to the matching actuator LED write.
+#
+#   python -m benchmarks.bench_stages [--json out.json] [--compare baseline.json]
+
+import sys
+import threading
+import time
+
+import sim
+import stages
+from benchmarks import harness
+
+import chromatography as app
+
+PAPER_AT = 1.0 # s, IR reading rises above the threshold
+FRONT_AT = 3.0 # s, thermistor warms up
+PAUSE_MS = 100 # stand-in for the 3 s / 10 s pauses
+
+
+def waveforms():
+  sim.reset()
+  sim.clock.virtual = False
+  sim.feed(27, sim.script((PAPER_AT, 0), (1, 6000)))
+  sim.feed(26, sim.script((FRONT_AT, 30000), (1, 32000)))
+  sim.feed(28, 20000)
+
+
+def legacy_sequence():
+  """experiment_sequence() with the busy waits it had before stages.py (pauses shortened)."""
+  def interpret_thermistor():
+    temp_thermistor_value = app.thermistor.read_u16()
+    sim.clock.sleep(1)
+    return abs(temp_thermistor_value - app.thermistor.read_u16()) > 500
+
+  app.reset_leds()
+  while app.check_paper_position() < 5000:
+    sim.clock.sleep(0)
+  app.activate_actuator_led(0, 1)
+  while interpret_thermistor() is False:
+    sim.clock.sleep(0)
+  app.activate_actuator_led(1, 1)
+  sim.clock.sleep(PAUSE_MS / 1000)
+  app.toggle_data_collection_led(1)
+  app.light_intensity = app.read_light_intensity()
+  sim.clock.sleep(PAUSE_MS / 1000)
+  app.activate_actuator_led(2, 1)
+  sim.clock.sleep(PAUSE_MS / 1000)
+
+
+def first_on(pin):
+  for t, v in sim.pins[pin].writes:
+    if v:
+      return t
+  return None
+
+
+def measure(start):
+  """Run one experiment via start(done_event) and return CPU and latency figures."""
+  waveforms()
+  done = threading.Event()
+  cpu0 = time.process_time()
+  wall0 = time.perf_counter()
+  with harness.quiet():
+    start(done)
+    done.wait(30)
+  wall = time.perf_counter() - wall0
+  cpu = time.process_time() - cpu0
+  saturating = first_on(13) # actuator LED 0
+  spraying = first_on(15) # actuator LED 1
+  return {
+    "wall_s": wall,
+    "cpu_s": cpu,
+    "cpu_percent": 100 * cpu / wall,
+    "idle_percent": 100 * (1 - cpu / wall),
+    "paper_latency_us": (saturating - PAPER_AT) * 1000000,
+    "front_latency_us": (spraying - FRONT_AT) * 1000000,
+  }
+
+
+def legacy(done):
+  def run():
+    legacy_sequence()
+    done.set()
+  threading.Thread(target=run, daemon=True).start()
+
+
+def engine_thread(done):
+  def run():
+    stages.run(app.new_experiment())
+    done.set()
+  threading.Thread(target=run, daemon=True).start()
+
+
+def engine_timer(done):
+  engine = app.new_experiment()
+  engine.listeners.append(lambda e: e.finished and done.set())
+  stages.run_timer(engine, sim.Timer())
+
+
+def main(argv=None):
+  args = harness.parser("Busy-wait sequence versus stage engine").parse_args(argv)
+  app.SPRAY_MS = app.COMPLETE_MS = PAUSE_MS
+  results = {
+    "legacy_busy_wait": measure(legacy),
+    "engine_thread": measure(engine_thread),
+    "engine_timer": measure(engine_timer),
+  }
+  engine = app.experiment
+  results["engine_timer"]["step_busy_us"] = engine.busy_us
+  results["engine_timer"]["transitions"] = len(engine.latency_us)
+  results["engine_timer"]["max_transition_us"] = max(engine.latency_us)
+  return harness.report(results, args)
+
+
+if __name__ == "__main__":
+  sys.exit(main())
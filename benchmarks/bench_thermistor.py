@@ -0,0 +1,122 @@
+# Replays thermistor traces through the old interpret_thermistor() logic and the streaming
+# detector in thermal.py, under the virtual clock, and reports false positives and detection
+# latency. Without --traces a reproducible set of synthetic recordings is used: a noisy
+# baseline with drift and single-sample spikes, half of them with a real step change.
+#
+#   python -m benchmarks.bench_thermistor [--traces DIR --rate HZ] [--json out.json]
+#
+# Trace files are CSV with the thermistor reading in the first column. A file whose name
+# contains "_step<seconds>" has a real change at that time; all others have none.
+
+import os
+import random
+import re
+import sys
+
+import sim
+import thermal
+from benchmarks import harness
+
+THERMISTOR_PIN = 26
+TRACE_HZ = 50
+TRACE_S = 30
+
+
+def synthetic_traces(count, seed=1):
+  rng = random.Random(seed)
+  traces = []
+  for k in range(count):
+    step_at = rng.uniform(5, 20) if k % 2 else None
+    level = rng.randint(25000, 35000)
+    drift = rng.uniform(-20, 20) # counts per second
+    samples = []
+    for i in range(TRACE_S * TRACE_HZ):
+      t = i / TRACE_HZ
+      v = level + drift * t + rng.gauss(0, 120)
+      if rng.random() < 0.01:
+        v += rng.choice((-1, 1)) * rng.randint(800, 2000) # spike
+      if step_at is not None and t >= step_at:
+        v += 1500 * min(1.0, (t - step_at) / 0.5) # solvent front: 1500 counts over 0.5 s
+      samples.append(int(v))
+    traces.append((sim.Trace(samples, TRACE_HZ), step_at))
+  return traces
+
+
+def load_traces(directory, rate):
+  traces = []
+  for name in sorted(os.listdir(directory)):
+    step = re.search(r"_step([0-9.]+)", name)
+    trace = sim.Trace.from_csv(os.path.join(directory, name), 0, rate)
+    traces.append((trace, float(step.group(1)) if step else None))
+  return traces
+
+
+def legacy(adc):
+  """interpret_thermistor() as it was before thermal.py."""
+  temp_thermistor_value = adc.read_u16()
+  sim.clock.sleep(1)
+  if ((temp_thermistor_value - adc.read_u16()) > 500) or ((temp_thermistor_value - adc.read_u16()) < -500):
+    return True
+  return False
+
+
+def streaming(adc, hz):
+  detector = thermal.ChangeDetector(threshold=500, window=hz)
+
+  def check():
+    triggered = detector.feed(adc.read_u16())
+    if not triggered:
+      sim.clock.sleep(1 / hz)
+    return triggered
+  return check
+
+
+def replay(traces, make_check, duration):
+  false_positives = 0
+  latencies = []
+  missed = 0
+  adc = sim.ADC(THERMISTOR_PIN)
+  for trace, step_at in traces:
+    sim.reset()
+    sim.clock.virtual = True
+    sim.feed(THERMISTOR_PIN, trace)
+    check = make_check(adc)
+    detected = None
+    while sim.clock.now() < duration:
+      if check():
+        detected = sim.clock.now()
+        break
+    if detected is None:
+      missed += step_at is not None
+    elif step_at is None or detected < step_at:
+      false_positives += 1
+    else:
+      latencies.append((detected - step_at) * 1000)
+  latencies.sort()
+  return {
+    "traces": len(traces),
+    "false_positive_rate": false_positives / len(traces),
+    "missed": missed,
+    "latency_ms_mean": sum(latencies) / len(latencies) if latencies else 0.0,
+    "latency_ms_p95": harness.percentile(latencies, 0.95),
+  }
+
+
+def main(argv=None):
+  p = harness.parser("Thermistor change detection: false positives and latency")
+  p.add_argument("--traces", metavar="DIR", help="directory of recorded CSV traces")
+  p.add_argument("--rate", type=float, default=TRACE_HZ, help="sample rate of the recorded traces")
+  args = p.parse_args(argv)
+  traces = load_traces(args.traces, args.rate) if args.traces else synthetic_traces(args.repeat or 40)
+  duration = max(len(t.samples) / t.rate_hz for t, _ in traces)
+  results = {"legacy_1s": replay(traces, lambda adc: lambda: legacy(adc), duration)}
+  for hz in (5, 10, 20):
+    results["streaming_%dhz" % hz] = replay(traces, lambda adc: streaming(adc, hz), duration)
+  detector = thermal.ChangeDetector()
+  feed = harness.measure(lambda: detector.feed(30000), 10000)
+  results["feed_cost"] = {"median_us": feed["median_us"]}
+  return harness.report(results, args)
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,146 @@
+# Live sensor traces over /ws: samples per second delivered to each WebSocket client.
+# The asyncio server runs chromatography.respond() on loopback with the acquisition engine
+# sampling at RATE Hz, and client threads open /ws and decode every binary frame. Reported per
+# scenario: samples per second per channel each client got (against what was acquired), frames
+# per second, the largest stride the server fell back to, samples skipped, and the acquisition
+# rate and jitter meanwhile. In the "stalled" scenario one client stops reading for STALL_S;
+# once the socket buffers are full the server thins out that client's frames (stride_raises),
+# while the other client and the acquisition carry on unaffected. The server's send buffers are
+# shrunk to SEND_BUFFER, so a stalled client fills them about as soon as it would on the board.
+#
+#   python -m benchmarks.bench_ws [--json out.json] [--compare baseline.json]
+
+import base64
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+import sim
+import acquire
+from benchmarks import harness
+from benchmarks.bench_http import start_async
+
+import chromatography as app
+
+SECONDS = 3.0
+STALL_S = 10.0
+SEND_BUFFER = 5840 # bytes; about what lwIP on the Pico W buffers per connection
+
+
+def feed():
+  sim.reset()
+  sim.feed(26, lambda t: 30000 + int(2000 * (t % 1.0)))
+  sim.feed(28, lambda t: 20000 + int(5000 * ((t * 3) % 1.0)))
+  sim.feed(27, 6000)
+
+
+def read_exactly(conn, n):
+  data = b""
+  while len(data) < n:
+    chunk = conn.recv(n - len(data))
+    if not chunk:
+      raise OSError("connection closed")
+    data += chunk
+  return data
+
+
+def viewer(port, stop, out, stalled=False):
+  conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  if stalled:
+    conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+  conn.settimeout(5)
+  conn.connect(("127.0.0.1", port))
+  key = base64.b64encode(os.urandom(16))
+  conn.sendall(b"GET /ws HTTP/1.1\r\nHost: x\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+               b"Sec-WebSocket-Key: " + key + b"\r\nSec-WebSocket-Version: 13\r\n\r\n")
+  head = b""
+  while b"\r\n\r\n" not in head:
+    head += conn.recv(1)
+  stats = {"frames": 0, "samples": 0, "max_stride": 1, "skipped": 0, "accepted": head.startswith(b"HTTP/1.1 101")}
+  expected = None
+  if stalled:
+    stop.wait()
+    stats["accepted"] = False
+  try:
+    while stats["accepted"] and not stop.is_set():
+      b0, b1 = read_exactly(conn, 2)
+      length = b1 & 0x7f
+      if length == 126:
+        length = struct.unpack(">H", read_exactly(conn, 2))[0]
+      elif length == 127:
+        length = struct.unpack(">Q", read_exactly(conn, 8))[0]
+      payload = read_exactly(conn, length)
+      if b0 & 0x0f != 0x2:
+        break
+      first, count, stride, channels = struct.unpack_from(acquire.FRAME_HEADER, payload)
+      if expected is not None and first > expected:
+        stats["skipped"] += first - expected
+      expected = first + count * stride
+      stats["frames"] += 1
+      stats["samples"] += count
+      stats["max_stride"] = max(stats["max_stride"], stride)
+  except OSError:
+    pass
+  conn.close()
+  out.append(stats)
+
+
+def scenario(port, rate, clients, stalled=False):
+  feed()
+  app.acquisition.rate_hz = rate
+  app.acquisition.start(sim.Timer())
+  raises = app.live_traces.slowed
+  stop = threading.Event()
+  out = []
+  threads = []
+  for i in range(clients):
+    # The stalled client's own figures are left out; stride_raises shows what happened to it.
+    stall = stalled and i == 0
+    threads.append(threading.Thread(target=viewer, args=(port, stop, [] if stall else out, stall), daemon=True))
+  for t in threads:
+    t.start()
+  seconds = STALL_S if stalled else SECONDS
+  time.sleep(seconds)
+  stats = app.acquisition.stats()
+  stop.set()
+  for t in threads:
+    t.join(SECONDS)
+  app.acquisition.stop()
+  time.sleep(0.2) # let the server notice the closed sockets
+  result = {
+    "clients": clients,
+    "acquired_per_s": stats["achieved_hz"],
+    "acquire_jitter_mean_us": stats["jitter_mean_us"],
+    "samples_per_s_per_client": sum(s["samples"] for s in out) / len(out) / seconds if out else 0.0,
+    "frames_per_s_per_client": sum(s["frames"] for s in out) / len(out) / seconds if out else 0.0,
+    "max_stride": max(s["max_stride"] for s in out) if out else 0,
+    "skipped_samples": sum(s["skipped"] for s in out),
+  }
+  if stalled:
+    result["stride_raises"] = app.live_traces.slowed - raises
+  return result
+
+
+def main(argv=None):
+  args = harness.parser("Samples per second per /ws client").parse_args(argv)
+  saved = app.acquisition.rate_hz
+  port, stop = start_async(SEND_BUFFER)
+  results = {}
+  try:
+    with harness.quiet():
+      results["rate_200_1_client"] = scenario(port, 200, 1)
+      results["rate_1000_1_client"] = scenario(port, 1000, 1)
+      results["rate_1000_2_clients"] = scenario(port, 1000, 2)
+      results["rate_1000_stalled_client"] = scenario(port, 1000, 2, stalled=True)
+  finally:
+    stop()
+    app.acquisition.rate_hz = saved
+  results["server"] = {"frames_sent": app.live_traces.sent, "stride_raises": app.live_traces.slowed}
+  return harness.report(results, args)
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,91 @@
+# Small timing harness shared by the benchmark scripts.
+# Every benchmark produces a flat dict of numbers. Results can be written to a JSON file with
+# --json and compared against an earlier file with --compare; any timing that got slower (or byte
+# count that grew) by more than the allowed tolerance makes the script exit with status 1, so
+# regressions show up in CI.
+
+import argparse
+import contextlib
+import io
+import json
+import statistics
+import sys
+import time
+
+
+def measure(fn, repeat=100, warmup=3):
+  """Call fn() `repeat` times and return timing statistics in microseconds."""
+  for _ in range(warmup):
+    fn()
+  samples = []
+  for _ in range(repeat):
+    t0 = time.perf_counter_ns()
+    fn()
+    samples.append((time.perf_counter_ns() - t0) / 1000)
+  samples.sort()
+  return {
+    "n": repeat,
+    "min_us": samples[0],
+    "median_us": statistics.median(samples),
+    "mean_us": statistics.fmean(samples),
+    "p95_us": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+    "max_us": samples[-1],
+  }
+
+
+def percentile(sorted_samples, q):
+  if not sorted_samples:
+    return 0.0
+  return sorted_samples[min(len(sorted_samples) - 1, int(len(sorted_samples) * q))]
+
+
+@contextlib.contextmanager
+def quiet():
+  """Swallow print() output from the code under test; printing would dominate the timings."""
+  with contextlib.redirect_stdout(io.StringIO()):
+    yield
+
+
+def parser(description):
+  p = argparse.ArgumentParser(description=description)
+  p.add_argument("--json", metavar="PATH", help="write the results to a JSON file")
+  p.add_argument("--compare", metavar="PATH", help="compare against an earlier --json file")
+  p.add_argument("--tolerance", type=float, default=0.25,
+                 help="allowed slowdown before a timing counts as a regression (default 0.25 = 25%%)")
+  p.add_argument("--repeat", type=int, default=None, help="override the number of repetitions")
+  return p
+
+
+def regressions(results, baseline, tolerance):
+  """List (benchmark, key, old, new) for every *_us timing or *_bytes count that grew more than allowed."""
+  found = []
+  for name, stats in results.items():
+    old = baseline.get(name, {})
+    for key, value in stats.items():
+      if not (key.endswith("_us") or key.endswith("_bytes")) or key not in old or not old[key]:
+        continue
+      if value > old[key] * (1 + tolerance):
+        found.append((name, key, old[key], value))
+  return found
+
+
+def report(results, args):
+  """Print the results, save/compare them as requested and return the process exit status."""
+  for name, stats in results.items():
+    print(name)
+    for key, value in stats.items():
+      if isinstance(value, float):
+        value = "%.2f" % value
+      print("  %-22s %s" % (key, value))
+  if args.json:
+    with open(args.json, "w") as f:
+      json.dump(results, f, indent=2, sort_keys=True)
+  if args.compare:
+    with open(args.compare) as f:
+      baseline = json.load(f)
+    slower = regressions(results, baseline, args.tolerance)
+    for name, key, old, new in slower:
+      print("REGRESSION %s %s: %.2f -> %.2f" % (name, key, old, new), file=sys.stderr)
+    if slower:
+      return 1
+  return 0
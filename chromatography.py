@@ -13,12 +13,28 @@
 
 # -----------------------------------------------------------------------
 # The following list of libraries are required. Do not remove any. 
-import machine
-import network
-import usocket as socket
-import utime as time
-import _thread
+# hardware.py hands out the real machine/network/usocket/utime modules on the Pico and the
+# simulated ones from sim.py on a PC, so this file also runs (and can be benchmarked) on a laptop.
+from hardware import machine, network, socket, time, _thread, SIMULATED
 import json
+import httpd
+import classifier
+import thermal
+import stages
+import status
+import batch
+import sensorlog
+import platescan
+import metrics
+import memstats
+import acquire
+import spsc
+import journal
+
+# When each phase of the boot ended, in ms since reset (metrics.Timeline): served at /boot and
+# as boot_seconds in /metrics. The phases are listed in main().
+boot = metrics.timeline("boot_seconds", "Time from reset to the end of each boot phase")
+boot.mark("imports")
 
 # -------------------------------------------------------------------------
 
@@ -38,10 +54,39 @@ light_sensor=machine.ADC(28)# Light sensors measure light intensity.
 
 ir_sensor = machine.ADC(27) # The IR sensor detects the IR beam from the IR emitter, used to determine paper position.
 
+# Every reading the helpers below take is kept in a compact ring log (sensorlog.py) and can be
+# downloaded from /history. Set LOG_PATH to also append it to a file on flash.
+LOG_RECORDS = 2000
+LOG_PATH = None
+sensor_log = sensorlog.SensorLog(LOG_RECORDS, LOG_PATH)
+
+# All three ADC channels are sampled together ACQUIRE_HZ times a second from a hardware timer
+# into ring buffers (acquire.py), and the helpers below read the rings instead of the ADCs.
+# The achieved rate and the sample jitter are served at /acquisition. With ACQUIRE_HZ = 0 the
+# helpers read the ADCs themselves, as they do anyway until the timer is started by main().
+ACQUIRE_HZ = 200
+acquisition = acquire.Acquisition((thermistor, light_sensor, ir_sensor), ACQUIRE_HZ or 1)
+
+# Timing histograms (metrics.py), served at /metrics and summarised on the dashboard.
+STAGE_TIMES = metrics.family("stage_duration_seconds", "Time spent in each experiment stage", "stage",
+                             metrics.DURATION_MS, 1000)
+SENSOR_TIMES = metrics.family("sensor_read_seconds", "Time taken by each sensor helper, waiting included", "sensor")
+REQUEST_TIMES = metrics.family("http_request_duration_seconds", "Time from a complete request to the response sent", "route")
+
+# Memory profiling (memstats.py): heap use per request route and per stage, served at /memory.
+# It runs the collector before every request and probes the largest free block after it, so it
+# is off unless switched on here. Only the server core probes: the trial allocations would
+# leave the experiment short of heap for a moment.
+MEMORY_PROFILE = False
+request_memory = memstats.Tracker(collect=True, probe=True, peak=True)
+stage_memory = memstats.Tracker()
+
 
 
 # provides the status of the ouptut. Determines the colour of the buttons online
 def get_output_status():
+  if abort.set:
+    return "Stopped"
   if actuator_leds[0].value()==1:
     if actuator_leds[1].value()==1:
       if data_collection_led.value()==1:
@@ -57,42 +102,62 @@ def colour_error():
    if actuator_leds[2].value()==1:
       return "on"
 # new thermistor detection code which will detect a fluctuation in temperature.
+# The thermistor is sampled THERMISTOR_HZ times a second and every reading is fed to a streaming
+# detector (thermal.py), so a change is seen a few sample periods after it happens instead of
+# after a blocking one second sleep.
+# With acquisition running, each check feeds the detector the mean of the samples taken since
+# the last one.
+THERMISTOR_HZ = 20
+thermistor_detector = thermal.ChangeDetector(threshold=500, window=THERMISTOR_HZ)
+thermistor_next = 0 # number of the first acquired sample the detector has not seen
+
 def interpret_thermistor():
-  temp_thermistor_value = thermistor.read_u16()
-  time.sleep(1)
-  if ((temp_thermistor_value - thermistor.read_u16()) > 500) or ((temp_thermistor_value - thermistor.read_u16()) < -500):
-      return True
+  """Take one thermistor reading. Returns True once the temperature has changed. Never blocks."""
+  global thermistor_next
+  t0 = time.ticks_us()
+  if acquisition.running:
+    value, thermistor_next = acquisition.mean(sensorlog.THERMISTOR, thermistor_next)
   else:
-      return False
-
+    value = thermistor.read_u16()
+  sensor_log.update(sensorlog.THERMISTOR, value, time.ticks_ms())
+  changed = thermistor_detector.feed(value)
+  SENSOR_TIMES.since("thermistor", t0)
+  return changed
+
+
+# One classification = one burst of readings reduced to a single value (see classifier.py).
+# The colour bands come from the calibration table if there is one on the board.
+COLOUR_TABLE = "colours.json"
+colour_edges, colour_names = classifier.load_table(COLOUR_TABLE)
+light_classifier = classifier.Classifier(light_sensor, edges=colour_edges, colours=colour_names)
+
+def classify_light():
+  # With acquisition running the burst is the newest acquired samples, and the ADC is left to the
+  # timer: until the rings hold a whole burst the plate reads as void.
+  t0 = time.ticks_us()
+  if not acquisition.running:
+    colour = light_classifier.classify()
+  elif acquisition.recent(sensorlog.LIGHT, light_classifier.buf) == len(light_classifier.buf):
+    colour = light_classifier.classify(burst=False)
+  else:
+    SENSOR_TIMES.since("light", t0)
+    return "void"
+  sensor_log.update(sensorlog.LIGHT, light_classifier.last, time.ticks_ms())
+  SENSOR_TIMES.since("light", t0)
+  return colour
 
 def read_light_intensity():
 
   """Read the raw analog value from the light sensor, which is proportional to the light intensity, then decide which colour it matches up with."""
-  
-  
 
-  while light_sensor.read_u16() > 40000 or light_sensor.read_u16() < 10000:
+  # Wait until the plate gives a reading inside one of the colour bands.
+  t0 = time.ticks_us()
+  while True:
+    colour = classify_light()
+    if colour != "void":
+      SENSOR_TIMES.since("light_wait", t0)
+      return colour
     time.sleep(0.2)
-  
-  if (light_sensor.read_u16() >10000 and light_sensor.read_u16() <24600):
-    
-    return "blue"
-  elif(light_sensor.read_u16() > 24600 and light_sensor.read_u16() <30800):
-    
-    return "red-pink"
-  elif(light_sensor.read_u16() > 34350 and light_sensor.read_u16() <40000):
-    
-    return "pink"
-  elif(light_sensor.read_u16() > 30800 and light_sensor.read_u16() <33100):
-    
-    return "yellow"
-  elif(light_sensor.read_u16() > 33100 and light_sensor.read_u16() <34350):
-    
-    return "white"
-  else:
-    
-    return "void"
 
 def toggle_data_collection_led(state):
   """Set the state of the data collection LED: 1 for on, 0 for off."""
@@ -110,52 +175,235 @@ def reset_leds():
   activate_actuator_led(1,0)
   activate_actuator_led(2,0)
 
+# Emergency stop (stages.Abort). The web page's stop button and an optional push button both
+# trigger it: the actuators are switched off at once by whoever sees the stop, and the running
+# experiment ends at its next step, within stages.WAIT_SLICE_MS. It stays stopped until a new run
+# is started from /batch.
+STOP_BUTTON = None # GPIO of a push button to ground, e.g. 16; None for the web page only
+
+def safe_state():
+  for led in actuator_leds:
+    led.value(0)
+  data_collection_led.value(0)
+  ir_emitter.value(0)
+
+abort = stages.Abort(safe_state)
+
 def check_paper_position():
   # Ensure the IR emitter is on to send a beam to the IR sensor.
   ir_emitter.value(1)
   # Check if the IR sensor detects the beam. If not, the beam is interrupted (like by the paper), indicating the desired position.
-  return ir_sensor.read_u16()
-
-
-def experiment_sequence():
-
+  t0 = time.ticks_us()
+  value = acquisition.latest(sensorlog.IR) if acquisition.running else ir_sensor.read_u16()
+  sensor_log.update(sensorlog.IR, value, time.ticks_ms())
+  SENSOR_TIMES.since("ir", t0)
+  return value
+
+
+# The experiment as a table of stages (see stages.py). Each stage switches its actuators on when
+# it starts and then has its sensor checked every poll_ms, with the core free in between,
+# instead of spinning in a while loop. Times are in milliseconds.
+PAPER_POLL_MS = 50
+SPRAY_MS = 3000
+SCAN_POLL_MS = 200
+COMPLETE_MS = 10000
+SATURATE_TIMEOUT_MS = 30 * 60 * 1000
+SCAN_TIMEOUT_MS = 5 * 60 * 1000
+
+def start_position_check():
   reset_leds()
-
   # Check for the correct paper position using the IR sensor and emitter.
   print("Checking paper position...")
-  while check_paper_position()<5000:
-      time.sleep(0)  # Wait for the paper to reach the correct position.
-  print("Paper in position.")
 
+def paper_in_position():
+  return check_paper_position() >= 5000
+
+def start_saturation():
+  global thermistor_next
+  print("Paper in position.")
   # Activate an actuator LED to simulate reaching a stage in the experiment.
   activate_actuator_led(0, 1)
-  
   # Monitor the temperature with the thermistor until it indicates the saturation solution has reached the desired height.
   print("Monitoring temperature...")
-  while interpret_thermistor() is False:  
-      time.sleep(0)
+  thermistor_detector.reset()
+  thermistor_next = acquisition.count
+
+def start_spray():
   print("Desired temperature reached.")
-  
   # Activate an actuator LED to simulate reaching a stage in the experiment.
-  activate_actuator_led(1, 1)  # Example: Turn on the first actuator LED.
-  time.sleep(3)
+  activate_actuator_led(1, 1)
+
+# "point" reads one colour where the plate stops. "profile" samples the light sensor along the
+# plate as it moves past, using the IR reading as the position, and finds every spot and its Rf
+# value (platescan.py). The latest profile and its spots are served on /profile.
+SCAN_MODE = "point"
+PROFILE_POLL_MS = 10
+
+# Like check_paper_position(), the profile takes the newest acquired sample while acquisition
+# runs, so the ADC is only read by the timer.
+def read_light():
+  return acquisition.latest(sensorlog.LIGHT) if acquisition.running else light_sensor.read_u16()
+
+profile_scan = platescan.ProfileScan(read_light, check_paper_position)
+last_profile = None
+
+def start_scan():
   # Illuminate the TLC plate with the data collection LED and read the light intensity from the light sensor.
   toggle_data_collection_led(1)  # Turn on the data collection LED. Which is the actuator for starting the scanning process.
   print("Collecting data")
+  profile_scan.reset()
+
+def scan_profile():
+  """Adds a few samples to the profile; done once enough of the plate has been covered."""
+  global light_intensity, last_profile
+  if not profile_scan.step():
+    return False
+  profile = profile_scan.profile()
+  spots = platescan.analyse(profile)
+  last_profile = {"profile": list(profile), "spots": spots}
+  # The colour under the strongest spot is the headline result.
+  strongest = None
+  for spot in spots:
+    if strongest is None or spot["height"] > strongest["height"]:
+      strongest = spot
+  light_intensity = classifier.lookup(profile[strongest["bin"]], light_classifier.edges, light_classifier.colours) if strongest else "no spots"
+  print("Spots (Rf): ", [spot["rf"] for spot in spots])
+  return True
+
+def scan_plate():
+  """One classification attempt; done once the plate reads inside a colour band."""
   global light_intensity
-  light_intensity= read_light_intensity()
+  if SCAN_MODE == "profile":
+    return scan_profile()
+  colour = classify_light()
+  if colour == "void":
+    return False
+  light_intensity = colour
   print("Light intensity/colour: ", light_intensity)
-  time.sleep(1)
-  # toggle_data_collection_led(0)  # Turn off the data collection LED after reading the light intensity.
-  
+  return True
+
+def finish():
   # Activate an actuator LED to indicate completion of experiment
   activate_actuator_led(2, 1)
-
   # Signal the completion of the experiment.
   print("Experiment complete.")
 
-  time.sleep(10)
- 
+def stopped(stage):
+  print("Stage %s timed out, stopping." % stage.name)
+  reset_leds()
+  toggle_data_collection_led(0)
+
+def scan_poll_ms():
+  return PROFILE_POLL_MS if SCAN_MODE == "profile" else SCAN_POLL_MS
+
+def experiment_stages():
+  return (
+    stages.Stage("position", start_position_check, paper_in_position, PAPER_POLL_MS),
+    stages.Stage("saturate", start_saturation, interpret_thermistor, 1000 // THERMISTOR_HZ, timeout_ms=SATURATE_TIMEOUT_MS),
+    stages.Stage("spray", start_spray, hold_ms=SPRAY_MS),
+    stages.Stage("scan", start_scan, scan_plate, scan_poll_ms(), timeout_ms=SCAN_TIMEOUT_MS),
+    stages.Stage("complete", finish, hold_ms=COMPLETE_MS),
+  )
+
+# The engine of the current run, so the web server can report on it.
+experiment = None
+
+# Called on every stage transition; the stage that just ended is the last one in the history.
+def time_stage(engine):
+  if engine.history:
+    name, start_ms, duration_ms = engine.history[-1]
+    STAGE_TIMES.observe(name, duration_ms)
+
+# Heap use per stage, measured from one transition to the next (MEMORY_PROFILE).
+def stage_heap(engine):
+  if not MEMORY_PROFILE:
+    return
+  if engine.history:
+    stage_memory.end(engine.history[-1][0])
+  if not engine.finished:
+    stage_memory.begin()
+
+# Every finished run is appended to a results journal on flash (journal.py): its stage durations,
+# the colour and how it ended. /results pages through it by time. Once the file holds
+# RESULTS_MAX runs it is cut down to the newest half.
+RESULTS_PATH = "results.bin"
+RESULTS_MAX = 1000
+RESULTS_STAGES = ("position", "saturate", "spray", "scan", "complete") # slot order in a record
+results = journal.Journal(RESULTS_PATH, RESULTS_MAX, RESULTS_MAX // 2)
+
+def result_durations(durations):
+  # (stage name, ms) pairs into the journal's slots; a batch "load" is the position check.
+  slots = [0] * len(RESULTS_STAGES)
+  for name, ms in durations:
+    name = "position" if name == "load" else name
+    if name in RESULTS_STAGES:
+      slots[RESULTS_STAGES.index(name)] = ms
+  return slots
+
+def result_colour():
+  return colour_names.index(light_intensity) + 1 if light_intensity in colour_names else 0
+
+def record_result(engine):
+  """Journal a finished run (a listener; the engine calls it on a timeout or stop as well)."""
+  if not engine.finished or not results.ready:
+    return
+  durations = [(name, duration_ms) for name, start_ms, duration_ms in engine.history]
+  outcome = journal.STOPPED if engine.aborted else journal.TIMED_OUT if engine.timed_out else journal.COMPLETE
+  # The colour belongs to this run only once its scan stage has been passed.
+  scanned = engine.index > [stage.name for stage in engine.stages].index("scan")
+  results.append(result_durations(durations), result_colour() if scanned else 0, outcome)
+
+def new_experiment():
+  global experiment
+  experiment = stages.StageEngine(experiment_stages(), on_timeout=stopped, abort=abort)
+  experiment.listeners.append(time_stage)
+  experiment.listeners.append(stage_heap)
+  experiment.listeners.append(record_result)
+  experiment.listeners.append(post_status)
+  return experiment
+
+def experiment_sequence():
+  """Run the whole experiment in the calling thread, sleeping between sensor checks."""
+  return stages.run(new_experiment())
+
+# Batch mode: several plates through the same stations, overlapping (see batch.py). Each station
+# switches its actuator off when its plate moves on, since the next plate may still need the others.
+BATCH_PLATES = 0 # plates to run at boot; 0 runs the single experiment above
+BATCH_MAX_PLATES = 100 # most plates /batch will start at once
+
+# The batch's first station only waits for a plate. Unlike start_position_check() it leaves the
+# actuators alone: the plates ahead of this one are still using them.
+def start_load():
+  print("Checking paper position...")
+
+def batch_stages():
+  return (
+    stages.Stage("load", start_load, paper_in_position, PAPER_POLL_MS),
+    stages.Stage("saturate", start_saturation, interpret_thermistor, 1000 // THERMISTOR_HZ,
+                 timeout_ms=SATURATE_TIMEOUT_MS, leave=lambda: activate_actuator_led(0, 0)),
+    stages.Stage("spray", start_spray, hold_ms=SPRAY_MS, leave=lambda: activate_actuator_led(1, 0)),
+    stages.Stage("scan", start_scan, scan_plate, scan_poll_ms(),
+                 timeout_ms=SCAN_TIMEOUT_MS, leave=lambda: toggle_data_collection_led(0)),
+  )
+
+def record_plate(plate, stage):
+  STAGE_TIMES.observe(stage.name, plate.durations[-1][1])
+
+# Every plate is journalled once it is through, timed out or stopped. The colour is the plate's
+# own only if it got through the scan; a plate that timed out or was stopped keeps no result.
+def finish_plate(plate):
+  if plate.failed is None:
+    plate.result = light_intensity
+    print("Plate %d: %s" % (plate.id, light_intensity))
+  if results.ready:
+    outcome = journal.COMPLETE if plate.failed is None else journal.STOPPED if plate.failed == "stopped" else journal.TIMED_OUT
+    results.append(result_durations(plate.durations), result_colour() if plate.failed is None else 0, outcome)
+
+def new_batch(count):
+  global experiment
+  experiment = batch.BatchRunner(batch_stages(), count, on_leave=record_plate, on_finish=finish_plate, abort=abort)
+  experiment.listeners.append(post_status)
+  return experiment
 
 # --------------------------------------------------------------------------
 
@@ -164,14 +412,30 @@ def experiment_sequence():
 # Create a network connection
 ssid = 'Chemists'       #Set access point name 
 password = '12345678'      #Set your access point password
-ap = network.WLAN(network.AP_IF)
-ap.config(essid=ssid, password=password)
-ap.active(True)            #activating
 
-while ap.active() == False:
-  pass
-print('Connection is successful')
-print(ap.ifconfig())
+def start_access_point():
+  ap = network.WLAN(network.AP_IF)
+  ap.config(essid=ssid, password=password)
+  ap.active(True)            #activating
+  return ap
+
+# The AP comes up in the background; these check on it every AP_POLL_MS instead of spinning, so
+# the server can answer (or the core sleep) meanwhile.
+AP_POLL_MS = 50
+
+def access_point_ready(ap):
+  print('Connection is successful')
+  print(ap.ifconfig())
+
+def wait_for_access_point(ap):
+  while not ap.active():
+    time.sleep_ms(AP_POLL_MS)
+  access_point_ready(ap)
+
+async def wait_for_access_point_async(ap):
+  while not ap.active():
+    await httpd.asyncio.sleep(AP_POLL_MS / 1000)
+  access_point_ready(ap)
 
 # ---------------------------------------------------------------------------
 
@@ -358,21 +622,108 @@ def web_page():
     <p id="results-text">Results</p>
   </div> <!--This is the code to display our results. It is linked to the micropython code to display the appropriate result-->
 
+  <div class="results"> <!--Batch mode: progress of every plate and the overall throughput-->
+    <div>
+      <input id="plate-count" type="number" min="1" max=""" + '"%d"' % BATCH_MAX_PLATES + """ value="4" style="width: 4em;">
+      <button class="button" style="display:inline-block;" onclick="startBatch()">Start Batch</button>
+    </div>
+    <p id="batch-text"></p>
+  </div>
+
+  <div class="results"> <!--Live thermistor (red) and light sensor (blue) traces from /ws-->
+    <canvas id="traces" width="600" height="160" style="background-color: #fff;"></canvas>
+    <p id="traces-text"></p>
+  </div>
+
+  <div class="results"> <!--Timings from /metrics: how long the stages, sensor reads and requests take-->
+    <p id="timings-text"></p>
+  </div>
+
   <script>
-  // continuously checks the code to update it. Takes in the json and is useful for communication. 
+  // Shows a status update. Takes in the json and is useful for communication. 
+  function showStatus(results) {
+    statusVersion = results.version;
+    var results_element = document.getElementById("results-text");
+    results_element.innerHTML = results.output_status;
+    document.getElementById('error').style.backgroundColor=results.completion_status=="on"? "green":"yellow"; // Completion marked
+    if (results.batch) showBatch(results.batch);
+  }
+
+  // One line per plate, then the throughput so far.
+  function showBatch(batch) {
+    var lines = [];
+    for (var i = 0; i < batch.plates.length; i++) {
+      var p = batch.plates[i];
+      lines.push("Plate " + p.id + ": " + p.stage + (p.result ? " (" + p.result + ")" : ""));
+    }
+    lines.push(batch.done + " done, " + batch.plates_per_hour.toFixed(1) + " plates/hour");
+    document.getElementById("batch-text").innerHTML = lines.join("<br>");
+  }
+
+  function startBatch() {
+    var xhr = new XMLHttpRequest();
+    xhr.onreadystatechange = function() {
+      if (xhr.readyState == 4 && xhr.status == 200 && xhr.responseText != "null") showBatch(JSON.parse(xhr.responseText));
+    };
+    xhr.open("GET", "/batch?plates=" + document.getElementById("plate-count").value, true);
+    xhr.send();
+  }
+
+  // Fallback: asks for the status once. Used every second when server-sent events are not available.
+  // Sends the version it already has; the board answers 304 with no body if nothing changed.
+  var statusVersion = -1;
   function updateStatus() {
     var xhr = new XMLHttpRequest();
     xhr.onreadystatechange = function() {
         if (xhr.readyState == 4 && xhr.status == 200) {
-          var results = JSON.parse(xhr.responseText); // The values are parsed here
-          var results_element = document.getElementById("results-text");
-          results_element.innerHTML = results.output_status;
-          document.getElementById('error').style.backgroundColor=results.completion_status=="on"? "green":"yellow"; // Completion marked
+          showStatus(JSON.parse(xhr.responseText)); // The values are parsed here
+      }
+    };
+    xhr.open("GET", "/status?v=" + statusVersion, true); //used for starting functions later
+    xhr.send();
+  }
 
-        
+  // The board pushes a status event on /events whenever something changes, over one open connection.
+  // If the browser or the server cannot do that, poll /status every second instead.
+  function startStatus() {
+    if (!window.EventSource) {
+      setInterval(updateStatus, 1000);
+      return;
+    }
+    var source = new EventSource("/events");
+    var opened = false;
+    source.onopen = function() { opened = true; };
+    source.onmessage = function(e) { showStatus(JSON.parse(e.data)); };
+    source.onerror = function() {
+      // Fall back to polling if it never connected, or if the browser gave up reconnecting (a 503
+      // from a full /events or the blocking server closes it for good). Other errors reconnect.
+      if (!opened || source.readyState == EventSource.CLOSED) {
+        source.close();
+        source.onerror = null;
+        setInterval(updateStatus, 1000);
+      }
+    };
+  }
+
+  // Timing summary from /metrics?format=json: one line per stage, sensor helper and route.
+  function updateTimings() {
+    var xhr = new XMLHttpRequest();
+    xhr.onreadystatechange = function() {
+      if (xhr.readyState == 4 && xhr.status == 200) {
+        var metrics = JSON.parse(xhr.responseText);
+        var lines = [];
+        for (var name in metrics) {
+          for (var label in metrics[name]) {
+            var m = metrics[name][label];
+            if (m.count === undefined) continue; // the boot timeline is on /boot
+            lines.push(name.split("_")[0] + " " + label + ": " + m.count + " times, p50 " + m.p50_ms +
+                       " ms, p95 " + m.p95_ms + " ms, max " + m.max_ms + " ms");
+          }
+        }
+        document.getElementById("timings-text").innerHTML = lines.join("<br>");
       }
     };
-    xhr.open("GET", "/status", true); //used for starting functions later
+    xhr.open("GET", "/metrics?format=json", true);
     xhr.send();
   }
 
@@ -416,7 +767,54 @@ def web_page():
       
     
   }
-  setInterval(updateStatus, 1000); // Refresh every 1 second
+  // Live traces: binary frames from /ws, an 8 byte header (first sample number, samples per channel,
+  // stride, channels) and then the uint16 samples of each channel. The last 600 points are plotted.
+  var traces = [[], []];
+  var traceColours = ["#ff4136", "#0074d9"];
+  function showFrame(buffer) {
+    var header = new DataView(buffer, 0, 8);
+    var count = header.getUint16(4, true);
+    var stride = header.getUint8(6);
+    var channels = Math.min(header.getUint8(7), traces.length);
+    var samples = new Uint16Array(buffer, 8, count * header.getUint8(7));
+    for (var c = 0; c < channels; c++) {
+      var trace = traces[c];
+      for (var i = 0; i < count; i++) trace.push(samples[c * count + i]);
+      if (trace.length > 600) trace.splice(0, trace.length - 600);
+    }
+    document.getElementById("traces-text").innerHTML = stride > 1 ? "every " + stride + " samples shown" : "";
+  }
+  function drawTraces() {
+    var canvas = document.getElementById("traces");
+    var g = canvas.getContext("2d");
+    g.clearRect(0, 0, canvas.width, canvas.height);
+    for (var c = 0; c < traces.length; c++) {
+      var trace = traces[c];
+      if (!trace.length) continue;
+      var lo = Math.min.apply(null, trace), hi = Math.max.apply(null, trace);
+      var span = Math.max(hi - lo, 1);
+      g.strokeStyle = traceColours[c];
+      g.beginPath();
+      for (var i = 0; i < trace.length; i++) {
+        var y = canvas.height - 4 - (trace[i] - lo) * (canvas.height - 8) / span;
+        if (i == 0) g.moveTo(i, y); else g.lineTo(i, y);
+      }
+      g.stroke();
+    }
+    window.requestAnimationFrame(drawTraces);
+  }
+  function startTraces() {
+    if (!window.WebSocket || !window.requestAnimationFrame) return;
+    var socket = new WebSocket("ws://" + location.host + "/ws");
+    socket.binaryType = "arraybuffer";
+    socket.onmessage = function(event) { showFrame(event.data); };
+    window.requestAnimationFrame(drawTraces);
+  }
+
+  startStatus();
+  startTraces();
+  updateTimings();
+  setInterval(updateTimings, 5000);
   
   </script>
 
@@ -437,54 +835,329 @@ def get_status():
         # You will add lines of code if status of more sensors is needed.
     }
     return json.dumps(status)
+
+# A new versioned snapshot of the same status is published whenever a stage changes (see
+# status.py). /status and /events only ever send the latest ready-made snapshot, so they
+# neither read the pins nor build JSON per request.
+status_board = status.StatusBoard()
+
+# The experiment (core 1) owns the pins and sensors and the web server (core 0) owns the status
+# board. Instead of the server reading the experiment's pins and globals, the experiment posts a
+# compact record through a single-producer/single-consumer ring (spsc.py) on every change, and
+# the server applies the records: before answering a request, and every DRAIN_MS in async mode.
+# A status travels as its index in STATUS_TEXT.
+STATUS_TEXT = (None, "Saturating", "Spraying", "Scanning", "Stopped", "no spots") + tuple(colour_names)
+DRAIN_MS = 20
+to_server = spsc.Ring(64)
+
+def post_status(engine=None):
+  """Core 1: post the current status to the server."""
+  text = get_output_status()
+  code = STATUS_TEXT.index(text) if text in STATUS_TEXT else 0
+  to_server.push(spsc.STATUS, code, 1 if colour_error() else 0, time.ticks_ms())
+
+def apply_event(kind, arg, value, ticks_ms):
+  if kind == spsc.STATUS:
+    summary = experiment.summary() if isinstance(experiment, batch.BatchRunner) else None
+    status_board.publish(STATUS_TEXT[arg], "on" if value else None, summary)
+
+def drain_events():
+  """Core 0: apply everything the experiment has posted."""
+  return to_server.drain(apply_event)
+
+async def forward_events():
+  while True:
+    drain_events()
+    await httpd.asyncio.sleep(DRAIN_MS / 1000)
+
+# Pushes the latest snapshot to every open dashboard, but only when a new one was published.
+events = httpd.EventSource(lambda: status_board.current, lambda snapshot: snapshot.payload)
+
+# Live thermistor and light traces for the dashboard plot on /ws: every WS_FRAME_MS each viewer
+# gets the samples acquired since its last message as one binary frame (acquire.py has the
+# layout). A viewer that falls behind gets every 2nd, 4th, ... sample, and skips ahead once it
+# is more than WS_MAX_SAMPLES behind; the acquisition itself never waits for it.
+WS_CHANNELS = (sensorlog.THERMISTOR, sensorlog.LIGHT)
+WS_FRAME_MS = 100
+WS_MAX_SAMPLES = 128
+
+def waveform_frame(cursor, stride, buf):
+  return acquisition.frame(cursor, stride, buf, WS_CHANNELS, WS_MAX_SAMPLES)
+
+live_traces = httpd.WebSocket(waveform_frame, acquire.FRAME_HEADER_SIZE + 2 * len(WS_CHANNELS) * WS_MAX_SAMPLES, WS_FRAME_MS)
 # ------------------------------------------------------------------------
 
 # -------------------------------------------------------------------------
 # This portion of the code remains as it is.
 
-# Start the ADC monitoring function in a separate thread
-_thread.start_new_thread(experiment_sequence, ())
-
-# Create a socket server
-s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-s.bind(('', 80))
-s.listen(5)
-
-# --------------------------------------------------------------------------
-
-# --------------------------------------------------------------------------
+# The dashboard never changes while the board is running, so it is rendered once at boot into
+# ready-made responses (plain, gzipped and 304) instead of rebuilding web_page() for every hit.
+page = None
+
+def dashboard():
+  global page
+  if page is None:
+    page = httpd.StaticPage(web_page())
+  return page
+
+# Route handlers. Each takes the parsed request (httpd.Request) and returns a response.
+def emergency_stop():
+  if abort.trigger("web"):
+    print('Emergency Stop')
+  status_board.publish("Stopped", None)
+
+def index(request):
+  # /?error is the emergency stop; every other path gets the dashboard.
+  if request.path_is(b"/") and request.query(b"error") is not None:
+    emergency_stop()
+  return dashboard().select(request)
+
+def status_route(request):
+  # Clients pass the version they already have as ?v= (or If-None-Match) and get a 304.
+  known = request.query(b"v") or request.header(b"If-None-Match")
+  return status_board.respond(known)
+
+def history_route(request):
+  # Binary sensor records from sequence number ?since= on, streamed in chunks.
+  try:
+    since = request.query_int(b"since", 0, 0)
+  except ValueError:
+    return httpd.BAD_REQUEST
+  first, chunks = sensor_log.read(since)
+  return httpd.Stream("application/octet-stream", chunks,
+                      [("X-First-Sequence", first), ("X-Record-Format", sensorlog.FORMAT)])
+
+# A page of journalled results as JSON, streamed a few records at a time. ?since= (seconds, as
+# time.time()) pages forward from that time and "next" is the since= of the following page;
+# without since= it is the newest ?limit= results. ?limit=1 is just the latest result.
+RESULTS_PAGE = 20
+RESULTS_PAGE_MAX = 100
+
+def result_json(record):
+  run, t, durations, colour, outcome = record
+  return json.dumps({
+    "run": run,
+    "time": t,
+    "stages_ms": dict(zip(RESULTS_STAGES, durations)),
+    "colour": colour_names[colour - 1] if colour else None,
+    "outcome": journal.OUTCOMES[outcome],
+  })
+
+def result_page(start, end, next_since, generation):
+  yield ('{"next": %s, "results": [' % json.dumps(next_since)).encode()
+  separator = ""
+  for record in results.records(start, end, generation):
+    yield (separator + result_json(record)).encode()
+    separator = ", "
+  yield b"]}"
+
+def results_route(request):
+  try:
+    since = request.query_int(b"since", None, 0)
+    limit = min(request.query_int(b"limit", RESULTS_PAGE, 1), RESULTS_PAGE_MAX)
+  except ValueError:
+    return httpd.BAD_REQUEST
+  # The indexes only hold until the next compaction; the page stops short if one comes first.
+  with results.lock:
+    count = results.count
+    start = results.find(since) if since is not None else max(0, count - limit)
+    end = min(count, start + limit)
+    next_since = results.times[end] if end < count else None
+    generation = results.generation
+  return httpd.Stream("application/json", result_page(start, end, next_since, generation), [("Cache-Control", "no-store")])
+
+def profile_route(request):
+  return httpd.response(json.dumps(last_profile), "application/json", headers=[("Cache-Control", "no-store")])
+
+def batch_route(request):
+  # /batch?plates=N (1 to BATCH_MAX_PLATES) starts a batch when nothing is running; both forms
+  # answer with its progress.
+  try:
+    plates = request.query_int(b"plates", None, 1, BATCH_MAX_PLATES)
+  except ValueError:
+    return httpd.BAD_REQUEST
+  if plates and (experiment is None or experiment.finished):
+    abort.clear()
+    start_run(new_batch(plates))
+  summary = experiment.summary() if isinstance(experiment, batch.BatchRunner) else None
+  return httpd.response(json.dumps(summary), "application/json", headers=[("Cache-Control", "no-store")])
+
+def metrics_route(request):
+  # Prometheus text format; ?format=json gives the summary the dashboard shows.
+  if request.query(b"format") == b"json":
+    return httpd.response(json.dumps(metrics.summary()), "application/json", headers=[("Cache-Control", "no-store")])
+  return httpd.Stream("text/plain; version=0.0.4", metrics.prometheus(), [("Cache-Control", "no-store")])
+
+def memory_route(request):
+  summary = {
+    "enabled": MEMORY_PROFILE,
+    "heap": memstats.snapshot(largest=MEMORY_PROFILE),
+    "requests": request_memory.summary(),
+    "stages": stage_memory.summary(),
+  }
+  return httpd.response(json.dumps(summary), "application/json", headers=[("Cache-Control", "no-store")])
+
+def boot_route(request):
+  return httpd.response(json.dumps(boot.report()), "application/json", headers=[("Cache-Control", "no-store")])
+
+def acquisition_route(request):
+  return httpd.response(json.dumps(acquisition.stats()), "application/json", headers=[("Cache-Control", "no-store")])
+
+# Dispatch table: exact path -> handler. respond(request) returns the response for a request.
+respond = httpd.Router([
+  ("/", index),
+  ("/status", status_route),
+  ("/events", lambda request: events),
+  ("/history", history_route),
+  ("/results", results_route),
+  ("/profile", profile_route),
+  ("/batch", batch_route),
+  ("/metrics", metrics_route),
+  ("/memory", memory_route),
+  ("/acquisition", acquisition_route),
+  ("/boot", boot_route),
+  ("/ws", live_traces.accept),
+], index)
+
+# respond() for the async server, with the heap use of each request recorded when MEMORY_PROFILE
+# is on. Streamed bodies are produced after this returns and are only counted by the blocking loop.
+def answer(request):
+  if not MEMORY_PROFILE:
+    return respond(request)
+  request_memory.begin()
+  response = respond(request)
+  request_memory.end(request.route)
+  return response
+
+# Called by the servers once a response has gone out.
+def time_request(request, t0):
+  REQUEST_TIMES.since(request.route, t0)
+  boot.once("first_response")
+
+# Answers a single client connection. Each response is one complete buffer, sent with a single sendall.
+# The accept loop handles one client at a time, so a single request buffer is reused for all of them.
+request = httpd.Request()
+
+def handle_connection(conn):
+    request.reset()
+    drain_events()
+    if request.receive(conn):
+      t0 = time.ticks_us()
+      if MEMORY_PROFILE:
+        request_memory.begin()
+      response = respond(request)
+      if response is events or isinstance(response, httpd.Upgrade):
+        # This loop cannot hold connections open; the page falls back to polling /status.
+        conn.sendall(httpd.UNAVAILABLE)
+      else:
+        response.send(conn)
+      if MEMORY_PROFILE:
+        request_memory.end(request.route) # streamed bodies included
+      time_request(request, t0)
+    conn.close()
 
-# This section of the code will have minimum changes. 
-while True:
+# Serves clients one at a time, forever. A client that stalls is dropped after CLIENT_TIMEOUT,
+# so it cannot hold up everyone behind it (the stop button among them) for good.
+def serve(s):
+  while True:
     conn, addr = s.accept()
     print('Got a connection from %s' % str(addr))
-    request = conn.recv(1024)
-    if request:
-        request = str(request)
-        print('Content = %s' % request)
-        LED_on = request.find('/?error') # this part of the code could be modified
-        
-        
-# this part of the code could be modified
-    if LED_on == 6: 
-      print('Emergency Stop')
-      reset_leds()
-      data_collection_led.value(0)
-      exit()
-    
-
-# this part of the code remains as it is. 
-    
-    if request.find("/status") == 6:
-        response = get_status()
-        conn.send("HTTP/1.1 200 OK\n")
-        conn.send("Content-Type: application/json\n")
-        conn.send("Connection: close\n\n")
-        conn.sendall(response)
-    else:
-        response = web_page()
-        conn.send("HTTP/1.1 200 OK\n")
-        conn.send("Content-Type: text/html\n")
-        conn.send("Connection: close\n\n")
-        conn.sendall(response)
-    conn.close()
+    conn.settimeout(CLIENT_TIMEOUT)
+    try:
+      handle_connection(conn)
+    except OSError:
+      conn.close()
+
+
+async def serve_async(port, first_run=None, ap=None):
+  await httpd.start_async_server(answer, port, CLIENT_TIMEOUT, observe=time_request)
+  boot.mark("listening")
+  httpd.asyncio.create_task(events.watch())
+  httpd.asyncio.create_task(forward_events())
+  if ap is not None:
+    await wait_for_access_point_async(ap)
+  boot.mark("access_point")
+  for phase in boot_phases(first_run):
+    boot.mark(phase)
+    await httpd.asyncio.sleep(0) # answer whoever is waiting before the next phase
+  while True:
+    await httpd.asyncio.sleep(3600)
+
+# "async" serves every client concurrently with keep-alive and timeouts (httpd.py);
+# "blocking" is the original one-client-at-a-time accept loop.
+SERVER_MODE = "async"
+CLIENT_TIMEOUT = 10 # seconds a client may take to send a request or receive the response
+
+# How the experiment runs next to the web server:
+# "thread" on the second core, "timer" from a machine.Timer, or "task" inside the asyncio server.
+EXPERIMENT_MODE = "thread"
+
+# Starts a stage engine or batch runner the way EXPERIMENT_MODE asks for.
+def start_run(engine):
+  if EXPERIMENT_MODE == "timer":
+    stages.run_timer(engine)
+  elif EXPERIMENT_MODE == "task":
+    httpd.asyncio.create_task(stages.run_async(engine))
+  else:
+    # Start the ADC monitoring function in a separate thread
+    _thread.start_new_thread(stages.run, (engine,))
+
+# The boot phases that can wait until the server is listening. Each yields its name once done, so
+# the async server gets to answer requests in between.
+def boot_phases(first_run):
+  if ACQUIRE_HZ:
+    acquisition.start()
+  yield "sensors"
+  if RESULTS_PATH:
+    results.open()
+  yield "journal"
+  dashboard()
+  yield "page"
+  if first_run:
+    start_run(first_run)
+  yield "ready"
+
+# Boot is phased so the socket is listening, and /status says "Booting", as early as possible:
+# the AP is switched on without waiting for it, the socket is bound, and only then do the AP
+# bring-up, sensors, results journal, dashboard page and experiment follow. The async server
+# answers requests from "listening" on; the blocking loop leaves them in the listen backlog
+# until "ready".
+def main(port=80, mode=None):
+  global EXPERIMENT_MODE
+  if MEMORY_PROFILE:
+    memstats.enable()
+  if STOP_BUTTON is not None:
+    abort.button(machine.Pin(STOP_BUTTON, machine.Pin.IN, machine.Pin.PULL_UP))
+  status_board.publish("Booting", None)
+  ap = start_access_point()
+  boot.mark("hardware")
+  mode = mode or SERVER_MODE
+  if EXPERIMENT_MODE == "task" and mode != "async":
+    EXPERIMENT_MODE = "thread"
+  first_run = new_batch(BATCH_PLATES) if BATCH_PLATES else new_experiment()
+
+  if mode == "async":
+    # Tasks can only be created once the event loop runs.
+    httpd.asyncio.run(serve_async(port, first_run, ap))
+    return
+
+  # Create a socket server
+  s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+  s.bind(('', port))
+  s.listen(5)
+  boot.mark("listening")
+  wait_for_access_point(ap)
+  boot.mark("access_point")
+  for phase in boot_phases(first_run):
+    boot.mark(phase)
+  serve(s)
+
+
+boot.mark("module") # everything above has run
+
+# Runs when the file is started as the program (main.py on the Pico, or `python chromatography.py`
+# on a PC), but not when it is imported by the benchmarks or by the main.py of a precompiled
+# build (tools/build.py), which calls main() itself. Port 80 needs root on a PC.
+if __name__ == "__main__":
+  main(8080 if SIMULATED else 80)
@@ -0,0 +1,99 @@
+# Colour classifier for the light sensor.
+# One classification takes a single burst of readings into a preallocated array, reduces it to
+# one robust value (trimmed mean, or the median when trimmed all the way) and looks that value
+# up in a sorted table of band edges with a binary search. Every decision is made on the same
+# value, so two comparisons can no longer straddle a threshold on different readings.
+#
+# The band table can be fitted from labelled recordings on a PC (tools/calibrate.py) and saved
+# as a small JSON file that load_table() reads at boot, so retuning needs no code change.
+
+from array import array
+
+# Band edges in ADC counts and the colour of each band. A reading below the first edge or at or
+# above the last one is "void". The bands touch, so every reading in between has a colour.
+EDGES = (10000, 24600, 30800, 33100, 34350, 40000)
+COLOURS = ("void", "blue", "red-pink", "yellow", "white", "pink", "void")
+
+
+def lookup(value, edges=EDGES, colours=COLOURS):
+  """Colour of the band `value` falls in (bisect right over the edges, O(log k))."""
+  lo = 0
+  hi = len(edges)
+  while lo < hi:
+    mid = (lo + hi) >> 1
+    if value < edges[mid]:
+      hi = mid
+    else:
+      lo = mid + 1
+  return colours[lo]
+
+
+def load_table(path, edges=EDGES, colours=COLOURS):
+  """(edges, colours) from a table file written by tools/calibrate.py.
+
+  Falls back to the given defaults if the file is missing or not a valid table, so a board
+  without a calibration still classifies.
+  """
+  import json
+  try:
+    with open(path) as f:
+      table = json.load(f)
+    new_edges = tuple(table["edges"])
+    new_colours = tuple(table["colours"])
+  except (OSError, ValueError, KeyError, TypeError):
+    return edges, colours
+  if len(new_colours) != len(new_edges) + 1:
+    return edges, colours
+  for i in range(1, len(new_edges)):
+    if new_edges[i] <= new_edges[i - 1]:
+      return edges, colours
+  return new_edges, new_colours
+
+
+class Classifier:
+  """Classifies the colour under an ADC channel from a burst of `samples` readings.
+
+  `trim` readings are dropped from each end of the sorted burst before averaging; a trim of
+  (samples - 1) // 2 gives the median.
+  """
+
+  def __init__(self, adc, samples=16, trim=4, edges=EDGES, colours=COLOURS):
+    if not 0 <= 2 * trim < samples:
+      raise ValueError("trim must leave at least one sample")
+    self.adc = adc
+    self.buf = array("H", bytes(2 * samples))
+    self.trim = trim
+    self.edges = edges
+    self.colours = colours
+    self.last = 0 # the reduced value behind the latest classification
+
+  def sample(self):
+    """Take one burst and return its trimmed mean."""
+    buf = self.buf
+    read = self.adc.read_u16
+    for i in range(len(buf)):
+      buf[i] = read()
+    return self.reduce()
+
+  def reduce(self):
+    """Trimmed mean of the burst in `buf`, which is sorted in place."""
+    buf = self.buf
+    n = len(buf)
+    for i in range(1, n):
+      # Insertion sort: the burst is small and this needs no extra memory.
+      v = buf[i]
+      j = i
+      while j > 0 and buf[j - 1] > v:
+        buf[j] = buf[j - 1]
+        j -= 1
+      buf[j] = v
+    total = 0
+    for i in range(self.trim, n - self.trim):
+      total += buf[i]
+    return total // (n - 2 * self.trim)
+
+  def classify(self, burst=True):
+    """Colour of a fresh burst, or with burst=False of the readings already put in `buf`
+    (e.g. the newest samples from an acquisition ring)."""
+    self.last = self.sample() if burst else self.reduce()
+    return lookup(self.last, self.edges, self.colours)
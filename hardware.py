@@ -0,0 +1,22 @@
+# Hardware access layer.
+# On the Pico this hands out the real MicroPython modules. Anywhere `machine` is missing (a PC
+# running CPython) the simulated backend in sim.py is used instead, with ordinary CPython sockets
+# and threads, so the same code can be run and measured without a board on the bench.
+#
+# Usage: from hardware import machine, network, socket, time, _thread
+
+import _thread
+
+try:
+  import machine
+  import network
+  import usocket as socket
+  import utime as time
+  SIMULATED = False
+except ImportError:
+  import socket
+  import sim
+  machine = sim
+  network = sim
+  time = sim.clock
+  SIMULATED = True
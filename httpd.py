@@ -0,0 +1,731 @@
+# HTTP helpers for the device web server (blocking and asyncio).
+# Responses are built as complete bytes buffers (status line, headers and body together) so the
+# server can hand each one to the socket with a single sendall(). Things that never change, like
+# the dashboard page, are built once at boot with StaticPage and reused for every request.
+
+try:
+  from binascii import crc32, b2a_base64
+except ImportError:
+  from ubinascii import crc32, b2a_base64
+
+try:
+  from hashlib import sha1
+except ImportError:
+  from uhashlib import sha1
+
+try:
+  import uasyncio as asyncio
+except ImportError:
+  import asyncio
+
+from hardware import time
+
+
+def header(request, name):
+  """Return the value of header `name` from a raw request, or None.
+
+  Browsers send headers in their canonical case ("Accept-Encoding"), so that spelling and the
+  all lower case one are searched for directly instead of lower-casing a copy of the request.
+  """
+  if isinstance(request, Request):
+    return request.header(name)
+  i = request.find(b"\r\n" + name + b":")
+  if i < 0:
+    i = request.find(b"\r\n" + name.lower() + b":")
+    if i < 0:
+      return None
+  start = i + len(name) + 3
+  end = request.find(b"\r\n", start)
+  if end < 0:
+    end = len(request)
+  return request[start:end].strip()
+
+
+class Response:
+  """A complete response kept ready to send.
+
+  `data` is the whole `Connection: close` response for a single sendall(). Keep-alive
+  connections write `keep_head` followed by `body`, a view into `data`, so the body is never
+  stored twice.
+  """
+
+  def __init__(self, body, content_type, status="200 OK", headers=()):
+    if isinstance(body, str):
+      body = body.encode()
+    head = "HTTP/1.1 %s\r\nContent-Type: %s\r\n" % (status, content_type)
+    if not status.startswith("304"):
+      # A 304 has no body, and a Content-Length on it would describe the full representation.
+      head += "Content-Length: %d\r\n" % len(body)
+    for name, value in headers:
+      head += "%s: %s\r\n" % (name, value)
+    close_head = (head + "Connection: close\r\n\r\n").encode()
+    self.data = close_head + body
+    self.keep_head = (head + "Connection: keep-alive\r\n\r\n").encode()
+    self.body = memoryview(self.data)[len(close_head):]
+
+  def send(self, conn):
+    conn.sendall(self.data)
+
+
+def query(request, name):
+  """Return the value of query parameter `name` from the request line, or None."""
+  if isinstance(request, Request):
+    return request.query(name)
+  line_end = request.find(b"\r\n")
+  if line_end < 0:
+    line_end = len(request)
+  q = request.find(b"?", 0, line_end)
+  if q < 0:
+    return None
+  path_end = request.find(b" ", q)
+  if path_end < 0 or path_end > line_end:
+    path_end = line_end
+  i = q
+  while i >= 0:
+    if request.startswith(name + b"=", i + 1):
+      start = i + 2 + len(name)
+      end = request.find(b"&", start, path_end)
+      return request[start:end if end >= 0 else path_end]
+    i = request.find(b"&", i + 1, path_end)
+  return None
+
+
+class Stream:
+  """A response whose body is produced chunk by chunk while it is being sent.
+
+  There is no Content-Length; the body ends when the connection closes, so the whole body is
+  never held in memory. `chunks` is an iterable of bytes-like objects.
+  """
+
+  def __init__(self, content_type, chunks, headers=()):
+    head = "HTTP/1.1 200 OK\r\nContent-Type: %s\r\n" % content_type
+    for name, value in headers:
+      head += "%s: %s\r\n" % (name, value)
+    self.head = (head + "Connection: close\r\n\r\n").encode()
+    self.chunks = chunks
+
+  def send(self, conn):
+    conn.sendall(self.head)
+    for chunk in self.chunks:
+      conn.sendall(chunk)
+
+  async def stream(self, writer, timeout):
+    writer.write(self.head)
+    for chunk in self.chunks:
+      writer.write(chunk)
+      await asyncio.wait_for(writer.drain(), timeout)
+    await asyncio.wait_for(writer.drain(), timeout)
+
+
+def response(body, content_type, status="200 OK", headers=()):
+  """Build a Response. `body` may be str or bytes."""
+  return Response(body, content_type, status, headers)
+
+
+def gzip_compress(data):
+  """Gzip `data` with whatever the platform offers, or return None if it cannot compress."""
+  try:
+    import gzip
+    return gzip.compress(data, 9, mtime=0)
+  except (ImportError, TypeError, AttributeError):
+    pass
+  try:
+    # MicroPython: the deflate module can only compress if the firmware was built with it.
+    import deflate
+    import io
+    buf = io.BytesIO()
+    with deflate.DeflateIO(buf, deflate.GZIP) as f:
+      f.write(data)
+    return buf.getvalue()
+  except Exception:
+    return None
+
+
+class StaticPage:
+  """A page rendered once into ready-to-send responses: plain, gzipped and 304 Not Modified.
+
+  The plain and gzipped bodies are different representations, so each has its own ETag (the
+  gzipped one ends in "-gz") and a 304 confirms only the one the client holds.
+  """
+
+  def __init__(self, html, content_type="text/html; charset=utf-8", gzip=True):
+    body = html.encode() if isinstance(html, str) else html
+    tag = "%08x" % (crc32(body) & 0xffffffff)
+    self.etag = '"%s"' % tag
+    self.gzip_etag = '"%s-gz"' % tag
+    cache = [("Cache-Control", "no-cache"), ("Vary", "Accept-Encoding")]
+    self.plain = response(body, content_type, headers=cache + [("ETag", self.etag)])
+    self.not_modified = response(b"", content_type, "304 Not Modified", cache + [("ETag", self.etag)])
+    self.gzipped = None
+    self.gzip_not_modified = None
+    packed = gzip_compress(body) if gzip else None
+    if packed and len(packed) < len(body):
+      gz = cache + [("ETag", self.gzip_etag)]
+      self.gzipped = response(packed, content_type, headers=gz + [("Content-Encoding", "gzip")])
+      self.gzip_not_modified = response(b"", content_type, "304 Not Modified", gz)
+    self.etag_bytes = self.etag.encode()
+    self.gzip_etag_bytes = self.gzip_etag.encode()
+
+  def select(self, request):
+    """Pick the response that suits the request headers.
+
+    The representation is chosen first, so a 304 is only sent for the one the client would get.
+    """
+    known = header(request, b"If-None-Match")
+    if self.gzipped:
+      encodings = header(request, b"Accept-Encoding")
+      if encodings and b"gzip" in encodings:
+        if known and self.gzip_etag_bytes in known:
+          return self.gzip_not_modified
+        return self.gzipped
+    if known and self.etag_bytes in known:
+      return self.not_modified
+    return self.plain
+
+
+# -------------------------------------------------------------------------
+# Request parsing and routing
+# Requests are received straight into one reusable buffer and parsed in place: the request line
+# is recorded as offsets into the buffer, headers are searched for where they lie, and values
+# are only copied out when a handler asks for them. A request split over several reads is
+# simply completed by the next read, and bytes of a pipelined next request are kept for it.
+
+MAX_REQUEST = 2048 # bytes of request line + headers accepted before the connection is dropped
+
+# Answer to a request line that cannot be parsed; the connection is closed after it.
+BAD_REQUEST = response(b"", "text/plain", "400 Bad Request")
+
+
+def _scan(buf, sub, start, end):
+  """bytearray.find() for MicroPython builds that do not have it."""
+  n = len(sub)
+  first = sub[0]
+  for i in range(start, end - n + 1):
+    if buf[i] == first:
+      j = 1
+      while j < n and buf[i + j] == sub[j]:
+        j += 1
+      if j == n:
+        return i
+  return -1
+
+
+class Request:
+  """An HTTP request parsed in place in a reusable buffer.
+
+  Fill it with receive() (blocking socket), read() (asyncio stream) or feed() (bytes); they
+  return True once the headers are complete. After the response, next() makes room for the
+  following request on the same connection.
+  """
+
+  def __init__(self, size=MAX_REQUEST):
+    self.buf = bytearray(size)
+    self.view = memoryview(self.buf)
+    buf = self.buf
+    self._find = buf.find if hasattr(buf, "find") else lambda sub, start, end: _scan(buf, sub, start, end)
+    self.reset()
+
+  def reset(self):
+    self.size = 0 # bytes held in buf
+    self.end = 0 # end of the headers (just past the blank line), 0 until they are complete
+    self.scan = 0 # where the search for the blank line carries on
+    self.skip = 0 # body bytes of the last request still to be dropped
+    self.valid = False
+    self.route = None # name of the route that answered it, set by Router
+
+  def _received(self, n):
+    """Take in `n` new bytes at buf[size:]. Returns True once the headers are complete."""
+    size = self.size
+    if self.skip:
+      dropped = min(self.skip, n)
+      self.skip -= dropped
+      n -= dropped
+      if n:
+        self.view[size:size + n] = self.view[size + dropped:size + dropped + n]
+    self.size = size + n
+    return self.end > 0 or self._parse()
+
+  def feed(self, data):
+    """Append bytes; returns True once the headers are complete. False also when full."""
+    n = min(len(data), len(self.buf) - self.size)
+    self.view[self.size:self.size + n] = data[:n] if n < len(data) else data
+    return self._received(n)
+
+  def full(self):
+    return not self.end and self.size >= len(self.buf)
+
+  def receive(self, conn):
+    """Read from a blocking socket until the headers are complete.
+
+    Returns False if the client closes the connection first or the headers do not fit.
+    """
+    into = getattr(conn, "recv_into", None) or getattr(conn, "readinto", None)
+    while not self.end:
+      if self.full():
+        return False
+      if into:
+        n = into(self.view[self.size:])
+      else:
+        data = conn.recv(len(self.buf) - self.size)
+        n = len(data)
+        self.view[self.size:self.size + n] = data
+      if not n:
+        return False
+      self._received(n)
+    return True
+
+  async def read(self, reader):
+    """Like receive() for an asyncio stream; uses readinto() where the stream has it (uasyncio)."""
+    readinto = getattr(reader, "readinto", None)
+    while not self.end:
+      if self.full():
+        return False
+      if readinto:
+        n = await readinto(self.view[self.size:])
+      else:
+        data = await reader.read(len(self.buf) - self.size)
+        n = len(data)
+        self.view[self.size:self.size + n] = data
+      if not n:
+        return False
+      self._received(n)
+    return True
+
+  def next(self):
+    """Drop the request that has been answered, keeping any bytes that follow it."""
+    start = self.end + self.skip
+    if start > self.size:
+      self.skip = start - self.size
+      start = self.size
+    else:
+      self.skip = 0
+    rest = self.size - start
+    if rest:
+      self.view[:rest] = self.view[start:self.size]
+    self.size = rest
+    self.end = 0
+    self.scan = 0
+    self.valid = False
+    if rest:
+      self._parse()
+
+  def _parse(self):
+    buf = self.buf
+    find = self._find
+    # Skip blank lines left between keep-alive requests.
+    while self.size >= 2 and buf[0] == 13 and buf[1] == 10:
+      self.view[:self.size - 2] = self.view[2:self.size]
+      self.size -= 2
+    end = find(b"\r\n\r\n", max(0, self.scan - 3), self.size)
+    if end < 0:
+      self.scan = self.size
+      return False
+    end += 4
+    self.end = end
+    line_end = find(b"\r\n", 0, end)
+    self.line_end = line_end
+    method_end = find(b" ", 0, line_end)
+    target_end = line_end
+    version = line_end
+    if method_end > 0:
+      space = find(b" ", method_end + 1, line_end)
+      if space > 0:
+        target_end = space
+        version = space + 1
+    self.method_end = method_end
+    self.target_end = target_end
+    self.version = version
+    self.valid = method_end > 0 and target_end > method_end + 1 and buf[method_end + 1] == 47 # "/"
+    q = find(b"?", method_end + 1, target_end) if self.valid else -1
+    self.path_end = q if q >= 0 else target_end
+
+    # Only a request with a body needs its headers looked at before the handler runs.
+    if find(b"ength:", line_end, end) > 0 or find(b"ENGTH:", line_end, end) > 0:
+      length = self.header(b"Content-Length")
+      if length:
+        try:
+          self.skip = int(length)
+        except ValueError:
+          self.valid = False
+    return True
+
+  def method(self):
+    return bytes(self.view[:self.method_end])
+
+  def path(self):
+    return bytes(self.view[self.method_end + 1:self.path_end])
+
+  def path_is(self, path):
+    """True if the path (without the query) is exactly `path`; compares in place."""
+    start = self.method_end + 1
+    return self.path_end - start == len(path) and self._find(path, start, self.path_end) == start
+
+  def header(self, name):
+    """Value of header `name` as bytes, or None.
+
+    Like header() above, the name is looked for in the spelling given and in lower case; it is
+    searched for in place and must start a line and be followed by a colon.
+    """
+    i = self._header(name)
+    if i < 0:
+      i = self._header(name.lower())
+      if i < 0:
+        return None
+    buf = self.buf
+    start = i + len(name) + 1
+    stop = self._find(b"\r\n", start, self.end)
+    while start < stop and buf[start] == 32:
+      start += 1
+    while stop > start and buf[stop - 1] == 32:
+      stop -= 1
+    return bytes(self.view[start:stop])
+
+  def _header(self, name):
+    find = self._find
+    buf = self.buf
+    n = len(name)
+    i = find(name, self.line_end + 2, self.end)
+    while i > 0:
+      if buf[i - 1] == 10 and buf[i + n] == 58: # at the start of a line and followed by ":"
+        return i
+      i = find(name, i + 1, self.end)
+    return -1
+
+  def query_int(self, name, default=None, low=None, high=None):
+    """Query parameter `name` as an int, or `default` if it is absent.
+
+    Raises ValueError if it is not a whole number between `low` and `high`, so a handler can
+    answer BAD_REQUEST instead of letting a typo in a URL take the server down.
+    """
+    value = self.query(name)
+    if value is None:
+      return default
+    value = int(value)
+    if (low is not None and value < low) or (high is not None and value > high):
+      raise ValueError("out of range")
+    return value
+
+  def query(self, name):
+    """Value of query parameter `name` as bytes, b"" if it has no value, or None if absent."""
+    find = self._find
+    end = self.target_end
+    i = self.path_end
+    n = len(name)
+    while 0 <= i < end:
+      start = i + 1
+      stop = find(b"&", start, end)
+      if stop < 0:
+        stop = end
+      if find(name, start, stop) == start:
+        if start + n == stop:
+          return b""
+        if self.buf[start + n] == 61: # "="
+          return bytes(self.view[start + n + 1:stop])
+      i = stop
+    return None
+
+  def keep_alive(self):
+    """HTTP/1.1 keeps the connection open unless asked not to; HTTP/1.0 only when asked to."""
+    connection = self.header(b"Connection")
+    if connection is not None:
+      connection = connection.lower()
+      if connection == b"close":
+        return False
+      if connection == b"keep-alive":
+        return True
+    return self._find(b"HTTP/1.1", self.version, self.line_end) == self.version
+
+
+def parse(data):
+  """A Request parsed from complete request bytes (for tests and benchmarks)."""
+  request = Request(max(MAX_REQUEST, len(data)))
+  request.feed(data)
+  return request
+
+
+class Router:
+  """Dispatch table from exact paths to handlers. Every handler takes the Request and returns a
+  response; `default` answers paths that are not in the table.
+
+  The path of the route taken (or "other") is left in request.route, e.g. to label timings.
+  """
+
+  def __init__(self, routes, default):
+    self.routes = [(path.encode(), handler, path) for path, handler in routes]
+    self.default = default
+
+  def __call__(self, request):
+    if not request.valid:
+      request.route = "bad"
+      return BAD_REQUEST
+    for path, handler, name in self.routes:
+      if request.path_is(path):
+        request.route = name
+        return handler(request)
+    request.route = "other"
+    return self.default(request)
+
+
+# -------------------------------------------------------------------------
+# Asynchronous server
+# One task per connection, so a slow client only ever stalls itself. Works with uasyncio on the
+# board and asyncio on CPython. Connections are kept alive between requests (HTTP/1.1 default)
+# and every read and write is bounded by a timeout.
+
+async def handle_client(reader, writer, handler, timeout, observe=None):
+  request = Request()
+  try:
+    while True:
+      if not await asyncio.wait_for(request.read(reader), timeout):
+        break
+      t0 = time.ticks_us()
+      response = handler(request)
+      keep = response is not BAD_REQUEST and request.keep_alive()
+      if isinstance(response, (EventSource, Stream)):
+        await response.stream(writer, timeout)
+        break
+      if isinstance(response, Upgrade):
+        await response.run(reader, writer, timeout)
+        break
+      if keep:
+        writer.write(response.keep_head)
+        writer.write(response.body)
+      else:
+        writer.write(response.data)
+      await asyncio.wait_for(writer.drain(), timeout)
+      if observe:
+        observe(request, t0)
+      if not keep:
+        break
+      request.next()
+  except (asyncio.TimeoutError, OSError):
+    pass
+  finally:
+    writer.close()
+    try:
+      await writer.wait_closed()
+    except OSError:
+      pass
+
+
+async def start_async_server(handler, port=80, timeout=10, host="0.0.0.0", backlog=5, observe=None):
+  """Start serving `handler(Request) -> Response` and return the server object.
+
+  observe(request, t0_us), if given, is called after each response has been sent (not for
+  streams and event sources), with the time.ticks_us() at which the request was complete.
+  """
+  return await asyncio.start_server(
+    lambda reader, writer: handle_client(reader, writer, handler, timeout, observe),
+    host, port, backlog=backlog)
+
+
+async def serve_forever(handler, port=80, timeout=10, observe=None):
+  await start_async_server(handler, port, timeout, observe=observe)
+  while True:
+    await asyncio.sleep(3600)
+
+
+# -------------------------------------------------------------------------
+# Server-Sent Events
+# One long-lived connection per dashboard instead of a new connection per status poll. A single
+# watcher task samples `snapshot()` every `period_ms` and, only when the value has changed,
+# renders one frame that is shared by every subscribed client.
+
+UNAVAILABLE = b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+
+
+class EventSource:
+  HEAD = (b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-store\r\n"
+          b"Connection: keep-alive\r\n\r\nretry: 2000\n\n")
+  PING = b": ping\n\n"
+
+  def __init__(self, snapshot, render, period_ms=250, ping_s=15, max_clients=4):
+    self.snapshot = snapshot # returns a comparable value, e.g. a tuple of states
+    self.render = render # value -> bytes payload of one event
+    self.period_ms = period_ms
+    self.ping_s = ping_s
+    self.max_clients = max_clients
+    self.clients = 0
+    self.version = 0
+    self.frame = None
+    self.last = None
+    self.changed = asyncio.Event()
+
+  def update(self):
+    """Check for a new value; returns True (and wakes the clients) when it changed."""
+    value = self.snapshot()
+    if self.frame is not None and value == self.last:
+      return False
+    self.last = value
+    self.frame = b"data: " + self.render(value) + b"\n\n"
+    self.version += 1
+    self.changed.set()
+    self.changed.clear()
+    return True
+
+  async def watch(self):
+    while True:
+      self.update()
+      await asyncio.sleep(self.period_ms / 1000)
+
+  async def stream(self, writer, timeout):
+    """Serve one subscriber until it goes away or stops reading."""
+    if self.clients >= self.max_clients:
+      # Too many sockets held open already; the page falls back to polling /status.
+      writer.write(UNAVAILABLE)
+      await asyncio.wait_for(writer.drain(), timeout)
+      return
+    self.clients += 1
+    try:
+      if self.frame is None:
+        self.update()
+      writer.write(self.HEAD)
+      seen = -1
+      while True:
+        if seen != self.version:
+          seen = self.version
+          writer.write(self.frame)
+        await asyncio.wait_for(writer.drain(), timeout)
+        try:
+          await asyncio.wait_for(self.changed.wait(), self.ping_s)
+        except asyncio.TimeoutError:
+          writer.write(self.PING) # also finds clients that have silently gone away
+    except (asyncio.TimeoutError, OSError):
+      pass
+    finally:
+      self.clients -= 1
+
+
+# -------------------------------------------------------------------------
+# WebSocket
+# Binary messages pushed to the browser over one upgraded connection (RFC 6455, server to client
+# only). Each client gets its own task that asks `source` for a message every `period_ms`. A
+# client that cannot keep up is never waited for: when sending the last message took longer than
+# the period (or it is still queued), the stride passed to the source doubles (up to max_stride), so the source sends
+# every second, fourth, ... sample or skips ahead; once the client catches up it halves again.
+# The source only reads what the producer has already stored, so the producer is never held up.
+
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def websocket_accept(key):
+  """Sec-WebSocket-Accept value for a Sec-WebSocket-Key."""
+  return b2a_base64(sha1(key + WS_GUID).digest()).strip()
+
+
+def ws_head(length, opcode=0x2):
+  """Header of an unmasked, final server frame (binary by default)."""
+  if length < 126:
+    return bytes((0x80 | opcode, length))
+  if length < 65536:
+    return bytes((0x80 | opcode, 126, length >> 8, length & 0xff))
+  return bytes((0x80 | opcode, 127, 0, 0, 0, 0, length >> 24, (length >> 16) & 0xff, (length >> 8) & 0xff, length & 0xff))
+
+
+def _queued(writer):
+  # Bytes written but not yet taken by the network. uasyncio's drain() only returns once it has
+  # written everything, so there this is always 0 and the time drain() took tells instead.
+  transport = getattr(writer, "transport", None)
+  return transport.get_write_buffer_size() if transport else 0
+
+
+class Upgrade:
+  """A response that takes the connection over (101 Switching Protocols)."""
+
+  def __init__(self, socket, key):
+    self.socket = socket
+    self.key = key
+
+  async def run(self, reader, writer, timeout):
+    await self.socket.serve(self.key, reader, writer, timeout)
+
+
+class WebSocket:
+  """Streams binary messages to every client that opens it.
+
+  source(cursor, stride, buf) fills `buf` with the next message for a client whose position is
+  `cursor` (None for a new client) and returns (length, new cursor); a length of 0 sends nothing.
+  """
+
+  def __init__(self, source, buffer_size=1024, period_ms=100, max_stride=16, max_clients=2):
+    self.source = source
+    self.buffer_size = buffer_size
+    self.period_ms = period_ms
+    self.max_stride = max_stride
+    self.max_clients = max_clients
+    self.clients = 0
+    self.sent = 0 # messages sent, all clients
+    self.slowed = 0 # times a client's stride was raised
+
+  def accept(self, request):
+    """The response to a request for the socket: an Upgrade, or 400 if it is not a WebSocket request."""
+    key = request.header(b"Sec-WebSocket-Key")
+    if not key:
+      return BAD_REQUEST
+    return Upgrade(self, bytes(key))
+
+  async def serve(self, key, reader, writer, timeout):
+    if self.clients >= self.max_clients:
+      writer.write(UNAVAILABLE)
+      await asyncio.wait_for(writer.drain(), timeout)
+      return
+    self.clients += 1
+    closed = []
+    listener = asyncio.create_task(self._listen(reader, writer, closed))
+    try:
+      writer.write(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                   b"Sec-WebSocket-Accept: " + websocket_accept(key) + b"\r\n\r\n")
+      await asyncio.wait_for(writer.drain(), timeout)
+      buf = bytearray(self.buffer_size)
+      view = memoryview(buf)
+      cursor = None
+      stride = 1
+      period_us = self.period_ms * 1000
+      while not closed:
+        n, cursor = self.source(cursor, stride, buf)
+        if n:
+          t0 = time.ticks_us()
+          writer.write(ws_head(n))
+          writer.write(view[:n])
+          await asyncio.wait_for(writer.drain(), timeout)
+          self.sent += 1
+          if time.ticks_diff(time.ticks_us(), t0) > period_us or _queued(writer) > self.buffer_size:
+            if stride < self.max_stride:
+              stride *= 2
+              self.slowed += 1
+          elif stride > 1:
+            stride //= 2
+        await asyncio.sleep(self.period_ms / 1000)
+      writer.write(ws_head(0, 0x8)) # close
+      await asyncio.wait_for(writer.drain(), timeout)
+    except (asyncio.TimeoutError, OSError):
+      pass
+    finally:
+      listener.cancel()
+      self.clients -= 1
+
+  async def _listen(self, reader, writer, closed):
+    # Client frames: answer pings and note a close; any data the client sends is ignored.
+    try:
+      while True:
+        head = await reader.readexactly(2)
+        length = head[1] & 0x7f
+        if length == 126:
+          length = int.from_bytes(await reader.readexactly(2), "big")
+        elif length == 127:
+          length = int.from_bytes(await reader.readexactly(8), "big")
+        mask = await reader.readexactly(4) if head[1] & 0x80 else None
+        payload = bytearray(await reader.readexactly(length)) if length else bytearray()
+        if mask:
+          for i in range(length):
+            payload[i] ^= mask[i & 3]
+        opcode = head[0] & 0x0f
+        if opcode == 0x8:
+          break
+        if opcode == 0x9:
+          writer.write(ws_head(len(payload), 0xa) + payload)
+    except (EOFError, OSError, ValueError):
+      pass
+    except asyncio.CancelledError:
+      return
+    closed.append(True)
@@ -0,0 +1,212 @@
+# Append-only journal of experiment results on flash.
+# One fixed-size binary record per finished run, appended to a file as the run ends:
+#
+#   FORMAT "<II5IBBH"  run id, time (seconds, time.time()), ms spent in each of up to 5 stages,
+#                      colour (1 + index into the colour names, 0 for none), outcome, reserved
+#   then a CRC32 of those 32 bytes (uint32); 36 bytes a record, little endian
+#
+# Power loss in the middle of an append leaves at most one short or corrupt record at the end
+# of the file. Opening the journal stops at the first record whose CRC does not match, and the
+# next append overwrites it, so a torn record is never read back. Times are kept strictly
+# increasing (a clock that was set back, or starts over after a reboot without an RTC, gets
+# the previous time plus one), so the index of times is sorted and a time names one record.
+#
+# The index is just that array of times, one uint32 per record, plus the newest record decoded:
+# latest() is O(1), find(t) a binary search, and a page of records is read from the file a
+# few at a time. Once the file holds `max_records` records the newest `keep_records` are copied
+# to a new file that then replaces the old one (compact()); a copy cut short by power loss is
+# thrown away on the next open, one that was complete is put in place.
+
+import os
+import struct
+from array import array
+
+try:
+  from binascii import crc32
+except ImportError:
+  from ubinascii import crc32
+
+from hardware import time, _thread
+
+STAGE_SLOTS = 5
+BODY_FORMAT = "<II%dIBBH" % STAGE_SLOTS
+BODY_SIZE = struct.calcsize(BODY_FORMAT)
+RECORD_SIZE = BODY_SIZE + 4
+
+# Outcomes.
+COMPLETE = 0
+TIMED_OUT = 1
+STOPPED = 2
+OUTCOMES = ("complete", "timed out", "stopped")
+
+
+def _exists(path):
+  try:
+    os.stat(path)
+    return True
+  except OSError:
+    return False
+
+
+def _remove(path):
+  try:
+    os.remove(path)
+  except OSError:
+    pass
+
+
+class Journal:
+  """Results journal in the file at `path`. Call open() once before using it."""
+
+  def __init__(self, path, max_records=1000, keep_records=500):
+    self.path = path
+    self.max_records = max_records
+    self.keep_records = keep_records
+    self.times = array("I", bytes(4 * max_records)) # time of every record in the file, in order
+    self.count = 0 # records in the file
+    self.last = None # newest record, decoded
+    self.generation = 0 # bumped by compact(); readers of the old file stop
+    self.torn = False # open() found a torn record at the end of the file
+    self.ready = False # set by open()
+    self.lock = _thread.allocate_lock()
+    self.buf = bytearray(RECORD_SIZE)
+
+  def open(self):
+    """Recover from an interrupted compaction, then index every intact record."""
+    new = self.path + ".new"
+    if _exists(new):
+      if _exists(self.path):
+        _remove(new) # the copy may be incomplete; the old file is still whole
+      else:
+        os.rename(new, self.path) # the old file was already removed
+    self.count = 0
+    self.last = None
+    self.torn = False
+    self.ready = True
+    if not _exists(self.path):
+      with open(self.path, "wb"):
+        pass
+      return self
+    with open(self.path, "rb") as f:
+      while self.count < self.max_records:
+        n = f.readinto(self.buf)
+        if not n:
+          break
+        record = self._decode(self.buf) if n == RECORD_SIZE else None
+        if record is None or (self.count and record[1] <= self.times[self.count - 1]):
+          self.torn = True
+          break
+        self.times[self.count] = record[1]
+        self.count += 1
+        self.last = record
+    return self
+
+  def _decode(self, buf):
+    """(run, time, durations, colour, outcome) from one record, or None if its CRC is wrong."""
+    if struct.unpack_from("<I", buf, BODY_SIZE)[0] != crc32(memoryview(buf)[:BODY_SIZE]) & 0xffffffff:
+      return None
+    fields = struct.unpack_from(BODY_FORMAT, buf)
+    return fields[0], fields[1], fields[2:2 + STAGE_SLOTS], fields[2 + STAGE_SLOTS], fields[3 + STAGE_SLOTS]
+
+  def append(self, durations, colour=0, outcome=COMPLETE, now=None):
+    """Add the result of a run. `durations` are ms per stage slot. Returns the record."""
+    with self.lock:
+      if self.count >= self.max_records:
+        self._compact()
+      last = self.last
+      run = last[0] + 1 if last else 1
+      t = time.time() if now is None else now
+      if last and t <= last[1]:
+        t = last[1] + 1
+      slots = [0] * STAGE_SLOTS
+      for i in range(min(len(durations), STAGE_SLOTS)):
+        slots[i] = durations[i]
+      buf = self.buf
+      struct.pack_into(BODY_FORMAT, buf, 0, run, t, *slots, colour, outcome, 0)
+      struct.pack_into("<I", buf, BODY_SIZE, crc32(memoryview(buf)[:BODY_SIZE]) & 0xffffffff)
+      # Written at the end of the intact records, over a torn one if open() found it.
+      with open(self.path, "r+b") as f:
+        f.seek(self.count * RECORD_SIZE)
+        f.write(buf)
+      self.times[self.count] = t
+      self.count += 1
+      self.torn = False
+      self.last = (run, t, tuple(slots), colour, outcome)
+      return self.last
+
+  def latest(self):
+    """The newest record, or None."""
+    return self.last
+
+  def find(self, since):
+    """Index of the first record with a time at or after `since`."""
+    lo = 0
+    hi = self.count
+    times = self.times
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if times[mid] < since:
+        lo = mid + 1
+      else:
+        hi = mid
+    return lo
+
+  def records(self, start, end, generation=None, chunk_records=8):
+    """Records with indexes start..end-1, read from the file `chunk_records` at a time.
+
+    The file is opened again for every chunk, with the lock held, so an append or compaction
+    can happen between two chunks. After a compaction the indexes mean other records, so the
+    iterator simply stops; the client asks again by time. `generation` is the one the indexes
+    were worked out in; by default the current one, taken now rather than at the first read.
+    """
+    if generation is None:
+      generation = self.generation
+    return self._read(start, end, generation, chunk_records)
+
+  def _read(self, start, end, generation, chunk_records):
+    buf = bytearray(chunk_records * RECORD_SIZE)
+    view = memoryview(buf)
+    while start < end:
+      n = min(end - start, chunk_records)
+      with self.lock:
+        if self.generation != generation:
+          return
+        with open(self.path, "rb") as f:
+          f.seek(start * RECORD_SIZE)
+          f.readinto(view[:n * RECORD_SIZE])
+      for i in range(n):
+        record = self._decode(view[i * RECORD_SIZE:(i + 1) * RECORD_SIZE])
+        if record is None:
+          return
+        yield record
+      start += n
+
+  def compact(self):
+    with self.lock:
+      self._compact()
+
+  def _compact(self):
+    """Keep only the newest keep_records: copy them to a new file, then swap it in."""
+    keep = min(self.keep_records, self.count)
+    drop = self.count - keep
+    new = self.path + ".new"
+    buf = bytearray(16 * RECORD_SIZE)
+    view = memoryview(buf)
+    with open(self.path, "rb") as src, open(new, "wb") as dst:
+      src.seek(drop * RECORD_SIZE)
+      left = keep * RECORD_SIZE
+      while left:
+        n = src.readinto(view[:min(left, len(buf))])
+        if not n:
+          break
+        dst.write(view[:n])
+        left -= n
+    # littlefs renames over an existing file; FAT needs the old one removed first.
+    try:
+      os.rename(new, self.path)
+    except OSError:
+      os.remove(self.path)
+      os.rename(new, self.path)
+    self.times[:keep] = self.times[drop:self.count]
+    self.count = keep
+    self.generation += 1
@@ -0,0 +1,160 @@
+# Heap instrumentation.
+# In memory-profiling mode the web server and the experiment record, per request route and per
+# stage, how much heap was allocated, how often the garbage collector ran, and how much heap
+# and how large a single free block was left afterwards. /memory serves the figures and
+# benchmarks/bench_memory.py checks them on a PC.
+#
+# On the board the figures come from gc.mem_alloc()/gc.mem_free(). MicroPython has no counter
+# of collections, so a collection is counted whenever mem_alloc() has gone down since the last
+# reading. On a PC tracemalloc stands in: allocated bytes are the traced memory above the start
+# of the span (its peak, for request spans), free memory is HEAP_BYTES minus what is traced,
+# and collections are read from gc.get_stats().
+
+import gc
+
+try:
+  mem_free = gc.mem_free
+  mem_alloc = gc.mem_alloc
+  collections = None
+  tracemalloc = None
+except AttributeError:
+  import tracemalloc
+
+  HEAP_BYTES = 192 * 1024 # about what a Pico W has left for Python once the network is up
+
+  def mem_alloc():
+    return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+
+  def mem_free():
+    return max(0, HEAP_BYTES - mem_alloc())
+
+  def collections():
+    return sum(s["collections"] for s in gc.get_stats())
+
+
+def enable():
+  """Start tracing allocations where that has to be switched on (PC)."""
+  if tracemalloc and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+
+def largest_free(step=64):
+  """Size of the largest block that can be allocated right now, to within `step` bytes.
+
+  Found by binary search with trial allocations, so it takes a dozen allocations (and on the
+  board a failed one runs the collector): call it outside the spans being measured. On a PC
+  nothing is fragmented and this comes out as mem_free().
+  """
+  lo = 0
+  hi = mem_free()
+  if tracemalloc:
+    return hi
+  while hi - lo > step:
+    mid = (lo + hi) // 2
+    try:
+      block = bytearray(mid)
+      del block
+      lo = mid
+    except MemoryError:
+      hi = mid
+  return lo
+
+
+class Usage:
+  """Totals for one route or stage."""
+
+  def __init__(self):
+    self.count = 0
+    self.alloc_bytes = 0
+    self.max_alloc_bytes = 0
+    self.gc_runs = 0
+    self.min_free_bytes = -1
+    self.min_largest_bytes = -1
+
+  def summary(self):
+    return {
+      "count": self.count,
+      "mean_alloc_bytes": self.alloc_bytes // self.count if self.count else 0,
+      "max_alloc_bytes": self.max_alloc_bytes,
+      "gc_runs": self.gc_runs,
+      "min_free_bytes": self.min_free_bytes,
+      "min_largest_block_bytes": self.min_largest_bytes,
+    }
+
+
+class Tracker:
+  """Records begin()..end(label) spans into a Usage per label. One span at a time.
+
+  collect=True runs the collector at begin(), so nothing is freed during a short span and the
+  mem_alloc() difference is what the span allocated (on the board). peak=True measures the
+  span by the tracemalloc peak on a PC; only one tracker may do that, since the peak is shared.
+  Without it a span records how much the heap grew, which suits long spans such as stages.
+  probe=True also records the largest free block after each span (largest_free()); the trial
+  allocations take most of the heap for a moment, so only one core should probe, and only
+  while profiling.
+  """
+
+  def __init__(self, collect=False, probe=False, peak=False):
+    self.collect = collect
+    self.probe = probe
+    self.peak = peak
+    self.usage = {}
+    self.start_alloc = 0
+    self.start_runs = 0
+    self.last_alloc = 0
+    self.gc_runs = 0 # collections seen by this tracker, all spans together
+
+  def _runs(self, alloc):
+    # Board: a drop in mem_alloc() since the last reading means the collector ran.
+    if collections:
+      return collections()
+    if alloc < self.last_alloc:
+      self.gc_runs += 1
+    self.last_alloc = alloc
+    return self.gc_runs
+
+  def begin(self):
+    if self.collect:
+      gc.collect()
+    alloc = mem_alloc()
+    self.start_runs = self._runs(alloc)
+    if tracemalloc and self.peak:
+      tracemalloc.reset_peak()
+    self.start_alloc = alloc
+
+  def end(self, label):
+    if tracemalloc and self.peak:
+      alloc = tracemalloc.get_traced_memory()[1] # peak since begin()
+    else:
+      alloc = mem_alloc()
+    runs = self._runs(alloc)
+    used = max(0, alloc - self.start_alloc)
+    free = mem_free()
+    largest = largest_free() if self.probe else -1
+    usage = self.usage.get(label)
+    if usage is None:
+      usage = self.usage[label] = Usage()
+    usage.count += 1
+    usage.alloc_bytes += used
+    if used > usage.max_alloc_bytes:
+      usage.max_alloc_bytes = used
+    usage.gc_runs += runs - self.start_runs
+    if usage.min_free_bytes < 0 or free < usage.min_free_bytes:
+      usage.min_free_bytes = free
+    if largest >= 0 and (usage.min_largest_bytes < 0 or largest < usage.min_largest_bytes):
+      usage.min_largest_bytes = largest
+    return used
+
+  def summary(self):
+    return {label: usage.summary() for label, usage in self.usage.items()}
+
+
+def snapshot(largest=False):
+  """The heap right now; with largest=True also the largest free block (see largest_free())."""
+  heap = {
+    "free_bytes": mem_free(),
+    "alloc_bytes": mem_alloc(),
+  }
+  if largest:
+    heap["largest_block_bytes"] = largest_free()
+  return heap
@@ -0,0 +1,204 @@
+# Latency instrumentation.
+# Durations are measured with time.ticks_us()/ticks_ms() (the sim clock, i.e. perf_counter, on
+# a PC) and counted into histograms with fixed bucket bounds. Recording a sample only bumps
+# integers in preallocated arrays, so it is cheap enough for sensor helpers and costs no memory
+# per sample. The collected metrics are exported in the Prometheus text format (/metrics, streamed
+# one histogram at a time) and as a JSON summary for the dashboard.
+#
+#   t0 = time.ticks_us()
+#   ...
+#   SENSOR_READS.since("light", t0)
+
+from array import array
+
+from hardware import time
+
+# Bucket upper bounds: 1-2.5-5 steps. Microseconds for requests and sensor reads (50 us to 10 s),
+# milliseconds for stages (100 ms to 30 min; ticks_us would wrap within a long stage).
+LATENCY_US = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000,
+              500000, 1000000, 2500000, 5000000, 10000000)
+DURATION_MS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000,
+               1000000, 1800000)
+
+
+class Histogram:
+  """Counts of samples per bucket, plus their number, sum and maximum.
+
+  `per_second` is the number of sample units in a second (1000000 for us, 1000 for ms). The sum
+  is kept as whole seconds plus a remainder so it stays a small int however long it runs.
+  """
+
+  def __init__(self, bounds=LATENCY_US, per_second=1000000):
+    self.bounds = bounds
+    self.per_second = per_second
+    self.counts = array("I", bytes(4 * (len(bounds) + 1))) # the last bucket is +Inf
+    self.count = 0
+    self.seconds = 0
+    self.rest = 0
+    self.max = 0
+
+  def observe(self, value):
+    bounds = self.bounds
+    lo = 0
+    hi = len(bounds)
+    while lo < hi:
+      mid = (lo + hi) >> 1
+      if value <= bounds[mid]:
+        hi = mid
+      else:
+        lo = mid + 1
+    self.counts[lo] += 1
+    self.count += 1
+    rest = self.rest + value
+    if rest >= self.per_second:
+      self.seconds += rest // self.per_second
+      rest %= self.per_second
+    self.rest = rest
+    if value > self.max:
+      self.max = value
+
+  def total(self):
+    """Sum of all samples in seconds."""
+    return self.seconds + self.rest / self.per_second
+
+  def quantile(self, q):
+    """Upper bound of the bucket holding the q-th sample (an overestimate by at most one bucket)."""
+    if not self.count:
+      return 0
+    rank = q * self.count
+    seen = 0
+    for i in range(len(self.bounds)):
+      seen += self.counts[i]
+      if seen >= rank:
+        return min(self.bounds[i], self.max)
+    return self.max
+
+  def summary(self):
+    """Count, mean, p50, p95 and max in milliseconds."""
+    ms = self.per_second / 1000
+    return {
+      "count": self.count,
+      "mean_ms": round(self.total() * 1000 / self.count, 3) if self.count else 0,
+      "p50_ms": round(self.quantile(0.5) / ms, 3),
+      "p95_ms": round(self.quantile(0.95) / ms, 3),
+      "max_ms": round(self.max / ms, 3),
+    }
+
+
+class Family:
+  """One metric with a histogram per value of its label (per stage, per route, ...).
+
+  A histogram is created the first time a label value is seen; after that, recording allocates
+  nothing.
+  """
+
+  def __init__(self, name, help, label, bounds=LATENCY_US, per_second=1000000):
+    self.name = name
+    self.help = help
+    self.label = label
+    self.bounds = bounds
+    self.per_second = per_second
+    self.children = {}
+    self.le = ["%g" % (b / per_second) for b in bounds] + ["+Inf"]
+
+  def get(self, value):
+    h = self.children.get(value)
+    if h is None:
+      h = self.children[value] = Histogram(self.bounds, self.per_second)
+    return h
+
+  def observe(self, value, sample):
+    self.get(value).observe(sample)
+
+  def since(self, value, t0_us):
+    """Record the time since `t0_us`, a time.ticks_us() reading."""
+    self.get(value).observe(time.ticks_diff(time.ticks_us(), t0_us))
+
+  def prometheus(self):
+    """The family in the Prometheus text format, one chunk of bytes per histogram."""
+    yield ("# HELP %s %s\n# TYPE %s histogram\n" % (self.name, self.help, self.name)).encode()
+    for value, h in list(self.children.items()):
+      out = []
+      cumulative = 0
+      for i in range(len(h.counts)):
+        cumulative += h.counts[i]
+        out.append('%s_bucket{%s="%s",le="%s"} %d\n' % (self.name, self.label, value, self.le[i], cumulative))
+      out.append('%s_sum{%s="%s"} %s\n' % (self.name, self.label, value, h.total()))
+      out.append('%s_count{%s="%s"} %d\n' % (self.name, self.label, value, h.count))
+      yield "".join(out).encode()
+
+  def summary(self):
+    return {value: h.summary() for value, h in self.children.items()}
+
+
+class Timeline:
+  """When each phase of a one-off sequence (the boot) ended, in ms since the board was reset.
+
+  Phases are marked in order as they end; events (the first response) are marked once, whenever
+  they happen. Exported as a gauge with the seconds from reset, labelled by phase.
+  """
+
+  def __init__(self, name, help, label="phase"):
+    self.name = name
+    self.help = help
+    self.label = label
+    self.phases = [] # (phase, ticks_ms at its end)
+    self.events = {}
+
+  def mark(self, phase):
+    self.phases.append((phase, time.ticks_ms()))
+
+  def once(self, event):
+    """Mark an event the first time it happens; later calls cost one dict lookup."""
+    if event not in self.events:
+      self.events[event] = time.ticks_ms()
+
+  def prometheus(self):
+    out = ["# HELP %s %s\n# TYPE %s gauge\n" % (self.name, self.help, self.name)]
+    for phase, at in self.phases + list(self.events.items()):
+      out.append('%s{%s="%s"} %g\n' % (self.name, self.label, phase, at / 1000))
+    yield "".join(out).encode()
+
+  def summary(self):
+    return {phase: {"at_ms": at} for phase, at in self.phases + list(self.events.items())}
+
+  def report(self):
+    """The phases in order, with how long each took, and the events."""
+    phases = []
+    last = 0
+    for phase, at in self.phases:
+      phases.append({"phase": phase, "at_ms": at, "took_ms": at - last})
+      last = at
+    return {"phases": phases, "events": dict(self.events)}
+
+
+registry = []
+
+
+def family(name, help, label, bounds=LATENCY_US, per_second=1000000):
+  """Create a Family and register it for export."""
+  f = Family(name, help, label, bounds, per_second)
+  registry.append(f)
+  return f
+
+
+def timeline(name, help, label="phase"):
+  """Create a Timeline and register it for export."""
+  t = Timeline(name, help, label)
+  registry.append(t)
+  return t
+
+
+def prometheus():
+  """Every registered metric in the Prometheus text exposition format, as chunks of bytes.
+
+  Only one histogram is rendered at a time, so the export never needs the whole text in memory.
+  """
+  for f in registry:
+    for chunk in f.prometheus():
+      yield chunk
+
+
+def summary():
+  """Every registered metric as {name: {label value: summary}}."""
+  return {f.name: f.summary() for f in registry}
@@ -0,0 +1,129 @@
+# Positional plate scan and spot detection.
+# Instead of one colour from one point, the scan builds an intensity profile along the plate:
+# while the plate moves past the sensors, the IR reading tells how far along it is and the light
+# reading at that position is added to one of `bins` position bins. The finished profile goes
+# through baseline subtraction, smoothing and peak picking, and every spot gets its Rf value
+# (distance of the spot from the origin divided by the distance of the solvent front).
+#
+# tools/profiles.py runs the same analysis vectorised with NumPy for archived profiles; keep
+# the two in step.
+
+from array import array
+
+
+class ProfileScan:
+  """Collects a light profile against IR position. Call step() until it returns True.
+
+  The IR reading is mapped linearly from `ir_start` (origin line) to `ir_end` (solvent front)
+  onto the bins; readings outside that range are ignored.
+  """
+
+  def __init__(self, read_light, read_position, bins=64, ir_start=5000, ir_end=60000,
+               coverage=0.9, samples_per_step=8):
+    self.read_light = read_light
+    self.read_position = read_position
+    self.bins = bins
+    self.ir_start = ir_start
+    self.ir_end = ir_end
+    self.needed = int(bins * coverage)
+    self.samples_per_step = samples_per_step
+    self.sums = array("I", bytes(4 * bins))
+    self.counts = array("H", bytes(2 * bins))
+    self.reset()
+
+  def reset(self):
+    for i in range(self.bins):
+      self.sums[i] = 0
+      self.counts[i] = 0
+    self.filled = 0
+
+  def position(self, ir):
+    """Bin index for an IR reading, or -1 when the reading is off the plate."""
+    if ir < self.ir_start or ir >= self.ir_end:
+      return -1
+    return (ir - self.ir_start) * self.bins // (self.ir_end - self.ir_start)
+
+  def step(self):
+    """Take a few position/light pairs. Returns True once enough of the plate is covered."""
+    for _ in range(self.samples_per_step):
+      b = self.position(self.read_position())
+      if b < 0:
+        continue
+      if self.counts[b] == 0:
+        self.filled += 1
+      if self.counts[b] < 65535:
+        self.sums[b] += self.read_light()
+        self.counts[b] += 1
+    return self.filled >= self.needed
+
+  def profile(self):
+    """Mean light reading per bin; empty bins are interpolated from their neighbours."""
+    n = self.bins
+    out = array("H", bytes(2 * n))
+    last = -1
+    for i in range(n):
+      if self.counts[i]:
+        out[i] = self.sums[i] // self.counts[i]
+        if last < 0:
+          for j in range(i): # leading gap: hold the first value
+            out[j] = out[i]
+        elif i - last > 1:
+          for j in range(last + 1, i):
+            out[j] = out[last] + (out[i] - out[last]) * (j - last) // (i - last)
+        last = i
+    for j in range(last + 1, n): # trailing gap
+      out[j] = out[last] if last >= 0 else 0
+    return out
+
+
+def _median(values):
+  """Upper median of a list (the middle element after sorting)."""
+  return sorted(values)[len(values) // 2]
+
+
+def find_peaks(profile, smooth=3, baseline=15, min_height=300, snr=5, separation=2, invert=True):
+  """Spots in a profile as a list of (bin, height).
+
+  invert: spots absorb the illumination and read darker, so the signal is flipped first.
+  baseline: width of the rolling minimum that is subtracted (bins).
+  smooth: width of the moving average applied after that (bins, odd).
+  min_height: smallest peak above the baseline that counts as a spot (ADC counts).
+  snr: the peak also has to stand this many noise widths above the median of the smoothed
+    profile. The noise width is estimated from the profile itself (1.5 x the median absolute
+    deviation), so a noisier sensor or plate raises the threshold instead of reading as spots.
+  separation: a spot has to be the highest point within this many bins on either side.
+  """
+  n = len(profile)
+  x = [(65535 - v) if invert else v for v in profile]
+  half = baseline // 2
+  flat = [x[i] - min(x[max(0, i - half):i + half + 1]) for i in range(n)]
+  half = smooth // 2
+  smoothed = []
+  for i in range(n):
+    window = flat[max(0, i - half):i + half + 1]
+    smoothed.append(sum(window) // len(window))
+  middle = _median(smoothed)
+  noise = _median([abs(v - middle) for v in smoothed]) * 3 // 2
+  threshold = max(min_height, middle + snr * noise)
+  peaks = []
+  for i in range(1, n - 1):
+    v = smoothed[i]
+    if (v >= threshold and v > max(smoothed[max(0, i - separation):i])
+        and v >= max(smoothed[i + 1:i + separation + 1])):
+      peaks.append((i, v))
+  return peaks
+
+
+def rf_values(peaks, bins, origin=0, front=None):
+  """Rf of each peak: (bin - origin) / (front - origin). The front defaults to the last bin."""
+  if front is None:
+    front = bins - 1
+  span = front - origin
+  return [round((b - origin) / span, 3) for b, _ in peaks]
+
+
+def analyse(profile, front=None, **options):
+  """Peaks with their Rf values, ready to be sent as JSON."""
+  peaks = find_peaks(profile, **options)
+  rfs = rf_values(peaks, len(profile), front=front)
+  return [{"bin": b, "height": h, "rf": rf} for (b, h), rf in zip(peaks, rfs)]
@@ -0,0 +1,102 @@
+# Compact on-device log of sensor readings.
+# A fixed-size ring of packed binary records, one per reading, each holding a timestamp and the
+# latest value of all three ADC channels:
+#
+#   FORMAT "<IHHH"  ticks_ms (uint32), thermistor, light sensor, IR sensor (uint16 each)
+#
+# 10 bytes per record, little endian, no padding, so a dump can be memory-mapped on a PC as a
+# NumPy structured array (tools/history.py). Every record has a sequence number (its position
+# in the log since boot); readers ask for records `since` a sequence number and get them in
+# chunks copied out of the ring, never the whole log at once.
+#
+# With a `path`, completed blocks of records are appended to a file on flash as they fill up.
+
+import struct
+
+FORMAT = "<IHHH"
+RECORD_SIZE = struct.calcsize(FORMAT)
+
+THERMISTOR = 0
+LIGHT = 1
+IR = 2
+
+
+class SensorLog:
+  def __init__(self, capacity=2000, path=None, block_records=100, max_file_bytes=512 * 1024):
+    self.capacity = capacity
+    self.buf = bytearray(capacity * RECORD_SIZE)
+    self.view = memoryview(self.buf)
+    self.total = 0 # records written since boot; the next record gets this sequence number
+    self.latest = [0, 0, 0] # last reading of each channel
+    self.path = path
+    self.block_records = block_records
+    self.max_file_bytes = max_file_bytes
+    self.flushed = 0 # sequence number of the first record not yet on flash
+    self.file_bytes = 0
+
+  def update(self, channel, value, ticks_ms):
+    """Note a fresh reading of one channel and log a record of all three."""
+    latest = self.latest
+    latest[channel] = value
+    struct.pack_into(FORMAT, self.buf, (self.total % self.capacity) * RECORD_SIZE,
+                     ticks_ms & 0xffffffff, latest[0], latest[1], latest[2])
+    self.total += 1
+    if self.path and self.total - self.flushed >= self.block_records:
+      self.flush()
+
+  def first(self):
+    """Sequence number of the oldest record still in the ring."""
+    return self.total - self.capacity if self.total > self.capacity else 0
+
+  def flush(self):
+    """Append every record not yet on flash, in one or two writes (the ring may wrap)."""
+    start = max(self.flushed, self.first())
+    end = self.total
+    if not self.path or start >= end:
+      return
+    if self.file_bytes + (end - start) * RECORD_SIZE > self.max_file_bytes:
+      self._rotate()
+    with open(self.path, "ab") as f:
+      while start < end:
+        i = start % self.capacity
+        n = min(end - start, self.capacity - i)
+        f.write(self.view[i * RECORD_SIZE:(i + n) * RECORD_SIZE])
+        self.file_bytes += n * RECORD_SIZE
+        start += n
+    self.flushed = end
+
+  def _rotate(self):
+    import os
+    try:
+      os.remove(self.path + ".old")
+    except OSError:
+      pass
+    try:
+      os.rename(self.path, self.path + ".old")
+    except OSError:
+      pass
+    self.file_bytes = 0
+
+  def read(self, since, chunk_records=50):
+    """Records from sequence number `since` up to the newest one at the time of the call.
+
+    Returns (sequence number of the first record, iterator of chunks). Each chunk holds up to
+    `chunk_records` records copied into one reusable buffer, so the ring keeps filling while a
+    slow client is served. If the writer laps the reader the iterator simply stops early; the
+    client asks again from where it got to and skips ahead to the oldest record still there.
+    """
+    first = self.first()
+    seq = since if since > first else first
+    return seq, self._chunks(seq, self.total, chunk_records)
+
+  def _chunks(self, seq, end, chunk_records):
+    out = bytearray(chunk_records * RECORD_SIZE)
+    out_view = memoryview(out)
+    while seq < end:
+      i = seq % self.capacity
+      n = min(end - seq, self.capacity - i, chunk_records)
+      out_view[:n * RECORD_SIZE] = self.view[i * RECORD_SIZE:(i + n) * RECORD_SIZE]
+      if seq < self.first():
+        return # overwritten before or while copying
+      seq += n
+      yield out_view[:n * RECORD_SIZE]
@@ -0,0 +1,384 @@
+# Simulated hardware backend.
+# This module stands in for the MicroPython `machine`, `network` and `utime` modules when the
+# code runs under CPython on a normal computer. hardware.py picks it up automatically when
+# `machine` cannot be imported, so chromatography.py runs unchanged on a Linux box.
+#
+# - ADC channels read from "sources": a constant, a function of time, a scripted sequence of
+#   steps or a recorded trace. Sources are registered per pin so they can be swapped at any time.
+# - Pins record every write (time, value) so a run can be checked afterwards. press() pushes a
+#   button on an input pin and runs its IRQ handler.
+# - Timer fires its callback from a background thread, in real time and on a fixed schedule.
+# - WLAN is a fake access point that simply reports itself active.
+# - ScriptedListener / ScriptedConnection are fake sockets fed with canned HTTP requests.
+# - `clock` replaces utime. In virtual mode sleeps advance the clock instantly.
+
+import bisect
+import time as _time
+import random
+import threading
+
+AP_IF = 1
+STA_IF = 0
+
+# How much virtual time one ADC conversion costs. Busy loops that only read the ADC still move
+# the clock forward in virtual mode this way, just like they would on the board.
+ADC_READ_US = 5
+
+
+# -------------------------------------------------------------------------
+# Clock
+
+TICKS_PERIOD = 1 << 30
+TICKS_HALF = TICKS_PERIOD // 2
+
+
+class Clock:
+  """Drop-in replacement for utime. Real time by default; set `virtual` to make sleeps instant."""
+
+  def __init__(self):
+    self.virtual = False
+    self.slept = 0.0 # total seconds spent in sleep calls, real or virtual
+    self.reset()
+
+  def reset(self, virtual=None):
+    if virtual is not None:
+      self.virtual = virtual
+    self._t0 = _time.perf_counter()
+    self._vt = 0.0
+    self.slept = 0.0
+
+  def now(self):
+    """Seconds since the clock was reset."""
+    if self.virtual:
+      return self._vt
+    return _time.perf_counter() - self._t0
+
+  def advance(self, seconds):
+    if self.virtual:
+      self._vt += seconds
+
+  def sleep(self, seconds):
+    self.slept += seconds
+    if self.virtual:
+      self._vt += seconds
+    else:
+      _time.sleep(seconds)
+
+  def sleep_ms(self, ms):
+    self.sleep(ms / 1000)
+
+  def sleep_us(self, us):
+    self.sleep(us / 1000000)
+
+  def ticks_ms(self):
+    return int(self.now() * 1000) & (TICKS_PERIOD - 1)
+
+  def ticks_us(self):
+    return int(self.now() * 1000000) & (TICKS_PERIOD - 1)
+
+  def ticks_add(self, ticks, delta):
+    return (ticks + delta) & (TICKS_PERIOD - 1)
+
+  def ticks_diff(self, a, b):
+    return ((a - b + TICKS_HALF) & (TICKS_PERIOD - 1)) - TICKS_HALF
+
+  def time(self):
+    return int(self.now())
+
+
+clock = Clock()
+
+
+# -------------------------------------------------------------------------
+# Waveform sources for the ADC
+
+def constant(value):
+  return lambda t: value
+
+
+def script(*steps):
+  """Piecewise constant waveform from (duration_s, value) steps. The last value holds forever."""
+  edges = []
+  t = 0.0
+  for duration, value in steps:
+    t += duration
+    edges.append((t, value))
+
+  def source(now):
+    for edge, value in edges:
+      if now < edge:
+        return value
+    return edges[-1][1]
+  return source
+
+
+class Trace:
+  """A recorded waveform sampled at `rate_hz`. Holds the last sample unless `loop` is set."""
+
+  def __init__(self, samples, rate_hz=10, loop=False):
+    self.samples = list(samples)
+    self.rate_hz = rate_hz
+    self.loop = loop
+
+  def __call__(self, now):
+    i = int(now * self.rate_hz)
+    if self.loop:
+      i %= len(self.samples)
+    elif i >= len(self.samples):
+      i = len(self.samples) - 1
+    return self.samples[i]
+
+  @classmethod
+  def from_csv(cls, path, column=0, rate_hz=10, loop=False):
+    """Load one column of a comma separated file. Lines that do not parse (headers) are skipped."""
+    samples = []
+    with open(path) as f:
+      for line in f:
+        try:
+          samples.append(int(float(line.split(",")[column])))
+        except (ValueError, IndexError):
+          pass
+    return cls(samples, rate_hz, loop)
+
+
+class Recorded:
+  """A recorded waveform with a timestamp per sample (seconds, ascending), as in a sensor log.
+
+  The value at time t is that of the last sample taken at or before t (the first one before the
+  recording starts, the last one after it ends).
+  """
+
+  def __init__(self, times, samples):
+    self.times = list(times)
+    self.samples = list(samples)
+
+  def __call__(self, now):
+    i = bisect.bisect_right(self.times, now) - 1
+    return self.samples[i if i > 0 else 0]
+
+
+def noisy(source, amplitude, seed=0):
+  """Add uniform noise of +/- amplitude to another source, reproducibly."""
+  rng = random.Random(seed)
+  return lambda t: source(t) + rng.randint(-amplitude, amplitude)
+
+
+# -------------------------------------------------------------------------
+# machine
+
+adc_sources = {} # ADC pin number -> source
+pins = {} # GPIO number -> Pin
+
+
+def feed(pin, source):
+  """Connect a waveform (or a plain number) to an ADC pin."""
+  if not callable(source):
+    source = constant(source)
+  adc_sources[pin] = source
+
+
+def reset():
+  """Forget all waveforms and pin history and restart the clock."""
+  adc_sources.clear()
+  for p in pins.values():
+    p.writes = []
+    p._value = 0
+  clock.reset()
+
+
+class ADC:
+  def __init__(self, pin):
+    self.pin = pin
+    self.reads = 0
+
+  def read_u16(self):
+    self.reads += 1
+    source = adc_sources.get(self.pin)
+    value = source(clock.now()) if source else 0
+    clock.advance(ADC_READ_US / 1000000)
+    return min(max(int(value), 0), 65535)
+
+
+class Pin:
+  IN = 0
+  OUT = 1
+  PULL_UP = 1
+  PULL_DOWN = 2
+  IRQ_FALLING = 4
+  IRQ_RISING = 8
+
+  def __new__(cls, id, mode=-1, pull=-1, value=None):
+    # Like on the board, asking for the same GPIO twice gives the same pin.
+    p = pins.get(id)
+    if p is None:
+      p = object.__new__(cls)
+      p.id = id
+      p._value = 0
+      p.writes = []
+      p._irq = None
+      pins[id] = p
+    return p
+
+  def __init__(self, id, mode=-1, pull=-1, value=None):
+    self.mode = mode
+    if value is not None:
+      self.value(value)
+
+  def value(self, v=None):
+    if v is None:
+      return self._value
+    v = 1 if v else 0
+    self.writes.append((clock.now(), v))
+    self._value = v
+
+  def on(self):
+    self.value(1)
+
+  def off(self):
+    self.value(0)
+
+  def __call__(self, v=None):
+    return self.value(v)
+
+  def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+    self._irq = (handler, trigger) if handler else None
+
+  def __repr__(self):
+    return "Pin(%d, value=%d)" % (self.id, self._value)
+
+
+def press(gpio):
+  """Push a button wired from input `gpio` to ground: the pin goes low and comes back high, and
+  its IRQ handler runs (in the calling thread) for each edge it was set up for."""
+  p = pins[gpio]
+  for value, edge in ((0, Pin.IRQ_FALLING), (1, Pin.IRQ_RISING)):
+    p._value = value
+    if p._irq and p._irq[1] & edge:
+      p._irq[0](p)
+
+
+class Timer:
+  """Calls `callback(timer)` from a background thread. Periodic timers keep to a fixed schedule
+  (period k fires at start + k * period), so a late callback does not push the later ones back."""
+
+  ONE_SHOT = 0
+  PERIODIC = 1
+
+  def __init__(self, id=-1, **kwargs):
+    self._timer = None
+    if kwargs:
+      self.init(**kwargs)
+
+  def init(self, mode=PERIODIC, period=-1, freq=-1, callback=None):
+    self.deinit()
+    self.mode = mode
+    self.period = 1 / freq if freq > 0 else period / 1000
+    self.callback = callback
+    self._stop = threading.Event()
+    self._timer = threading.Thread(target=self._run, args=(self._stop, mode, self.period, callback), daemon=True)
+    self._timer.start()
+
+  def _run(self, stop, mode, period, callback):
+    due = _time.perf_counter()
+    while True:
+      due += period
+      if stop.wait(max(0.0, due - _time.perf_counter())):
+        return
+      if callback:
+        callback(self)
+      if mode != Timer.PERIODIC:
+        return
+
+  def deinit(self):
+    if self._timer:
+      self._stop.set()
+      self._timer = None
+
+
+# -------------------------------------------------------------------------
+# network
+
+class WLAN:
+  def __init__(self, interface=STA_IF):
+    self.interface = interface
+    self._active = False
+    self.settings = {}
+
+  def config(self, **kwargs):
+    self.settings.update(kwargs)
+
+  def active(self, state=None):
+    if state is None:
+      return self._active
+    self._active = bool(state)
+
+  def isconnected(self):
+    return self._active
+
+  def ifconfig(self):
+    return ("192.168.4.1", "255.255.255.0", "192.168.4.1", "0.0.0.0")
+
+
+# -------------------------------------------------------------------------
+# Fake sockets
+
+class ListenerClosed(OSError):
+  """Raised by ScriptedListener.accept() once every scripted connection has been handed out."""
+
+
+class ScriptedConnection:
+  """A client connection that sends one canned request and collects whatever the server writes."""
+
+  def __init__(self, request, addr=("192.168.4.2", 50000)):
+    self.request = request if isinstance(request, bytes) else request.encode()
+    self.addr = addr
+    self.sent = []
+    self.closed = False
+
+  def recv(self, n):
+    data = self.request[:n]
+    self.request = self.request[n:]
+    return data
+
+  def send(self, data):
+    self.sent.append(bytes(data) if not isinstance(data, str) else data.encode())
+    return len(data)
+
+  def sendall(self, data):
+    self.send(data)
+
+  def settimeout(self, t):
+    pass
+
+  def close(self):
+    self.closed = True
+
+  def response(self):
+    return b"".join(self.sent)
+
+
+class ScriptedListener:
+  """Listening socket whose accept() hands out ScriptedConnections for a list of requests."""
+
+  def __init__(self, requests):
+    self.pending = list(requests)
+    self.accepted = []
+
+  def accept(self):
+    if not self.pending:
+      raise ListenerClosed("no more scripted connections")
+    conn = ScriptedConnection(self.pending.pop(0))
+    self.accepted.append(conn)
+    return conn, conn.addr
+
+  def bind(self, addr):
+    pass
+
+  def listen(self, backlog):
+    pass
+
+  def settimeout(self, t):
+    pass
+
+  def close(self):
+    pass
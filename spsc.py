@@ -0,0 +1,74 @@
+# Single-producer/single-consumer ring of fixed-size event records.
+# The experiment (core 1, or a thread on a PC) is the only producer and the web server (core 0)
+# the only consumer, so no lock is needed: the producer writes a record into a free slot and only
+# then moves `head` on; the consumer reads the record at `tail` and only then moves `tail` on.
+# Each index is written by one side only and a single int assignment is atomic on MicroPython
+# and CPython alike, so neither side ever sees a half-written record.
+#
+# A record is packed into a preallocated bytearray, so push() allocates nothing. A full ring
+# drops the new record and counts it rather than blocking the producer.
+#
+#   FORMAT "<BBHI"  kind, arg, value (uint16), ticks_ms (uint32); 8 bytes
+
+import struct
+
+FORMAT = "<BBHI"
+RECORD_SIZE = struct.calcsize(FORMAT)
+
+# Event kinds.
+STATUS = 1 # arg: index into the status text table, value: 1 once the run is complete
+SAMPLE = 2 # arg: ADC channel, value: reading
+
+COUNT_MASK = 0x3fffffff # head and tail count modulo this, so they stay small ints
+
+
+class Ring:
+  """`capacity` records; a power of two, so slots stay in step when the counts wrap."""
+
+  def __init__(self, capacity=64):
+    if capacity <= 0 or capacity & (capacity - 1):
+      raise ValueError("capacity must be a power of two")
+    self.capacity = capacity
+    self.mask = capacity - 1
+    self.buf = bytearray(capacity * RECORD_SIZE)
+    self.head = 0 # records pushed (producer only)
+    self.tail = 0 # records popped (consumer only)
+    self.dropped = 0 # records pushed while full (producer only)
+
+  def __len__(self):
+    return (self.head - self.tail) & COUNT_MASK
+
+  def push(self, kind, arg, value, ticks_ms):
+    """Producer side. Returns False (and drops the record) if the ring is full."""
+    head = self.head
+    if (head - self.tail) & COUNT_MASK >= self.capacity:
+      self.dropped += 1
+      return False
+    struct.pack_into(FORMAT, self.buf, (head & self.mask) * RECORD_SIZE,
+                     kind, arg, value & 0xffff, ticks_ms & 0xffffffff)
+    self.head = (head + 1) & COUNT_MASK
+    return True
+
+  def pop(self):
+    """Consumer side. The oldest record as (kind, arg, value, ticks_ms), or None if empty."""
+    tail = self.tail
+    if tail == self.head:
+      return None
+    record = struct.unpack_from(FORMAT, self.buf, (tail & self.mask) * RECORD_SIZE)
+    self.tail = (tail + 1) & COUNT_MASK
+    return record
+
+  def drain(self, handle, limit=None):
+    """Consumer side. Calls handle(kind, arg, value, ticks_ms) for every waiting record (at most
+    `limit`) and returns how many there were."""
+    n = 0
+    head = self.head
+    tail = self.tail
+    buf = self.buf
+    while tail != head and (limit is None or n < limit):
+      kind, arg, value, ticks_ms = struct.unpack_from(FORMAT, buf, (tail & self.mask) * RECORD_SIZE)
+      tail = (tail + 1) & COUNT_MASK
+      self.tail = tail
+      handle(kind, arg, value, ticks_ms)
+      n += 1
+    return n
@@ -0,0 +1,274 @@
+# Event-driven stage engine for the experiment.
+# An experiment is a table of Stages. Each stage runs its `enter` action once, optionally holds
+# for `hold_ms`, then checks `done()` every `poll_ms` until it returns True (or `timeout_ms`
+# runs out). The engine never spins: step() does whatever is due and returns how long nothing
+# needs to happen, and a runner sleeps (thread), awaits (asyncio) or arms a one-shot timer for
+# that long. In between, the core is free for the network code.
+#
+# An Abort is the emergency stop. Whoever raises it (web request, button IRQ) makes the actuators
+# safe on the spot; the engine sees the flag at its next step and ends the run.
+
+from hardware import time, machine, _thread
+
+try:
+  import uasyncio as asyncio
+except ImportError:
+  import asyncio
+
+try:
+  import micropython
+  schedule = micropython.schedule
+except ImportError:
+  schedule = lambda fn, arg: fn(arg) # CPython: timer callbacks already run outside any IRQ
+
+# Longest a runner sleeps without looking at notify() and the abort flag.
+WAIT_SLICE_MS = 50
+
+
+class Stage:
+  def __init__(self, name, enter=None, done=None, poll_ms=100, hold_ms=0, timeout_ms=None, leave=None):
+    self.name = name
+    self.enter = enter # action run once when the stage starts
+    self.leave = leave # action run once when the stage is over
+    self.done = done # check returning True when the stage is over; None = over after hold_ms
+    self.poll_ms = poll_ms
+    self.hold_ms = hold_ms
+    self.timeout_ms = timeout_ms
+
+
+class Abort:
+  """Emergency stop shared by the web server, an optional button and the experiment runner.
+
+  trigger() drives every actuator to its safe state through `safe` in the caller, so they are
+  safe as soon as the stop is seen, whatever the experiment is doing. It then wakes the run,
+  which stops at its next step: within WAIT_SLICE_MS plus the step in progress. The engine
+  applies `safe` again when it stops, in case a stage was being entered at the time. The stop
+  stays set until clear(), so no new run gets going by accident.
+
+  trigger() only writes pins and attributes, so it may be called from another thread or from a
+  (soft) pin IRQ.
+  """
+
+  def __init__(self, safe=None):
+    self.safe = safe
+    self.set = False
+    self.reason = None
+    self.at_us = 0 # time.ticks_us() of the trigger
+    self.safe_us = 0 # time taken to make the actuators safe
+    self.engine = None # the run to wake, set by its start()
+
+  def trigger(self, reason="stop"):
+    """Stop. Returns False if the stop was already set."""
+    first = not self.set
+    self.set = True # before the pins, so a step running now enters no further stage
+    t0 = time.ticks_us()
+    if first:
+      self.reason = reason
+      self.at_us = t0
+    if self.safe:
+      self.safe()
+    if first:
+      self.safe_us = time.ticks_diff(time.ticks_us(), t0)
+    engine = self.engine
+    if engine is not None:
+      engine.notify()
+    return first
+
+  def clear(self):
+    self.set = False
+    self.reason = None
+
+  def button(self, pin, trigger=None):
+    """Trigger on a push button: `pin` is an input that falls when the button is pressed."""
+    pin.irq(handler=lambda p: self.trigger("button"), trigger=trigger or machine.Pin.IRQ_FALLING)
+
+
+class StageEngine:
+  """Runs a table of stages. Drive it with run(), run_async() or run_timer().
+
+  Bookkeeping for checking the core is really freed:
+    busy_us   time spent inside step() (checks and actions)
+    idle_ms   time handed back to the runner to sleep
+    history   (stage name, start ms, duration ms) for every finished stage
+    latency_us  per transition, from the check that saw the stage finish to the next stage entered
+    stop_us   from an abort being triggered to the run stopped
+  """
+
+  def __init__(self, stages, on_timeout=None, abort=None):
+    self.stages = stages
+    self.on_timeout = on_timeout # called with the stage that timed out, before the listeners
+    self.abort = abort
+    self.aborted = None # reason of the abort that stopped the run
+    self.stop_us = None
+    self.index = -1
+    self.stage = None
+    self.entered = 0
+    self.started = 0
+    self.finished = False
+    self.timed_out = None
+    self.busy_us = 0
+    self.idle_ms = 0
+    self.history = []
+    self.latency_us = []
+    self.listeners = [] # called with the engine after every transition
+    self.wake = False
+    self.wakeup = None # set by run_timer() to re-arm its timer on notify()
+
+  def start(self):
+    self.started = time.ticks_ms()
+    if self.abort is not None:
+      self.abort.engine = self
+    self._enter(0, time.ticks_ms())
+
+  def _enter(self, index, now):
+    if self.stage is not None:
+      if self.stage.leave:
+        self.stage.leave()
+      self.history.append((self.stage.name, time.ticks_diff(self.entered, self.started), time.ticks_diff(now, self.entered)))
+    self.index = index
+    self.entered = now
+    if index >= len(self.stages):
+      self.stage = None
+      self.finished = True
+    else:
+      self.stage = self.stages[index]
+      if self.stage.enter:
+        self.stage.enter()
+    for listener in self.listeners:
+      listener(self)
+
+  def _end(self, now, ended=None):
+    """Finish the run in the current stage: leave it, record it, then call `ended` with it (if
+    given) and the listeners, as on any other transition."""
+    stage = self.stage
+    if stage is not None:
+      if stage.leave:
+        stage.leave()
+      self.history.append((stage.name, time.ticks_diff(self.entered, self.started), time.ticks_diff(now, self.entered)))
+    self.stage = None
+    self.finished = True
+    if ended:
+      ended(stage)
+    for listener in self.listeners:
+      listener(self)
+
+  def _stop(self, now):
+    abort = self.abort
+    if abort.safe:
+      abort.safe()
+    self.aborted = abort.reason
+    self.stop_us = time.ticks_diff(time.ticks_us(), abort.at_us)
+    self._end(now)
+
+  def notify(self):
+    """Ask for the current stage to be checked straight away (e.g. from a pin IRQ)."""
+    self.wake = True
+    if self.wakeup:
+      self.wakeup()
+
+  def step(self):
+    """Do whatever is due. Returns ms until the next step is needed, or -1 once finished."""
+    t0 = time.ticks_us()
+    self.wake = False
+    wait = -1
+    abort = self.abort
+    while self.stage is not None:
+      stage = self.stage
+      now = time.ticks_ms()
+      if abort is not None and abort.set:
+        self._stop(now)
+        break
+      elapsed = time.ticks_diff(now, self.entered)
+      if elapsed < stage.hold_ms:
+        wait = stage.hold_ms - elapsed
+        break
+      if stage.done is None or stage.done():
+        seen = time.ticks_us()
+        self._enter(self.index + 1, now)
+        self.latency_us.append(time.ticks_diff(time.ticks_us(), seen))
+        continue
+      if stage.timeout_ms is not None and elapsed >= stage.timeout_ms:
+        self.timed_out = stage.name
+        self._end(now, self.on_timeout)
+        break
+      wait = stage.poll_ms
+      break
+    self.busy_us += time.ticks_diff(time.ticks_us(), t0)
+    if wait > 0:
+      self.idle_ms += wait
+    return wait
+
+  def elapsed_ms(self):
+    return time.ticks_diff(time.ticks_ms(), self.started)
+
+
+def run(engine):
+  """Run to the end in the calling thread, sleeping between steps."""
+  engine.start()
+  while True:
+    wait = engine.step()
+    if wait < 0:
+      return engine
+    # Sleep in short slices so notify() is noticed quickly.
+    while wait > 0 and not engine.wake:
+      slice_ms = wait if wait < WAIT_SLICE_MS else WAIT_SLICE_MS
+      time.sleep_ms(slice_ms)
+      wait -= slice_ms
+
+
+async def run_async(engine):
+  """Run as an asyncio task, next to the web server, without any thread."""
+  engine.start()
+  while True:
+    wait = engine.step()
+    if wait < 0:
+      return engine
+    while wait > 0 and not engine.wake:
+      slice_ms = wait if wait < WAIT_SLICE_MS else WAIT_SLICE_MS
+      await asyncio.sleep(slice_ms / 1000)
+      wait -= slice_ms
+
+
+def run_timer(engine, timer=None):
+  """Drive the engine from a one-shot machine.Timer that is re-armed after every step.
+
+  Returns immediately; the timer keeps the experiment going in the background.
+
+  The timer is armed by tick() and by notify(), which may be called from another thread or an
+  IRQ, and on a PC the timer thread runs tick() itself, so one lock covers both the step and the
+  arming. notify() never waits for it: while a tick() holds the lock, tick() sees the wake flag
+  once it lets go and re-arms for 1 ms itself, so no two steps ever run at once. A wake that is
+  already armed is not armed again, so a stream of notify() calls cannot keep pushing it back.
+  """
+  timer = timer or machine.Timer(-1)
+  lock = _thread.allocate_lock()
+  callback = lambda t: schedule(tick, None)
+  woken = False # a 1 ms wake is armed
+
+  def arm(period):
+    timer.init(mode=machine.Timer.ONE_SHOT, period=max(period, 1), callback=callback)
+
+  def wakeup():
+    nonlocal woken
+    if lock.acquire(0):
+      try:
+        if not woken:
+          woken = True
+          arm(1)
+      finally:
+        lock.release()
+
+  def tick(_):
+    nonlocal woken
+    with lock:
+      woken = False
+      wait = engine.step()
+      if wait >= 0:
+        arm(wait)
+    if wait >= 0 and engine.wake:
+      wakeup()
+
+  engine.wakeup = wakeup
+  engine.start()
+  tick(None)
+  return timer
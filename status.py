@@ -0,0 +1,70 @@
+# Versioned status snapshots.
+# The experiment publishes its status here whenever something changes. Each publish builds one
+# immutable Snapshot with a version number, the JSON payload and the complete /status response,
+# and swaps it in with a single assignment. Readers on the web server take `board.current`
+# once and use that object, so they never see a half-updated status and never touch the pins.
+#
+# Versions start at a random number at every boot rather than at 0, so a version a client kept
+# from before a reboot does not name a status of this boot (which would get it a false 304).
+
+import json
+import random
+
+import httpd
+from hardware import _thread
+
+FIRST_VERSION_BITS = 24 # leaves room to count up within a small int on the board
+
+
+class Snapshot:
+  def __init__(self, version, output_status, completion_status, batch=None):
+    self.version = version
+    self.output_status = output_status
+    self.completion_status = completion_status
+    self.batch = batch
+    record = {
+      "version": version,
+      "output_status": output_status,
+      "completion_status": completion_status,
+    }
+    if batch is not None:
+      record["batch"] = batch
+    self.payload = json.dumps(record).encode()
+    self.tag = str(version).encode()
+    headers = [("Cache-Control", "no-store"), ("ETag", '"%d"' % version)]
+    self.response = httpd.response(self.payload, "application/json", headers=headers)
+    # Returned to clients that already have this version.
+    self.not_modified = httpd.response(b"", "application/json", "304 Not Modified", headers)
+
+
+class StatusBoard:
+  """Holds the latest Snapshot. Readers just take `current`; writers are serialised by a lock."""
+
+  def __init__(self, first_version=None):
+    if first_version is None:
+      first_version = random.getrandbits(FIRST_VERSION_BITS)
+    self.current = Snapshot(first_version, None, None)
+    self.lock = _thread.allocate_lock()
+
+  def publish(self, output_status, completion_status, batch=None):
+    """Publish a new status; does nothing if it is the same as the current one.
+
+    `batch` is the progress summary of a running batch (see batch.py); it is carried over to
+    later snapshots until a new one is given.
+    """
+    with self.lock:
+      current = self.current
+      if batch is None:
+        if output_status == current.output_status and completion_status == current.completion_status:
+          return current
+        batch = current.batch
+      snapshot = Snapshot(current.version + 1, output_status, completion_status, batch)
+      self.current = snapshot
+      return snapshot
+
+  def respond(self, known=None):
+    """The /status response for a client that already has version `known` (bytes, may be quoted)."""
+    current = self.current
+    if known is not None and known.strip(b'"') == current.tag:
+      return current.not_modified
+    return current.response
@@ -0,0 +1,75 @@
+# Streaming temperature-change detector for the thermistor.
+# Fed one ADC reading at a time, it never sleeps. Readings pass a three-sample median filter
+# (which removes single-sample spikes), are smoothed with an integer exponential moving
+# average and kept in a fixed-size ring buffer; a change is reported when the smoothed value
+# has moved by more than `threshold` counts across the ring (the slope over `window` samples)
+# for `confirm` samples in a row. A single noise spike cannot do that.
+
+from array import array
+
+
+class ChangeDetector:
+  """Reports a sustained temperature change.
+
+  threshold: ADC counts the smoothed reading must move across the window.
+  window: number of samples the change is measured over (window / sample rate = seconds).
+  shift: smoothing strength; each sample moves the average by 1 / 2**shift of the difference.
+  confirm: consecutive samples the change must persist before it is reported.
+  """
+
+  def __init__(self, threshold=500, window=8, shift=2, confirm=3):
+    self.threshold = threshold << 4 # the average is kept in 1/16 counts
+    self.shift = shift
+    self.confirm = confirm
+    self.ring = array("i", bytes(4 * window))
+    self.reset()
+
+  def reset(self):
+    self.ema = -1
+    self.prev = -1 # the two previous raw readings, for the median filter
+    self.prev2 = -1
+    self.pos = 0
+    self.filled = 0
+    self.hits = 0
+    self.triggered = False
+
+  def feed(self, reading):
+    """Add one reading. Returns True once a change has been detected (until reset())."""
+    if self.triggered:
+      return True
+    a = self.prev2
+    b = self.prev
+    self.prev2 = b
+    self.prev = reading
+    if a < 0:
+      return False # still collecting the first three readings
+    # median of the last three readings
+    if a > b:
+      a, b = b, a
+    if reading < a:
+      reading = a
+    elif reading > b:
+      reading = b
+    x = reading << 4
+    if self.ema < 0:
+      self.ema = x
+    else:
+      self.ema += (x - self.ema) >> self.shift
+    ring = self.ring
+    n = len(ring)
+    oldest = ring[self.pos] # the value `window` samples ago, once the ring is full
+    ring[self.pos] = self.ema
+    self.pos += 1
+    if self.pos == n:
+      self.pos = 0
+    if self.filled < n:
+      self.filled += 1
+      return False
+    slope = self.ema - oldest
+    if slope > self.threshold or slope < -self.threshold:
+      self.hits += 1
+      if self.hits >= self.confirm:
+        self.triggered = True
+    else:
+      self.hits = 0
+    return self.triggered
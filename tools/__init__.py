@@ -0,0 +1,2 @@
+# Host-side tools (run on a PC, not on the board). Run them from the repository root,
+# e.g. `python -m tools.history`.
@@ -0,0 +1,74 @@
+# Precompiles the board's modules to MicroPython bytecode (.mpy) with mpy-cross.
+# Imported from source, every module is compiled on the board at each boot, and the compiler
+# needs heap for it (the dashboard page alone is one long string constant). Imported from .mpy,
+# the bytecode is loaded as it is. The board only starts main.py, and only as source, so the
+# build adds a main.py stub that imports chromatography and calls main().
+#
+#   python -m tools.build [--out build] [--mpy-cross PATH]
+#   mpremote cp build/* :        then colours.json too, if there is a calibrated table
+#
+# mpy-cross has to match the firmware's bytecode version: use the one from the same MicroPython
+# release (pip install mpy-cross==<release>). On import the board says "incompatible .mpy file"
+# when they do not match.
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+
+# Everything chromatography.py imports on the board; sim.py and the PC tools stay behind.
+MODULES = (
+  "hardware", "httpd", "classifier", "thermal", "stages", "status", "batch", "sensorlog",
+  "platescan", "metrics", "memstats", "acquire", "spsc", "journal", "chromatography",
+)
+ARCH = "armv6m" # RP2040 (Cortex-M0+); for native and viper code emitters only
+
+MAIN = """# Boots the precompiled modules (tools/build.py).
+import chromatography
+chromatography.main()
+"""
+
+
+def find_mpy_cross(path=None):
+  """The mpy-cross command: `path`, the one on PATH, or the pip package's module."""
+  if path:
+    return [path]
+  found = shutil.which("mpy-cross")
+  if found:
+    return [found]
+  try:
+    import mpy_cross # noqa: F401 (pip install mpy-cross)
+  except ImportError:
+    raise SystemExit("mpy-cross not found: pip install mpy-cross, or pass --mpy-cross PATH")
+  return [sys.executable, "-m", "mpy_cross"]
+
+
+def build(out, command, root="."):
+  """Compile every module into `out`, and write main.py. Returns the files written."""
+  os.makedirs(out, exist_ok=True)
+  written = []
+  for name in MODULES:
+    target = os.path.join(out, name + ".mpy")
+    subprocess.run(command + ["-march=" + ARCH, "-o", target, os.path.join(root, name + ".py")], check=True)
+    written.append(target)
+  main = os.path.join(out, "main.py")
+  with open(main, "w") as f:
+    f.write(MAIN)
+  written.append(main)
+  return written
+
+
+def main(argv=None):
+  p = argparse.ArgumentParser(description="Precompile the board's modules with mpy-cross")
+  p.add_argument("--out", default="build")
+  p.add_argument("--mpy-cross", help="path of the mpy-cross binary")
+  args = p.parse_args(argv)
+  for path in build(args.out, find_mpy_cross(args.mpy_cross)):
+    print("%7d  %s" % (os.path.getsize(path), path))
+  print("copy to the board with: mpremote cp %s/* :" % args.out.rstrip("/"))
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,283 @@
+# Host-side calibration of the colour bands (classifier.py).
+# Fits one band per colour from labelled light readings and writes the band table as a small
+# JSON file that the board loads at boot (COLOUR_TABLE in chromatography.py). Two models:
+#
+#   gaussian  one normal distribution per colour; the edge between two neighbouring colours is
+#             where their densities cross (equal priors)
+#   centroid  nearest class mean; the edge is halfway between the two means
+#
+# Readings further than `--reject` standard deviations from every colour are "void", as are
+# gaps between colours that are that far apart. Readings labelled "void" are not fitted but are
+# kept for the confusion matrix, so a table that calls an empty holder a colour shows up there.
+#
+#   python -m tools.calibrate fit samples.csv [--dump blue run1.bin ...] [--out colours.json]
+#   python -m tools.calibrate evaluate colours.json samples.csv
+#
+# Sample files are CSV rows of "colour,value". A sensor log dump (tools/history.py) recorded
+# over a plate of one known colour can be added with --dump COLOUR PATH; its light channel is
+# used. With --burst N, consecutive raw readings of a colour are reduced N at a time the way the
+# board reduces a burst, so the fit sees the same values the board decides on.
+
+import argparse
+import json
+import math
+import statistics
+import struct
+import sys
+import time
+
+import classifier
+import sensorlog
+
+VOID = "void"
+ADC_MAX = 65536
+
+
+def read_csv(path, samples):
+  with open(path) as f:
+    for line in f:
+      fields = line.strip().split(",")
+      if len(fields) < 2:
+        continue
+      try:
+        value = int(float(fields[1]))
+      except ValueError:
+        continue # header
+      samples.setdefault(fields[0].strip(), []).append(value)
+
+
+def read_dump(label, path, samples):
+  with open(path, "rb") as f:
+    data = f.read()
+  data = data[:len(data) - len(data) % sensorlog.RECORD_SIZE]
+  values = samples.setdefault(label, [])
+  for record in struct.iter_unpack(sensorlog.FORMAT, data):
+    values.append(record[1 + sensorlog.LIGHT])
+
+
+def reduce_bursts(values, burst, trim):
+  """Trimmed means of consecutive bursts, as classifier.Classifier.sample() computes them."""
+  if not 0 <= 2 * trim < burst:
+    raise ValueError("trim must leave at least one sample")
+  out = []
+  for i in range(0, len(values) - burst + 1, burst):
+    chunk = sorted(values[i:i + burst])
+    kept = chunk[trim:burst - trim]
+    out.append(sum(kept) // len(kept))
+  return out
+
+
+def split(samples, holdout):
+  """Training and test sets; the test set is the last `holdout` fraction of each colour."""
+  train = {}
+  test = {}
+  for label, values in samples.items():
+    n = len(values) - int(len(values) * holdout)
+    train[label] = values[:n] if holdout else values
+    test[label] = values[n:] if holdout else values
+  return train, test
+
+
+def class_stats(samples):
+  stats = []
+  for label, values in samples.items():
+    if label == VOID or not values:
+      continue
+    std = statistics.pstdev(values) if len(values) > 1 else 0.0
+    stats.append((statistics.fmean(values), max(std, 1.0), label, len(values)))
+  stats.sort()
+  return stats
+
+
+def gaussian_edge(m1, s1, m2, s2):
+  """Where two normal densities (m1 < m2) cross between their means."""
+  a = 1 / (2 * s2 * s2) - 1 / (2 * s1 * s1)
+  b = m1 / (s1 * s1) - m2 / (s2 * s2)
+  c = m2 * m2 / (2 * s2 * s2) - m1 * m1 / (2 * s1 * s1) + math.log(s2 / s1)
+  if abs(a) < 1e-12:
+    roots = [-c / b]
+  else:
+    d = b * b - 4 * a * c
+    if d < 0:
+      roots = []
+    else:
+      r = math.sqrt(d)
+      roots = [(-b - r) / (2 * a), (-b + r) / (2 * a)]
+  for x in roots:
+    if m1 <= x <= m2:
+      return x
+  return m1 + (m2 - m1) * s1 / (s1 + s2)
+
+
+def centroid_edge(m1, s1, m2, s2):
+  return (m1 + m2) / 2
+
+
+MODELS = {"gaussian": gaussian_edge, "centroid": centroid_edge}
+
+
+def fit(samples, model="gaussian", reject=4.0):
+  """Band table (edges, colours) for classifier.lookup()."""
+  stats = class_stats(samples)
+  if not stats:
+    raise ValueError("no labelled colour samples")
+  edge = MODELS[model]
+  bounds = [(m - reject * s, m + reject * s) for m, s, _, _ in stats]
+  edges = [max(0, round(bounds[0][0]))]
+  colours = [VOID, stats[0][2]]
+  for k in range(1, len(stats)):
+    m1, s1 = stats[k - 1][:2]
+    m2, s2 = stats[k][:2]
+    if bounds[k - 1][1] < bounds[k][0]:
+      edges += [round(bounds[k - 1][1]), round(bounds[k][0])]
+      colours += [VOID, stats[k][2]]
+    else:
+      edges.append(round(edge(m1, s1, m2, s2)))
+      colours.append(stats[k][2])
+  edges.append(min(ADC_MAX, round(bounds[-1][1])))
+  colours.append(VOID)
+  for i in range(1, len(edges)):
+    if edges[i] <= edges[i - 1]:
+      raise ValueError("colours %s and %s cannot be told apart" % (colours[i - 1], colours[i + 1]))
+  return edges, colours
+
+
+def confusion(samples, edges, colours):
+  """{truth: {decision: count}} for every labelled sample."""
+  matrix = {}
+  for label, values in samples.items():
+    row = matrix.setdefault(label, {})
+    for v in values:
+      decision = classifier.lookup(v, edges, colours)
+      row[decision] = row.get(decision, 0) + 1
+  return matrix
+
+
+def accuracy(matrix):
+  total = sum(sum(row.values()) for row in matrix.values())
+  correct = sum(row.get(label, 0) for label, row in matrix.items())
+  return correct / total if total else 0.0
+
+
+def format_matrix(matrix):
+  labels = sorted(set(matrix) | {d for row in matrix.values() for d in row})
+  width = max(8, max(len(l) for l in labels) + 1)
+  lines = ["truth \\ decided".ljust(width + 4) + "".join(l.rjust(width) for l in labels)]
+  for truth in sorted(matrix):
+    row = matrix[truth]
+    lines.append(truth.ljust(width + 4) + "".join(str(row.get(l, 0)).rjust(width) for l in labels))
+  return "\n".join(lines)
+
+
+def throughput(edges, colours, values, min_lookups=200000):
+  """Lookups per second of classifier.lookup() with this table on this machine."""
+  values = values or [0]
+  repeat = max(1, min_lookups // len(values))
+  lookup = classifier.lookup
+  t0 = time.perf_counter()
+  for _ in range(repeat):
+    for v in values:
+      lookup(v, edges, colours)
+  return repeat * len(values) / (time.perf_counter() - t0)
+
+
+def report(test, edges, colours):
+  values = [v for vs in test.values() for v in vs]
+  matrix = confusion(test, edges, colours)
+  return {
+    "edges": list(edges),
+    "colours": list(colours),
+    "confusion": matrix,
+    "accuracy": accuracy(matrix),
+    "test_samples": len(values),
+    "lookups_per_s": throughput(edges, colours, values),
+    "comparisons_per_lookup": math.ceil(math.log2(len(edges) + 1)),
+    "table_bytes": len(table_json(edges, colours, None)),
+  }
+
+
+def table_json(edges, colours, model):
+  table = {"edges": list(edges), "colours": list(colours)}
+  if model:
+    table["model"] = model
+  return json.dumps(table, separators=(",", ":"))
+
+
+def load_samples(args):
+  samples = {}
+  for path in args.samples:
+    read_csv(path, samples)
+  for label, path in args.dump or ():
+    read_dump(label, path, samples)
+  if args.burst > 1:
+    samples = {label: reduce_bursts(values, args.burst, args.trim) for label, values in samples.items()}
+  return samples
+
+
+def print_report(title, result):
+  print("%s: accuracy %.1f%% on %d samples, %.0f lookups/s, %d comparisons per lookup, %d byte table"
+        % (title, 100 * result["accuracy"], result["test_samples"], result["lookups_per_s"],
+           result["comparisons_per_lookup"], result["table_bytes"]))
+  print(format_matrix(result["confusion"]))
+
+
+def main(argv=None):
+  p = argparse.ArgumentParser(description="Fit the colour band table from labelled readings")
+  sub = p.add_subparsers(dest="command", required=True)
+  for name in ("fit", "evaluate"):
+    c = sub.add_parser(name)
+    if name == "evaluate":
+      c.add_argument("table", help="table file, or 'builtin' for the bands in classifier.py")
+    c.add_argument("samples", nargs="*", help="CSV files of colour,value rows")
+    c.add_argument("--dump", nargs=2, action="append", metavar=("COLOUR", "PATH"),
+                   help="sensor log dump recorded over one colour")
+    c.add_argument("--burst", type=int, default=1, help="reduce raw readings in bursts of N")
+    c.add_argument("--trim", type=int, default=4)
+    c.add_argument("--json", help="write the report as JSON")
+  f = sub.choices["fit"]
+  f.add_argument("--model", choices=sorted(MODELS), default="gaussian")
+  f.add_argument("--reject", type=float, default=4.0, help="void beyond this many std devs")
+  f.add_argument("--holdout", type=float, default=0.25, help="fraction of each colour kept for testing")
+  f.add_argument("--out", default="colours.json")
+  args = p.parse_args(argv)
+  if args.burst > 1 and not 0 <= 2 * args.trim < args.burst:
+    p.error("--trim %d leaves no readings of a burst of %d; use at most %d"
+            % (args.trim, args.burst, (args.burst - 1) // 2))
+
+  samples = load_samples(args)
+  if args.command == "evaluate":
+    if args.table == "builtin":
+      edges, colours = classifier.EDGES, classifier.COLOURS
+    else:
+      edges, colours = classifier.load_table(args.table, None, None)
+      if edges is None:
+        print("%s is not a valid table" % args.table, file=sys.stderr)
+        return 1
+    result = report(samples, edges, colours)
+    print_report(args.table, result)
+  else:
+    train, test = split(samples, args.holdout)
+    try:
+      edges, colours = fit(train, args.model, args.reject)
+    except ValueError as e:
+      print("cannot fit: %s" % e, file=sys.stderr)
+      return 1
+    with open(args.out, "w") as out:
+      out.write(table_json(edges, colours, args.model) + "\n")
+    result = report(test, edges, colours)
+    result["model"] = args.model
+    result["classes"] = {label: {"mean": round(m, 1), "std": round(s, 1), "n": n}
+                         for m, s, label, n in class_stats(train)}
+    print("wrote %s: %s" % (args.out, " | ".join("%s <%d" % (c, e) for c, e in zip(colours, edges)) + " | void"))
+    print_report(args.model, result)
+    builtin = report(test, classifier.EDGES, classifier.COLOURS)
+    result["builtin_accuracy"] = builtin["accuracy"]
+    print("built-in bands on the same samples: accuracy %.1f%%" % (100 * builtin["accuracy"]))
+  if args.json:
+    with open(args.json, "w") as out:
+      json.dump(result, out, indent=2)
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,376 @@
+# Host-side collector for a fleet of units.
+# One asyncio task per unit keeps a keep-alive connection to it and either polls /status with the
+# version it already has (the unit answers 304 when nothing changed) or subscribes to /events.
+# Every read is bounded by a timeout; a unit that fails is retried with exponential backoff and
+# jitter, so a fleet of unreachable units does not turn into a busy loop. The results go into one
+# FleetStore, which a single fleet dashboard serves (page at /, JSON at /fleet).
+#
+#   python -m tools.fleet collect 192.168.4.1 10.0.0.7:8080 ... [--events] [--port 8000]
+#   python -m tools.fleet standins 20 [--base-port 9000]     local stand-in units for testing
+#
+# Stand-in units serve the same /status and /events as the board (status.StatusBoard and
+# httpd.EventSource), with a status that cycles through the stages of an experiment.
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+import httpd
+import status
+
+INTERVAL = 1.0 # seconds between polls of one unit
+TIMEOUT = 3.0 # seconds allowed for connecting, and for each response
+MAX_BACKOFF = 30.0
+EVENTS_TIMEOUT = 40.0 # the board pings every 15 s, so silence for this long means it is gone
+
+
+class Unit:
+  """What the collector knows about one unit."""
+
+  def __init__(self, name, host, port=80):
+    self.name = name
+    self.host = host
+    self.port = port
+    self.status = None # last /status payload
+    self.version = -1
+    self.online = False
+    self.last_seen = None # time.time() of the last answer
+    self.latency_ms = None
+    self.polls = 0
+    self.updates = 0
+    self.errors = 0
+    self.failures = 0 # consecutive
+    self.mode = "poll"
+
+  def record(self, now):
+    return {
+      "name": self.name,
+      "address": "%s:%d" % (self.host, self.port),
+      "online": self.online,
+      "status": self.status,
+      "age_s": round(now - self.last_seen, 1) if self.last_seen else None,
+      "latency_ms": self.latency_ms,
+      "polls": self.polls,
+      "updates": self.updates,
+      "errors": self.errors,
+      "mode": self.mode,
+    }
+
+
+class FleetStore:
+  """The merged view of every unit."""
+
+  def __init__(self, units):
+    self.units = units
+    self.changes = 0 # bumped on every status change, for cheap change detection
+
+  def update(self, unit, payload, latency_ms):
+    unit.status = payload
+    unit.version = payload.get("version", unit.version)
+    unit.updates += 1
+    self.changes += 1
+    self.seen(unit, latency_ms)
+
+  def seen(self, unit, latency_ms):
+    unit.online = True
+    unit.last_seen = time.time()
+    unit.latency_ms = latency_ms
+    unit.polls += 1
+    unit.failures = 0
+
+  def failed(self, unit):
+    unit.errors += 1
+    unit.failures += 1
+    if unit.failures >= 3:
+      unit.online = False
+
+  def snapshot(self):
+    now = time.time()
+    units = [u.record(now) for u in self.units]
+    return {
+      "units": units,
+      "online": sum(1 for u in self.units if u.online),
+      "changes": self.changes,
+    }
+
+
+def backoff(failures, interval=INTERVAL):
+  """Delay before the next attempt after `failures` failures in a row (exponential, jittered)."""
+  return min(MAX_BACKOFF, interval * 2 ** failures) * random.uniform(0.5, 1.0)
+
+
+class Client:
+  """One keep-alive HTTP/1.1 connection to a unit, reopened when it breaks."""
+
+  def __init__(self, host, port, timeout=TIMEOUT):
+    self.host = host
+    self.port = port
+    self.timeout = timeout
+    self.reader = None
+    self.writer = None
+
+  async def connect(self):
+    self.reader, self.writer = await asyncio.wait_for(
+      asyncio.open_connection(self.host, self.port), self.timeout)
+
+  def close(self):
+    if self.writer is not None:
+      self.writer.close()
+    self.reader = self.writer = None
+
+  async def request(self, path):
+    """Send a GET and read the status line and headers. Returns (code, headers)."""
+    if self.writer is None:
+      await self.connect()
+    self.writer.write(("GET %s HTTP/1.1\r\nHost: %s\r\nConnection: keep-alive\r\n\r\n"
+                       % (path, self.host)).encode())
+    await asyncio.wait_for(self.writer.drain(), self.timeout)
+    line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+    if not line:
+      raise ConnectionError("connection closed")
+    code = int(line.split()[1])
+    headers = {}
+    while True:
+      line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+      if line in (b"\r\n", b"\n", b""):
+        break
+      name, _, value = line.decode("latin-1").partition(":")
+      headers[name.strip().lower()] = value.strip()
+    return code, headers
+
+  async def get(self, path):
+    """GET `path` and read the whole body. Returns (code, body)."""
+    code, headers = await self.request(path)
+    length = int(headers.get("content-length", 0))
+    body = await asyncio.wait_for(self.reader.readexactly(length), self.timeout) if length else b""
+    if headers.get("connection", "").lower() == "close":
+      self.close()
+    return code, body
+
+
+async def poll(unit, store, interval=INTERVAL, timeout=TIMEOUT):
+  """Poll one unit's /status forever."""
+  client = Client(unit.host, unit.port, timeout)
+  loop = asyncio.get_running_loop()
+  while True:
+    t0 = loop.time()
+    try:
+      code, body = await client.get("/status?v=%d" % unit.version)
+      latency = round((loop.time() - t0) * 1000, 2)
+      if code == 200:
+        store.update(unit, json.loads(body), latency)
+      elif code == 304:
+        store.seen(unit, latency)
+      else:
+        raise ConnectionError("HTTP %d" % code)
+      delay = interval
+    except (OSError, EOFError, asyncio.TimeoutError, ValueError, IndexError):
+      client.close()
+      store.failed(unit)
+      delay = backoff(unit.failures, interval)
+    await asyncio.sleep(max(0.0, delay - (loop.time() - t0)))
+
+
+async def subscribe(unit, store, interval=INTERVAL, timeout=TIMEOUT):
+  """Follow one unit's /events; falls back to poll() if the unit has no room for another subscriber."""
+  unit.mode = "events"
+  while True:
+    client = Client(unit.host, unit.port, timeout)
+    try:
+      code, headers = await client.request("/events")
+      if code == 503:
+        client.close()
+        unit.mode = "poll"
+        await poll(unit, store, interval, timeout)
+        return
+      if code != 200:
+        raise ConnectionError("HTTP %d" % code)
+      unit.failures = 0
+      while True:
+        line = await asyncio.wait_for(client.reader.readline(), EVENTS_TIMEOUT)
+        if not line:
+          raise ConnectionError("connection closed")
+        if line.startswith(b"data: "):
+          store.update(unit, json.loads(line[6:]), None)
+        elif line.startswith(b":"):
+          store.seen(unit, None) # keep-alive ping
+    except (OSError, EOFError, asyncio.TimeoutError, ValueError, IndexError):
+      client.close()
+      store.failed(unit)
+      await asyncio.sleep(backoff(unit.failures, interval))
+
+
+def collectors(store, events=False, interval=INTERVAL, timeout=TIMEOUT):
+  """One task per unit."""
+  follow = subscribe if events else poll
+  return [asyncio.ensure_future(follow(unit, store, interval, timeout)) for unit in store.units]
+
+
+# -------------------------------------------------------------------------
+# Fleet dashboard
+
+PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<title>Chromatography fleet</title>
+<style>
+  body { font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background-color: #f4f4f4; color: #333; }
+  table { margin: 20px auto; border-collapse: collapse; background-color: #fff; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }
+  th, td { padding: 6px 14px; text-align: left; border-bottom: 1px solid #eee; }
+  .offline { color: #ff4136; }
+  .done { background-color: #dff5df; }
+</style>
+</head>
+<body>
+<h1 style="text-align: center; font-size: 1.2em;">Chromatography fleet <span id="summary"></span></h1>
+<table>
+  <thead><tr><th>Unit</th><th>Address</th><th>Stage / result</th><th>Last seen</th><th>Latency</th><th>Errors</th></tr></thead>
+  <tbody id="units"></tbody>
+</table>
+<script>
+function show(fleet) {
+  var rows = [];
+  for (var i = 0; i < fleet.units.length; i++) {
+    var u = fleet.units[i];
+    var s = u.status || {};
+    var cls = !u.online ? "offline" : (s.completion_status == "on" ? "done" : "");
+    rows.push("<tr class='" + cls + "'><td>" + u.name + "</td><td>" + u.address + "</td><td>" +
+              (s.output_status || "-") + "</td><td>" + (u.age_s == null ? "never" : u.age_s + " s ago") +
+              "</td><td>" + (u.latency_ms == null ? "-" : u.latency_ms + " ms") + "</td><td>" + u.errors + "</td></tr>");
+  }
+  document.getElementById("units").innerHTML = rows.join("");
+  document.getElementById("summary").innerHTML = "(" + fleet.online + " of " + fleet.units.length + " online)";
+}
+function update() {
+  var xhr = new XMLHttpRequest();
+  xhr.onreadystatechange = function() {
+    if (xhr.readyState == 4 && xhr.status == 200) show(JSON.parse(xhr.responseText));
+  };
+  xhr.open("GET", "/fleet", true);
+  xhr.send();
+}
+update();
+setInterval(update, 1000);
+</script>
+</body>
+</html>
+"""
+
+
+def dashboard(store):
+  """Router for the fleet dashboard."""
+  page = httpd.StaticPage(PAGE)
+
+  def fleet(request):
+    return httpd.response(json.dumps(store.snapshot()), "application/json", headers=[("Cache-Control", "no-store")])
+
+  return httpd.Router([("/fleet", fleet)], page.select)
+
+
+# -------------------------------------------------------------------------
+# Stand-in units
+
+class StandIn:
+  """A fake unit serving the board's /status and /events. Its status moves to the next stage
+  every `period_s` seconds (with some jitter) and starts over after the result."""
+
+  STAGES = ("Saturating", "Spraying", "Scanning")
+  COLOURS = ("blue", "red-pink", "yellow", "white", "pink")
+
+  def __init__(self, name, period_s=2.0, seed=None):
+    self.name = name
+    self.period_s = period_s
+    self.random = random.Random(seed)
+    self.board = status.StatusBoard()
+    self.events = httpd.EventSource(lambda: self.board.current, lambda s: s.payload)
+    self.router = httpd.Router([
+      ("/status", lambda r: self.board.respond(r.query(b"v") or r.header(b"If-None-Match"))),
+      ("/events", lambda r: self.events),
+    ], lambda r: httpd.response(self.name, "text/plain"))
+    self.server = None
+    self.tasks = []
+
+  async def start(self, host="127.0.0.1", port=0):
+    self.server = await httpd.start_async_server(self.router, port, TIMEOUT * 4, host, backlog=16)
+    self.tasks = [asyncio.ensure_future(self.run()), asyncio.ensure_future(self.events.watch())]
+    return self.server.sockets[0].getsockname()[1]
+
+  async def run(self):
+    while True:
+      for stage in self.STAGES:
+        self.board.publish(stage, None)
+        await asyncio.sleep(self.period_s * self.random.uniform(0.8, 1.2))
+      self.board.publish(self.random.choice(self.COLOURS), "on")
+      await asyncio.sleep(self.period_s * self.random.uniform(0.8, 1.2))
+
+  def stop(self):
+    for task in self.tasks:
+      task.cancel()
+    if self.server:
+      self.server.close()
+
+
+async def start_standins(count, host="127.0.0.1", base_port=0, period_s=2.0):
+  """Start `count` stand-in units. Returns (stand-ins, ports)."""
+  standins = [StandIn("unit-%d" % (i + 1), period_s, seed=i) for i in range(count)]
+  ports = []
+  for i, unit in enumerate(standins):
+    ports.append(await unit.start(host, base_port + i if base_port else 0))
+  return standins, ports
+
+
+def parse_address(text, default_port=80):
+  host, _, port = text.partition(":")
+  return host, int(port) if port else default_port
+
+
+async def collect(addresses, events=False, interval=INTERVAL, port=8000):
+  units = []
+  for address in addresses:
+    host, unit_port = parse_address(address)
+    units.append(Unit(address, host, unit_port))
+  store = FleetStore(units)
+  collectors(store, events, interval)
+  await httpd.start_async_server(dashboard(store), port)
+  print("fleet dashboard on http://localhost:%d/ for %d units" % (port, len(units)))
+  while True:
+    await asyncio.sleep(3600)
+
+
+async def serve_standins(count, base_port, period_s):
+  standins, ports = await start_standins(count, "0.0.0.0", base_port, period_s)
+  print("stand-ins on ports %d-%d" % (ports[0], ports[-1]))
+  while True:
+    await asyncio.sleep(3600)
+
+
+def main(argv=None):
+  p = argparse.ArgumentParser(description="Collect the status of many units into one dashboard")
+  sub = p.add_subparsers(dest="command", required=True)
+  c = sub.add_parser("collect", help="poll or subscribe to units and serve the fleet dashboard")
+  c.add_argument("units", nargs="+", help="host or host:port of each unit")
+  c.add_argument("--events", action="store_true", help="subscribe to /events instead of polling")
+  c.add_argument("--interval", type=float, default=INTERVAL)
+  c.add_argument("--port", type=int, default=8000)
+  s = sub.add_parser("standins", help="run local stand-in units")
+  s.add_argument("count", type=int)
+  s.add_argument("--base-port", type=int, default=9000)
+  s.add_argument("--period", type=float, default=2.0, help="seconds per stage")
+  args = p.parse_args(argv)
+  try:
+    if args.command == "collect":
+      asyncio.run(collect(args.units, args.events, args.interval, args.port))
+    else:
+      asyncio.run(serve_standins(args.count, args.base_port, args.period))
+  except KeyboardInterrupt:
+    pass
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,73 @@
+# Host-side reader for the sensor log (sensorlog.py).
+# Downloads /history from a running board into a file, then memory-maps the file as a NumPy
+# structured array with one row per record. Works the same on a log file copied off the
+# board's flash, since both hold the same packed records.
+#
+#   python -m tools.history fetch 192.168.4.1 run1.bin [--since N]
+#   python -m tools.history show run1.bin
+
+import argparse
+import sys
+import urllib.request
+
+import numpy as np
+
+import sensorlog
+
+# Must match sensorlog.FORMAT ("<IHHH"): little endian, packed, 10 bytes per record.
+RECORD_DTYPE = np.dtype([
+  ("ticks_ms", "<u4"),
+  ("thermistor", "<u2"),
+  ("light", "<u2"),
+  ("ir", "<u2"),
+])
+assert RECORD_DTYPE.itemsize == sensorlog.RECORD_SIZE
+
+
+def load(path):
+  """Memory-map a dumped log as a structured array (read only, nothing is copied)."""
+  return np.memmap(path, dtype=RECORD_DTYPE, mode="r")
+
+
+def fetch(host, path, since=0, append=False, timeout=10):
+  """Download /history?since= into `path`. Returns (first sequence number, records written)."""
+  url = "http://%s/history?since=%d" % (host, since)
+  written = 0
+  with urllib.request.urlopen(url, timeout=timeout) as r, open(path, "ab" if append else "wb") as f:
+    first = int(r.headers.get("X-First-Sequence", since))
+    while True:
+      chunk = r.read(64 * sensorlog.RECORD_SIZE)
+      if not chunk:
+        break
+      f.write(chunk)
+      written += len(chunk)
+  return first, written // sensorlog.RECORD_SIZE
+
+
+def main(argv=None):
+  p = argparse.ArgumentParser(description="Fetch and inspect the board's sensor log")
+  sub = p.add_subparsers(dest="command", required=True)
+  f = sub.add_parser("fetch", help="download /history from a board")
+  f.add_argument("host")
+  f.add_argument("path")
+  f.add_argument("--since", type=int, default=0)
+  f.add_argument("--append", action="store_true")
+  s = sub.add_parser("show", help="summarise a dumped log")
+  s.add_argument("path")
+  args = p.parse_args(argv)
+
+  if args.command == "fetch":
+    first, count = fetch(args.host, args.path, args.since, args.append)
+    print("records %d..%d -> %s (next --since %d)" % (first, first + count - 1, args.path, first + count))
+    return 0
+
+  log = load(args.path)
+  print("%d records, %.1f s" % (len(log), (log["ticks_ms"][-1] - log["ticks_ms"][0]) / 1000 if len(log) else 0))
+  for name in ("thermistor", "light", "ir"):
+    column = log[name]
+    print("  %-10s min %5d  mean %8.1f  max %5d" % (name, column.min(), column.mean(), column.max()))
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,216 @@
+# Load generator for the device web server: how many dashboards can it keep up with?
+# Every simulated browser loads the dashboard once and then polls /status every second with the
+# version it already has, as the page does when it cannot use /events, over one keep-alive
+# connection (reopened whenever the server closes it, as the blocking loop does after every
+# request). Next to the browsers, a burst of emergency stops (GET /?error) is sent every few
+# seconds. A request that fails, gets an error status or takes longer than --timeout counts
+# as an error.
+#
+#   python -m tools.loadtest 192.168.4.1 --browsers 1,5,10,20 [--duration 30] [--json out.json]
+#   python -m tools.loadtest local --mode blocking --browsers 1,5,10,20
+#
+# "local" runs chromatography.py on the simulated backend in a child process (so the server has
+# an interpreter of its own) and loads that instead of a board. The report is JSON: per number
+# of browsers, requests per second, p50/p95/p99 latency and the error rate, overall and per kind
+# of request. Keep the files from two runs to compare server changes.
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import socket
+import sys
+import time
+
+from tools.fleet import Client, parse_address
+
+POLL_S = 1.0 # the dashboard's /status polling interval
+TIMEOUT = 3.0 # seconds a request may take before it counts as failed
+STOP_EVERY_S = 10.0
+STOP_BURST = 5
+KINDS = ("page", "status", "stop")
+
+
+def percentile(sorted_samples, q):
+  if not sorted_samples:
+    return 0.0
+  return sorted_samples[min(len(sorted_samples) - 1, int(len(sorted_samples) * q))]
+
+
+class Tally:
+  """Latencies and errors per kind of request."""
+
+  def __init__(self):
+    self.latencies = {kind: [] for kind in KINDS}
+    self.errors = {kind: 0 for kind in KINDS}
+    self.timeouts = 0
+
+  def add(self, kind, seconds):
+    self.latencies[kind].append(seconds * 1000)
+
+  def fail(self, kind, timed_out=False):
+    self.errors[kind] += 1
+    if timed_out:
+      self.timeouts += 1
+
+  def report(self, wall_s):
+    def figures(latencies, errors):
+      latencies = sorted(latencies)
+      total = len(latencies) + errors
+      return {
+        "requests": total,
+        "requests_per_s": round(total / wall_s, 1),
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        "error_rate": round(errors / total, 4) if total else 0.0,
+      }
+    result = figures([ms for kind in KINDS for ms in self.latencies[kind]], sum(self.errors.values()))
+    result["timeouts"] = self.timeouts
+    for kind in KINDS:
+      result[kind] = figures(self.latencies[kind], self.errors[kind])
+    return result
+
+
+async def fetch(client, path, kind, tally, ok=(200, 304)):
+  """One request. Returns the body, or None if it failed."""
+  t0 = time.perf_counter()
+  try:
+    code, body = await client.get(path)
+  except asyncio.TimeoutError:
+    client.close()
+    tally.fail(kind, timed_out=True)
+    return None
+  except (OSError, ConnectionError, ValueError, asyncio.IncompleteReadError):
+    client.close()
+    tally.fail(kind)
+    return None
+  if code not in ok:
+    tally.fail(kind)
+    return None
+  tally.add(kind, time.perf_counter() - t0)
+  return body
+
+
+async def browser(host, port, tally, until, timeout):
+  client = Client(host, port, timeout)
+  loop = asyncio.get_running_loop()
+  await asyncio.sleep(random.uniform(0, POLL_S)) # browsers are not opened in step
+  await fetch(client, "/", "page", tally)
+  version = None
+  next_poll = loop.time()
+  while loop.time() < until:
+    body = await fetch(client, "/status" if version is None else "/status?v=%s" % version, "status", tally)
+    if body:
+      try:
+        version = json.loads(body).get("version", version)
+      except ValueError:
+        pass
+    next_poll += POLL_S
+    await asyncio.sleep(max(0.0, next_poll - loop.time()))
+  client.close()
+
+
+async def stopper(host, port, tally, until, timeout, every_s, burst):
+  client = Client(host, port, timeout)
+  loop = asyncio.get_running_loop()
+  while loop.time() + every_s < until:
+    await asyncio.sleep(every_s)
+    for _ in range(burst):
+      await fetch(client, "/?error", "stop", tally)
+  client.close()
+
+
+async def load(host, port, browsers, duration_s, timeout=TIMEOUT, stop_every_s=STOP_EVERY_S, stop_burst=STOP_BURST):
+  """Run `browsers` simulated browsers for `duration_s` seconds. Returns the report."""
+  tally = Tally()
+  loop = asyncio.get_running_loop()
+  t0 = loop.time()
+  until = t0 + duration_s
+  tasks = [browser(host, port, tally, until, timeout) for _ in range(browsers)]
+  if stop_burst:
+    tasks.append(stopper(host, port, tally, until, timeout, stop_every_s, stop_burst))
+  await asyncio.gather(*tasks)
+  report = {"browsers": browsers}
+  report.update(tally.report(loop.time() - t0))
+  return report
+
+
+# -------------------------------------------------------------------------
+# Local server on the simulated backend
+
+def serve_local(port, mode):
+  import io
+  sys.stdout = io.StringIO() # the blocking loop prints every connection
+  import sim
+  import chromatography as app
+  app.RESULTS_PATH = None # keep the journal off the disk
+  sim.feed(27, 6000) # paper in place, so the experiment runs as on the bench
+  sim.feed(26, sim.script((20, 30000), (1, 33000)))
+  sim.feed(28, 20000)
+  app.main(port, mode)
+
+
+def start_local(mode):
+  """Start chromatography.py in a child process. Returns (port, process)."""
+  with socket.socket() as s:
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+  server = multiprocessing.Process(target=serve_local, args=(port, mode), daemon=True)
+  server.start()
+  deadline = time.monotonic() + 10
+  while True:
+    try:
+      socket.create_connection(("127.0.0.1", port), 0.2).close()
+      return port, server
+    except OSError:
+      if time.monotonic() > deadline:
+        server.terminate()
+        raise
+      time.sleep(0.05)
+
+
+def main(argv=None):
+  p = argparse.ArgumentParser(description="Simulate many dashboards against the device web server")
+  p.add_argument("target", help="host or host:port of a board, or 'local' for the simulated one")
+  p.add_argument("--mode", choices=("async", "blocking"), default="async", help="server mode for 'local'")
+  p.add_argument("--browsers", default="1,5,10,20", help="comma separated numbers of browsers to try in turn")
+  p.add_argument("--duration", type=float, default=20.0, help="seconds per number of browsers")
+  p.add_argument("--timeout", type=float, default=TIMEOUT)
+  p.add_argument("--stop-every", type=float, default=STOP_EVERY_S, help="seconds between emergency stop bursts")
+  p.add_argument("--stop-burst", type=int, default=STOP_BURST, help="stops per burst; 0 sends none")
+  p.add_argument("--json", metavar="PATH", help="also write the report to a file")
+  args = p.parse_args(argv)
+
+  server = None
+  if args.target == "local":
+    host = "127.0.0.1"
+    port, server = start_local(args.mode)
+  else:
+    host, port = parse_address(args.target)
+  runs = []
+  try:
+    for browsers in [int(n) for n in args.browsers.split(",")]:
+      runs.append(asyncio.run(load(host, port, browsers, args.duration, args.timeout,
+                                   args.stop_every, args.stop_burst)))
+  finally:
+    if server:
+      server.terminate()
+  report = {
+    "target": args.target,
+    "mode": args.mode if server else None,
+    "duration_s": args.duration,
+    "timeout_s": args.timeout,
+    "runs": runs,
+  }
+  text = json.dumps(report, indent=2)
+  print(text)
+  if args.json:
+    with open(args.json, "w") as f:
+      f.write(text + "\n")
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
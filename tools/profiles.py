@@ -0,0 +1,210 @@
+# Vectorised spot detection for archived plate profiles.
+# Same analysis as platescan.find_peaks()/rf_values() on the board (invert, rolling-minimum
+# baseline, moving average, local maxima above a noise-based threshold, Rf), but on a whole
+# (profiles x bins) NumPy array at once, so thousands of archived profiles are reprocessed in
+# seconds.
+#
+#   python -m tools.profiles fetch 192.168.4.1 archive.jsonl     append the board's /profile
+#   python -m tools.profiles analyse archive.jsonl [--csv spots.csv]
+#   python -m tools.profiles bench [--profiles 5000 --bins 64]   NumPy versus the board's code,
+#                                                                 both against the known spots
+#
+# Archives are JSON lines as served by /profile ({"profile": [...], "spots": [...]}) or a .npy
+# array of shape (profiles, bins).
+
+import argparse
+import json
+import sys
+import time
+import urllib.request
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import platescan
+
+
+def load(path):
+  """Profiles from an archive as a (profiles, bins) integer array."""
+  if path.endswith(".npy"):
+    return np.load(path)
+  rows = []
+  with open(path) as f:
+    for line in f:
+      line = line.strip()
+      if line and line != "null":
+        rows.append(json.loads(line)["profile"])
+  return np.array(rows, dtype=np.int64)
+
+
+def fetch(host, path, timeout=10):
+  """Append the board's latest /profile to an archive. Returns False if there is none yet."""
+  with urllib.request.urlopen("http://%s/profile" % host, timeout=timeout) as r:
+    body = r.read().decode()
+  if body.strip() == "null":
+    return False
+  with open(path, "a") as f:
+    f.write(body.strip() + "\n")
+  return True
+
+
+def _window(x, width, fill):
+  """(profiles, bins, width) centred windows, padded with `fill` past both ends."""
+  half = width // 2
+  padded = np.pad(x, ((0, 0), (half, half)), constant_values=fill)
+  return sliding_window_view(padded, 2 * half + 1, axis=1)
+
+
+def find_peaks(profiles, smooth=3, baseline=15, min_height=300, snr=5, separation=2, invert=True):
+  """Vectorised platescan.find_peaks(). Returns (profile index, bin, height) arrays."""
+  x = np.asarray(profiles, dtype=np.int64)
+  if invert:
+    x = 65535 - x
+  # Rolling minimum; padding with the maximum value makes edge windows behave like the
+  # clipped windows on the board.
+  flat = x - _window(x, baseline, np.iinfo(np.int64).max).min(axis=2)
+  sums = _window(flat, smooth, 0).sum(axis=2)
+  counts = _window(np.ones_like(flat), smooth, 0).sum(axis=2)
+  smoothed = sums // counts
+  # Upper medians, as on the board.
+  middle = np.sort(smoothed, axis=1)[:, smoothed.shape[1] // 2, None]
+  noise = np.sort(np.abs(smoothed - middle), axis=1)[:, smoothed.shape[1] // 2, None] * 3 // 2
+  threshold = np.maximum(min_height, middle + snr * noise)
+  around = _window(smoothed, 2 * separation + 1, np.iinfo(np.int64).min)
+  left = around[:, :, :separation].max(axis=2)
+  right = around[:, :, separation + 1:].max(axis=2)
+  mid = smoothed[:, 1:-1]
+  is_peak = (mid >= threshold) & (mid > left[:, 1:-1]) & (mid >= right[:, 1:-1])
+  rows, cols = np.nonzero(is_peak)
+  cols = cols + 1
+  return rows, cols, smoothed[rows, cols]
+
+
+def rf_values(bins, nbins, origin=0, front=None):
+  if front is None:
+    front = nbins - 1
+  return np.round((bins - origin) / (front - origin), 3)
+
+
+def analyse(profiles, front=None, **options):
+  """Every spot of every profile as a structured array (profile, bin, height, rf)."""
+  rows, cols, heights = find_peaks(profiles, **options)
+  spots = np.empty(len(rows), dtype=[("profile", "<i4"), ("bin", "<i4"), ("height", "<i4"), ("rf", "<f4")])
+  spots["profile"] = rows
+  spots["bin"] = cols
+  spots["height"] = heights
+  spots["rf"] = rf_values(cols, np.shape(profiles)[1], front=front)
+  return spots
+
+
+def synthetic(count, bins, seed=0, spots=3):
+  """Profiles with up to `spots` spots each at random positions, plus noise and a sloped baseline.
+
+  Returns (profiles, centres, depths): the spots that were put in, as (count, spots) arrays of
+  positions in bins and depths in ADC counts (0 where a profile has fewer spots).
+  """
+  rng = np.random.default_rng(seed)
+  pos = np.linspace(0, 1, bins)
+  profiles = 40000 + rng.normal(0, 150, (count, bins)) - rng.uniform(0, 3000, (count, 1)) * pos
+  centres = np.zeros((count, spots))
+  depths = np.zeros((count, spots))
+  for k in range(spots):
+    centre = rng.uniform(0.1, 0.9, (count, 1))
+    depth = rng.uniform(0, 9000, (count, 1)) * (rng.random((count, 1)) < 0.8 if k else 1)
+    profiles -= depth * np.exp(-((pos - centre) / 0.03) ** 2)
+    centres[:, k] = centre[:, 0] * (bins - 1)
+    depths[:, k] = depth[:, 0]
+  return np.clip(profiles, 0, 65535).astype(np.int64), centres, depths
+
+
+def score(found, centres, depths, tolerance=2, detectable=2000):
+  """Detections against the spots that were put in.
+
+  `found` is a list of the detected bins per profile. A detection within `tolerance` bins of a
+  spot that is not yet taken counts as that spot; one near no spot is a false positive. Spots
+  at least `detectable` deep should all be found (recall); fainter ones may be missed, and
+  finding one is not an error.
+  """
+  detections = false = wanted = missed = 0
+  for bins, centre, depth in zip(found, centres, depths):
+    taken = [d <= 0 for d in depth]
+    for b in bins:
+      detections += 1
+      for k in range(len(centre)):
+        if not taken[k] and abs(b - centre[k]) <= tolerance:
+          taken[k] = True
+          break
+      else:
+        false += 1
+    for k in range(len(centre)):
+      if depth[k] >= detectable:
+        wanted += 1
+        missed += not taken[k]
+  return {
+    "detections": detections,
+    "false_positives": false,
+    "precision": round(1 - false / detections, 4) if detections else 1.0,
+    "recall": round(1 - missed / wanted, 4) if wanted else 1.0,
+  }
+
+
+def main(argv=None):
+  p = argparse.ArgumentParser(description="Spot detection for archived plate profiles")
+  sub = p.add_subparsers(dest="command", required=True)
+  f = sub.add_parser("fetch", help="append the board's latest /profile to an archive")
+  f.add_argument("host")
+  f.add_argument("path")
+  a = sub.add_parser("analyse", help="find the spots in every archived profile")
+  a.add_argument("path")
+  a.add_argument("--csv", help="write the spots to a CSV file")
+  b = sub.add_parser("bench", help="time the vectorised analysis against the board's code")
+  b.add_argument("--profiles", type=int, default=5000)
+  b.add_argument("--bins", type=int, default=64)
+  args = p.parse_args(argv)
+
+  if args.command == "fetch":
+    print("appended" if fetch(args.host, args.path) else "no profile yet")
+    return 0
+
+  if args.command == "analyse":
+    profiles = load(args.path)
+    spots = analyse(profiles)
+    print("%d profiles, %d spots" % (len(profiles), len(spots)))
+    if args.csv:
+      np.savetxt(args.csv, spots, delimiter=",", header="profile,bin,height,rf", comments="",
+                 fmt=("%d", "%d", "%d", "%.3f"))
+    return 0
+
+  profiles, centres, depths = synthetic(args.profiles, args.bins)
+  t0 = time.perf_counter()
+  spots = analyse(profiles)
+  vectorised = time.perf_counter() - t0
+  sample = profiles[:min(500, len(profiles))]
+  t0 = time.perf_counter()
+  reference = [platescan.analyse(list(row)) for row in sample]
+  scalar = (time.perf_counter() - t0) * len(profiles) / len(sample)
+  agree = True
+  for i, ref in enumerate(reference):
+    mine = spots[spots["profile"] == i]
+    agree &= [(s["bin"], s["rf"]) for s in ref] == [(int(b), round(float(r), 3)) for b, r in zip(mine["bin"], mine["rf"])]
+  found = [[] for _ in range(len(profiles))]
+  for p, b in zip(spots["profile"], spots["bin"]):
+    found[p].append(int(b))
+  blank, _, _ = synthetic(args.profiles, args.bins, seed=1, spots=0)
+  print(json.dumps({
+    "profiles": len(profiles),
+    "bins": args.bins,
+    "spots": int(len(spots)),
+    "numpy_s": vectorised,
+    "profiles_per_s": len(profiles) / vectorised,
+    "pure_python_s_estimate": scalar,
+    "matches_board_code": agree,
+    "spots_put_in": int((depths > 0).sum()),
+    "against_known_spots": score(found, centres, depths),
+    "spots_in_spot_free_profiles": int(len(analyse(blank))),
+  }, indent=2))
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,231 @@
+# Replays recorded experiments through the real experiment logic, faster than real time.
+# Each trace feeds the three ADC pins of the simulated backend while chromatography.py runs its
+# stage engine under the virtual clock, so every sleep and stage pause costs nothing and a run
+# that takes minutes on the bench replays in milliseconds. Traces are spread over a pool of
+# worker processes, each with its own copy of the simulated board.
+#
+#   python -m tools.replay run logs/*.bin [--workers 8] [--out results.jsonl]
+#   python -m tools.replay synthetic 5000 [--seed 1] [--workers 8] [--out results.jsonl]
+#
+# Per trace the result holds the virtual duration of every stage, the colour classified and
+# whether a stage timed out; the summary adds traces per second, stage timing statistics and
+# the colour counts. Synthetic traces know their true colour and solvent-front time, so their
+# summary also has the classification accuracy and the front detection delay.
+#
+# Recorded traces are sensor log dumps (tools/history.py fetch, or the log file off the flash),
+# or CSV files with columns seconds,thermistor,light,ir.
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import struct
+import sys
+import time
+
+import sensorlog
+import sim
+
+TRACE_HZ = 50 # sample rate of synthetic traces
+TICKS_PERIOD = 1 << 30 # ticks_ms on the board wraps here
+
+app = None # chromatography, imported once per worker
+
+
+def _init():
+  global app
+  with contextlib.redirect_stdout(io.StringIO()):
+    import chromatography
+  app = chromatography
+
+
+# -------------------------------------------------------------------------
+# Traces: (seconds, thermistor, light, ir) columns
+
+def load(path):
+  """A recorded trace as four lists: times in seconds from the first record, then the readings."""
+  times, thermistor, light, ir = [], [], [], []
+  if path.endswith(".csv"):
+    with open(path) as f:
+      for line in f:
+        try:
+          t, a, b, c = (float(x) for x in line.split(",")[:4])
+        except ValueError:
+          continue # header
+        times.append(t)
+        thermistor.append(int(a))
+        light.append(int(b))
+        ir.append(int(c))
+    return times, thermistor, light, ir
+  with open(path, "rb") as f:
+    data = f.read()
+  data = data[:len(data) - len(data) % sensorlog.RECORD_SIZE]
+  t = 0
+  last = None
+  for ticks, a, b, c in struct.iter_unpack(sensorlog.FORMAT, data):
+    if last is not None:
+      t += (ticks - last) % TICKS_PERIOD
+    last = ticks
+    times.append(t / 1000)
+    thermistor.append(a)
+    light.append(b)
+    ir.append(c)
+  return times, thermistor, light, ir
+
+
+def synthetic(seed):
+  """A made-up run with a known answer: (trace, expected colour, solvent front time in s)."""
+  rng = random.Random(seed)
+  edges = app.colour_edges
+  band = rng.randrange(1, len(edges)) # a band with a colour on both sides of it
+  level = (edges[band - 1] + edges[band]) // 2
+  spread = (edges[band] - edges[band - 1]) // 6
+  paper_at = rng.uniform(0.5, 5)
+  front_at = paper_at + rng.uniform(5, 60)
+  base = rng.randint(25000, 35000)
+  times, thermistor, light, ir = [], [], [], []
+  for i in range(int((front_at + 30) * TRACE_HZ)):
+    t = i / TRACE_HZ
+    times.append(t)
+    rise = 1500 * min(1.0, (t - front_at) / 0.5) if t >= front_at else 0
+    spike = rng.choice((-1, 1)) * rng.randint(800, 2000) if rng.random() < 0.01 else 0
+    thermistor.append(int(base + rng.gauss(0, 120) + rise + spike))
+    light.append(int(level + rng.gauss(0, spread)))
+    ir.append(6000 if t >= paper_at else 0)
+  return (times, thermistor, light, ir), app.colour_names[band], front_at
+
+
+# -------------------------------------------------------------------------
+# Replay
+
+def replay(trace):
+  """Run one experiment against a trace. Returns its result record."""
+  times, thermistor, light, ir = trace
+  sim.reset()
+  sim.clock.reset(virtual=True)
+  sim.feed(26, sim.Recorded(times, thermistor))
+  sim.feed(28, sim.Recorded(times, light))
+  sim.feed(27, sim.Recorded(times, ir))
+  app.light_intensity = ""
+  app.abort.clear()
+  cpu = time.process_time()
+  with contextlib.redirect_stdout(io.StringIO()):
+    engine = app.experiment_sequence()
+  stages = {}
+  ends = {}
+  for name, start_ms, duration_ms in engine.history:
+    stages[name] = duration_ms
+    ends[name] = start_ms + duration_ms
+  return {
+    "stages_ms": stages,
+    "ends_ms": ends,
+    "colour": app.light_intensity or None,
+    "timed_out": engine.timed_out,
+    "virtual_s": round(sim.clock.now(), 3),
+    "cpu_ms": round((time.process_time() - cpu) * 1000, 2),
+  }
+
+
+def run_file(path):
+  result = replay(load(path))
+  result["trace"] = path
+  return result
+
+
+def run_synthetic(seed):
+  trace, colour, front_at = synthetic(seed)
+  result = replay(trace)
+  result["trace"] = "synthetic-%d" % seed
+  result["expected"] = colour
+  saturated = result["ends_ms"].get("saturate")
+  result["front_delay_ms"] = round(saturated - front_at * 1000) if saturated is not None else None
+  return result
+
+
+def run_pool(fn, items, workers=None, out=None):
+  """Replay every item in a process pool. Returns (results, wall seconds)."""
+  workers = workers or os.cpu_count() or 1
+  items = list(items)
+  results = []
+  t0 = time.perf_counter()
+  with multiprocessing.Pool(workers, initializer=_init) as pool:
+    for result in pool.imap_unordered(fn, items, chunksize=max(1, len(items) // (workers * 8))):
+      results.append(result)
+      if out:
+        out.write(json.dumps(result) + "\n")
+  return results, time.perf_counter() - t0
+
+
+def summary(results, wall_s, workers):
+  """Totals over all replayed traces."""
+  per_stage = {}
+  colours = {}
+  for r in results:
+    for name, ms in r["stages_ms"].items():
+      per_stage.setdefault(name, []).append(ms)
+    colours[str(r["colour"])] = colours.get(str(r["colour"]), 0) + 1
+  stages = {}
+  for name, values in per_stage.items():
+    values.sort()
+    stages[name] = {
+      "mean_ms": round(statistics.fmean(values), 1),
+      "p95_ms": values[min(len(values) - 1, int(len(values) * 0.95))],
+      "max_ms": values[-1],
+    }
+  virtual = sum(r["virtual_s"] for r in results)
+  report = {
+    "traces": len(results),
+    "workers": workers,
+    "wall_s": round(wall_s, 3),
+    "traces_per_s": round(len(results) / wall_s, 1) if wall_s else 0.0,
+    "speedup_vs_real_time": round(virtual / wall_s, 1) if wall_s else 0.0,
+    "timed_out": sum(1 for r in results if r["timed_out"]),
+    "colours": colours,
+    "stages": stages,
+  }
+  known = [r for r in results if "expected" in r]
+  if known:
+    report["accuracy"] = round(sum(1 for r in known if r["colour"] == r["expected"]) / len(known), 4)
+    delays = sorted(r["front_delay_ms"] for r in known if r["front_delay_ms"] is not None)
+    if delays:
+      report["front_delay_ms"] = {
+        "median": statistics.median(delays),
+        "p95": delays[min(len(delays) - 1, int(len(delays) * 0.95))],
+        "missed": len(known) - len(delays),
+      }
+  return report
+
+
+def main(argv=None):
+  p = argparse.ArgumentParser(description="Replay recorded experiments under the virtual clock")
+  sub = p.add_subparsers(dest="command", required=True)
+  r = sub.add_parser("run", help="replay sensor log dumps or CSV traces")
+  r.add_argument("paths", nargs="+")
+  s = sub.add_parser("synthetic", help="replay made-up traces with known answers")
+  s.add_argument("count", type=int)
+  s.add_argument("--seed", type=int, default=1)
+  for q in (r, s):
+    q.add_argument("--workers", type=int, default=None, help="processes (default: one per CPU)")
+    q.add_argument("--out", help="write one JSON result per trace to this file")
+  args = p.parse_args(argv)
+
+  workers = args.workers or os.cpu_count() or 1
+  out = open(args.out, "w") if args.out else None
+  try:
+    if args.command == "run":
+      results, wall = run_pool(run_file, args.paths, workers, out)
+    else:
+      results, wall = run_pool(run_synthetic, range(args.seed, args.seed + args.count), workers, out)
+  finally:
+    if out:
+      out.close()
+  print(json.dumps(summary(results, wall, workers), indent=2))
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())